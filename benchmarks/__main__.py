@@ -0,0 +1,45 @@
+import argparse
+import asyncio
+import sys
+
+from benchmarks.cases import collect, teardown
+from benchmarks.harness import run_all
+
+
+def main(select=None, fmt='text', output=None, number=None, repeat=None):
+    # caches and streams grab the current loop on creation
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    benches = [b for b in collect() if not select or any(s in b.name for s in select)]
+    for bench in benches:
+        if number is not None:
+            bench.number = number
+        if repeat is not None:
+            bench.repeat = repeat
+
+    stream = open(output, 'w') if output else sys.stdout
+    try:
+        run_all(benches, stream, fmt=fmt, loop=loop)
+    finally:
+        if output:
+            stream.close()
+        loop.run_until_complete(teardown())
+        loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', '--select', action='append',
+                        help='Run only benchmarks whose name contains this substring')
+    parser.add_argument('--format', dest='fmt', default='text',
+                        choices=['text', 'json'], help='Output format')
+    parser.add_argument('-o', '--output', default=None,
+                        type=str, help='Write results to file instead of stdout')
+    parser.add_argument('-n', '--number', default=None,
+                        type=int, help='Override calls per repetition')
+    parser.add_argument('-r', '--repeat', default=None,
+                        type=int, help='Override number of repetitions')
+    args: argparse.Namespace = parser.parse_args()
+
+    main(**args.__dict__)
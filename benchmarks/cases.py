@@ -0,0 +1,229 @@
+import asyncio
+import atexit
+import os
+import tempfile
+
+from benchmarks.harness import Bench
+from yapas.core.abs.messages import RawHttpMessage, _StatusLine
+from yapas.core.cache.files import OpenFileCache
+from yapas.core.cache.mapped import MappedFileCache
+from yapas.core.cache.memory import TTLMemoryCache
+from yapas.core.client.socket import SocketClient
+from yapas.core.constants import OK
+from yapas.core.dispatcher import ProxyDispatcher
+
+REQUEST_LINE = b'GET /static/css/min.css?v=42 HTTP/1.1'
+RESPONSE_LINE = b'HTTP/1.1 200 OK'
+REQUEST_BYTES = (
+    b'GET /index HTTP/1.1\r\n'
+    b'Host: localhost:8079\r\n'
+    b'User-Agent: Mozilla/5.0 (X11; Linux x86_64)\r\n'
+    b'Accept: text/html,application/xhtml+xml\r\n'
+    b'Accept-Encoding: gzip, deflate, br\r\n'
+    b'Cookie: csrftoken=bls1lQLeouKcoK75fT8VShMlGrvVqt4m\r\n'
+    b'Connection: keep-alive\r\n'
+    b'\r\n'
+)
+BODY = b'x' * 16 * 1024
+
+DISPATCHER_SIZES = (10, 100, 1000)
+CACHE_SIZES = (10, 1000, 100_000)
+STATIC_SIZE = 1024 * 1024
+# responses of one call in flight at once, like slow clients downloading the same asset
+STATIC_IN_FLIGHT = 32
+# upstream requests of one call in flight at once
+CLIENT_IN_FLIGHT = 32
+
+# coroutine functions run by teardown(), e.g. closing backends started by the cases
+_teardowns = []
+
+
+class _NullWriter:
+    """StreamWriter stub which throws everything away."""
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    async def drain(self) -> None:
+        pass
+
+
+async def _noop_handler(request: RawHttpMessage) -> RawHttpMessage:
+    return request
+
+
+def parser_cases() -> list[Bench]:
+    """Status line and message parsing/serialization."""
+    response = RawHttpMessage(RESPONSE_LINE, headers=[[b'Content-Type', b'text/css']], body=BODY)
+    writer = _NullWriter()
+
+    def _raw_bytes():
+        # raw_bytes is a cached_property, drop the cached value to measure the build
+        response.__dict__.pop('raw_bytes', None)
+        return response.raw_bytes
+
+    async def _from_reader():
+        reader = asyncio.StreamReader()
+        reader.feed_data(REQUEST_BYTES)
+        reader.feed_eof()
+        return await RawHttpMessage.from_reader(reader)
+
+    return [
+        Bench('parser.status_line.request', lambda: _StatusLine.from_bytes(REQUEST_LINE)),
+        Bench('parser.status_line.response', lambda: _StatusLine.from_bytes(RESPONSE_LINE)),
+        Bench('parser.message.from_bytes',
+              lambda: RawHttpMessage.from_bytes(REQUEST_BYTES), is_async=True),
+        Bench('parser.message.from_reader', _from_reader, is_async=True),
+        Bench('parser.message.raw_bytes_16k', _raw_bytes),
+        Bench('parser.message.fill_16k', lambda: response.fill(writer), is_async=True),
+    ]
+
+
+def dispatcher_cases() -> list[Bench]:
+    """Location lookup with growing location tables."""
+    benches = []
+    for size in DISPATCHER_SIZES:
+        dispatcher = ProxyDispatcher()
+        for i in range(size):
+            dispatcher.add_location(f'/location_{i}/*', _noop_handler)
+
+        last = f'/location_{size - 1}/some/path'.encode()
+        benches.extend([
+            Bench(f'dispatcher.get_handler.first[{size}]',
+                  lambda d=dispatcher: d.get_handler(b'/location_0/'), is_async=True),
+            Bench(f'dispatcher.get_handler.last[{size}]',
+                  lambda d=dispatcher, p=last: d.get_handler(p), is_async=True),
+            Bench(f'dispatcher.get_handler.miss[{size}]',
+                  lambda d=dispatcher: d.get_handler(b'/missing'), is_async=True),
+        ])
+    return benches
+
+
+def cache_cases() -> list[Bench]:
+    """TTLMemoryCache get/set with different fill levels."""
+    benches = []
+    value = RawHttpMessage(OK, body=BODY)
+    for size in CACHE_SIZES:
+        cache = TTLMemoryCache()
+        for i in range(size):
+            cache.set(f'/static/{i}', value)
+
+        hit = f'/static/{size // 2}'
+        benches.extend([
+            Bench(f'cache.get.hit[{size}]', lambda c=cache, k=hit: c.get(k)),
+            Bench(f'cache.get.miss[{size}]', lambda c=cache: c.get('/static/missing')),
+            Bench(f'cache.set.existing[{size}]', lambda c=cache, k=hit: c.set(k, value)),
+        ])
+    return benches
+
+
+def static_cases() -> list[Bench]:
+    """Serving a mid-sized static file to concurrent clients: mapped slices vs reads into memory.
+
+    Every call builds STATIC_IN_FLIGHT responses and writes them, they stay alive
+    until the next call; rss shows the memory they hold, best/median the cost of a batch.
+    """
+    fd, path = tempfile.mkstemp(suffix='.js')
+    os.write(fd, os.urandom(STATIC_SIZE))
+    os.close(fd)
+    atexit.register(os.unlink, path)
+
+    files = OpenFileCache()
+    mapped = MappedFileCache(files)
+    request = RawHttpMessage(b'GET /static/app.js HTTP/1.1')
+    writer = _NullWriter()
+    held: list[RawHttpMessage] = []
+
+    async def _mapped():
+        for response in held:
+            response.body_lease.release()
+        held[:] = [await mapped.get(path, request) for _ in range(STATIC_IN_FLIGHT)]
+        for response in held:
+            await response.fill(writer)
+        return held
+
+    async def _read():
+        held[:] = [RawHttpMessage(OK, body=await files.read(path)) for _ in range(STATIC_IN_FLIGHT)]
+        for response in held:
+            await response.fill(writer)
+        return held
+
+    size = f'{STATIC_SIZE // 1024}k'
+    return [
+        Bench(f'static.mmap[{size} x{STATIC_IN_FLIGHT}]', _mapped, number=100, warmup=10, is_async=True),
+        Bench(f'static.read[{size} x{STATIC_IN_FLIGHT}]', _read, number=100, warmup=10, is_async=True),
+    ]
+
+
+async def _keepalive_backend(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Answer requests with BODY until the client closes or asks to."""
+    response = b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(BODY), BODY)
+    try:
+        while head := await reader.readuntil(b'\r\n\r\n'):
+            writer.write(response)
+            await writer.drain()
+            if b'connection: close' in head.lower():
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    writer.close()
+
+
+def client_cases() -> list[Bench]:
+    """Upstream requests to a local backend: a connection per request vs the pooled aiohttp session.
+
+    The socket client reads the response up to the connection close, the aiohttp
+    one reuses keep-alive connections. Skipped without aiohttp.
+    """
+    try:
+        from yapas.core.client.aiohttp import AIOHttpClient
+    except ImportError:
+        return []
+
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(_keepalive_backend, '127.0.0.1', 0))
+    _teardowns.append(server.wait_closed)
+    _teardowns.append(server.close)
+    url = 'http://127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+    pooled = AIOHttpClient(url)
+    _teardowns.append(pooled.close)
+
+    def _request() -> RawHttpMessage:
+        return RawHttpMessage(b'GET /index HTTP/1.1', headers=[[b'Host', b'localhost'], [b'Connection', b'close']])
+
+    async def _socket():
+        return await SocketClient(base_url=url).raw(_request())
+
+    async def _aiohttp():
+        return await pooled.raw(_request())
+
+    async def _concurrent(func):
+        return await asyncio.gather(*(func() for _ in range(CLIENT_IN_FLIGHT)))
+
+    size = f'{len(BODY) // 1024}k'
+    return [
+        Bench(f'client.socket[{size}]', _socket, number=1000, warmup=100, is_async=True),
+        Bench(f'client.aiohttp[{size}]', _aiohttp, number=1000, warmup=100, is_async=True),
+        Bench(f'client.socket[{size} x{CLIENT_IN_FLIGHT}]', lambda: _concurrent(_socket),
+              number=100, warmup=10, is_async=True),
+        Bench(f'client.aiohttp[{size} x{CLIENT_IN_FLIGHT}]', lambda: _concurrent(_aiohttp),
+              number=100, warmup=10, is_async=True),
+    ]
+
+
+async def teardown() -> None:
+    """Release what the cases hold open, in reverse order."""
+    while _teardowns:
+        if asyncio.iscoroutine(result := _teardowns.pop()()):
+            await result
+
+
+def collect() -> list[Bench]:
+    """Return all the benchmark cases."""
+    return [
+        *parser_cases(),
+        *dispatcher_cases(),
+        *cache_cases(),
+        *static_cases(),
+        *client_cases(),
+    ]
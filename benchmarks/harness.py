@@ -0,0 +1,192 @@
+import asyncio
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Callable, Any, Optional, TextIO
+
+# calls sampled for the resident memory of a case
+RSS_SAMPLES = 20
+
+
+def _rss_anon() -> int:
+    """Return anonymous resident memory of the process in bytes, 0 if unknown.
+
+    Page cache pages of mapped files are shared with the kernel and not counted.
+    """
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'RssAnon:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+@dataclass(slots=True)
+class BenchResult:
+    """Timings of a single benchmark.
+
+    Times and allocated blocks are per operation, alloc_peak is the peak of
+    traced memory in bytes during one repetition, rss_peak is the peak growth
+    of anonymous resident memory in bytes while the result of a call is alive.
+    """
+    name: str
+    number: int
+    repeat: int
+    best: float
+    median: float
+    mean: float
+    stdev: float
+    alloc_blocks: float
+    alloc_peak: float
+    rss_peak: float = 0.0
+
+    def as_text(self) -> str:
+        """Return a human-readable line."""
+        return (
+            f'{self.name:<48} best {self.best * 1e6:10.3f} us  '
+            f'median {self.median * 1e6:10.3f} us  '
+            f'stdev {self.stdev * 1e6:8.3f} us  '
+            f'blocks {self.alloc_blocks:8.2f}  peak {self.alloc_peak:10.0f} B  '
+            f'rss {self.rss_peak / 1024:8.0f} KiB'
+        )
+
+
+class Bench:
+    """A single benchmark case.
+
+    `func` is a zero-argument callable (or coroutine function) which is
+    called `number` times per repetition. Async cases are awaited inside one
+    coroutine per repetition, so the event loop overhead is paid once per batch.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        *,
+        number: int = 10_000,
+        repeat: int = 5,
+        warmup: int = 1_000,
+        is_async: bool = False,
+    ) -> None:
+        self.name = name
+        self._func = func
+        self.number = number
+        self.repeat = repeat
+        self._warmup = warmup
+        self._is_async = is_async
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _batch(self, n: int) -> float:
+        """Call the function n times and return elapsed time in seconds."""
+        func = self._func
+        if self._is_async:
+            async def _run():
+                start = time.perf_counter()
+                for _ in range(n):
+                    await func()
+                return time.perf_counter() - start
+
+            return self._loop.run_until_complete(_run())
+
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        return time.perf_counter() - start
+
+    def _rss(self) -> float:
+        """Return the peak growth of anonymous RSS over a few calls, sampled
+        after every call while its result is still referenced."""
+        func = self._func
+        n = min(self.number, RSS_SAMPLES)
+        baseline = _rss_anon()
+        samples = [baseline]
+        if self._is_async:
+            async def _run():
+                for _ in range(n):
+                    result = await func()  # noqa: F841, alive while sampling
+                    samples.append(_rss_anon())
+
+            self._loop.run_until_complete(_run())
+        else:
+            for _ in range(n):
+                result = func()  # noqa: F841
+                samples.append(_rss_anon())
+        return max(samples) - baseline
+
+    def _allocations(self) -> tuple[float, float]:
+        """Return net allocated blocks per operation and peak traced bytes."""
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            self._batch(self.number)
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+        return blocks / self.number, peak
+
+    def run(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> BenchResult:
+        """Warm up, run all the repetitions and return the result."""
+        self._loop = loop
+        # before the warm-up, memory it frees may stay in the heap and hide the growth
+        rss = self._rss()
+        if self._warmup:
+            self._batch(self._warmup)
+
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            timings = [self._batch(self.number) / self.number for _ in range(self.repeat)]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        blocks, peak = self._allocations()
+        return BenchResult(
+            name=self.name,
+            number=self.number,
+            repeat=self.repeat,
+            best=min(timings),
+            median=statistics.median(timings),
+            mean=statistics.fmean(timings),
+            stdev=statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            alloc_blocks=blocks,
+            alloc_peak=peak,
+            rss_peak=rss,
+        )
+
+
+def run_all(
+    benches: list[Bench],
+    output: TextIO,
+    fmt: str = 'text',
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+) -> list[BenchResult]:
+    """Run benchmarks one by one and write every result as soon as it is ready.
+
+    :param benches: benchmarks to run
+    :param output: stream to write results to
+    :param fmt: 'text' for humans, 'json' for one JSON object per line
+    :param loop: event loop for async cases, the current one by default
+    """
+    loop = loop or asyncio.get_event_loop()
+    results = []
+    for bench in benches:
+        result = bench.run(loop)
+        results.append(result)
+        if fmt == 'json':
+            output.write(json.dumps(asdict(result)) + '\n')
+        else:
+            output.write(result.as_text() + '\n')
+        output.flush()
+
+    return results
@@ -0,0 +1,61 @@
+import asyncio
+import io
+import json
+
+from benchmarks.cases import collect
+from benchmarks.harness import Bench, run_all
+
+
+def test_sync_and_async_cases():
+    calls = 0
+
+    def func():
+        nonlocal calls
+        calls += 1
+        return bytearray(64)
+
+    async def afunc():
+        return func()
+
+    loop = asyncio.new_event_loop()
+    try:
+        for bench in (Bench('sync', func, number=10, repeat=3, warmup=5),
+                      Bench('async', afunc, number=10, repeat=3, warmup=5, is_async=True)):
+            result = bench.run(loop)
+            assert (result.number, result.repeat) == (10, 3)
+            assert 0 < result.best <= result.median
+            assert result.alloc_peak > 0
+    finally:
+        loop.close()
+    # rss samples, warm-up, repetitions and the tracemalloc run, for both cases
+    assert calls == 2 * (10 + 5 + 3 * 10 + 10)
+
+
+def test_json_output():
+    output = io.StringIO()
+    loop = asyncio.new_event_loop()
+    try:
+        run_all([Bench('a', lambda: None, number=5, repeat=2, warmup=0),
+                 Bench('b', lambda: None, number=5, repeat=2, warmup=0)], output, fmt='json', loop=loop)
+    finally:
+        loop.close()
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [line['name'] for line in lines] == ['a', 'b']
+    assert {'best', 'median', 'mean', 'stdev', 'alloc_blocks', 'alloc_peak'} <= lines[0].keys()
+
+
+def test_hot_path_cases():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        names = [bench.name for bench in collect()]
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    for prefix in ('parser.status_line', 'parser.message.from_bytes', 'parser.message.from_reader',
+                   'parser.message.raw_bytes', 'parser.message.fill', 'cache.get.hit', 'cache.set'):
+        assert any(name.startswith(prefix) for name in names), prefix
+    for size in (10, 100, 1000):
+        assert f'dispatcher.get_handler.last[{size}]' in names
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.disk import DiskCache
+from yapas.core.cache.memory import TTLMemoryCache
+from yapas.core.cache.proxy import ProxyCache
+from yapas.core.cache.tiered import TieredCache
+
+KEY = (b'GET', b'localhost', b'/api/items?page=2')
+
+
+def _response(body=b'[1, 2, 3]'):
+    return RawHttpMessage(b'HTTP/1.1 200 OK', headers=[[b'Content-Length', b'%d' % len(body)]], body=body)
+
+
+async def _written(cache):
+    await asyncio.gather(*cache._tasks)
+
+
+def test_entries_survive_restarts(tmp_path):
+    async def main():
+        cache = DiskCache(str(tmp_path))
+        cache.set(KEY, _response(), timeout=60)
+        cache.set((KEY, b'Vary'), (b'Accept-Encoding',), timeout=60)
+        await _written(cache)
+
+        digest = cache._digest(repr(KEY).encode())
+        assert os.path.exists(tmp_path / digest[-1] / digest[-3:-1] / digest)
+        assert cache.size == sum(entry.size for entry in cache._index.values())
+
+        # a new process finds the files before and after the index is rebuilt
+        restarted = DiskCache(str(tmp_path))
+        assert await restarted.get((KEY, b'Vary')) == (b'Accept-Encoding',)
+        await restarted.startup()
+        await asyncio.sleep(0.1)
+        assert restarted._indexed and len(restarted) == 2
+        assert await restarted.get((b'GET', b'localhost', b'/missing')) is None
+
+        response, ttl = await restarted.lookup(KEY)
+        assert 0 < ttl <= 60
+        assert response.get_header_value(b'Content-Length') == b'9'
+        assert response._body == b''
+        body = response.body_file
+        body.file.seek(body.offset)
+        assert body.file.read(body.count) == b'[1, 2, 3]'
+        body.release()
+        await restarted.cleanup()
+
+    asyncio.run(main())
+    assert os.listdir(tmp_path / 'tmp') == []
+
+
+def test_expired_and_over_size_entries(tmp_path):
+    async def main():
+        cache = DiskCache(str(tmp_path), max_size=3000)
+        cache.set(KEY, _response(), timeout=-1)
+        for i in range(5):
+            cache.set(f'/static/{i}', b'x' * 1000)
+            await _written(cache)
+        assert await cache.get(KEY) is None
+
+        await cache.get('/static/0')
+        assert await cache.evict() == 4
+        assert cache.size <= 3000
+        assert await cache.get('/static/0') == b'x' * 1000
+        assert await cache.get('/static/4') == b'x' * 1000
+        assert await cache.get('/static/1') is None
+
+    asyncio.run(main())
+
+
+def test_disk_tier_is_read_off_the_loop(tmp_path, monkeypatch):
+    async def main():
+        disk = DiskCache(str(tmp_path))
+        request = RawHttpMessage(b'GET /page HTTP/1.1', headers=[[b'Host', b'localhost']])
+        key = (b'GET', b'localhost', b'/page')
+        headers = [[b'Cache-Control', b'max-age=5, stale-if-error=60']]
+        ProxyCache(disk).set(key, request, RawHttpMessage(b'HTTP/1.1 200 OK', headers=headers, body=b'x'))
+        await _written(disk)
+
+        opened = []
+        read = DiskCache._open
+
+        def _open(path, key, now):
+            opened.append(found := read(path, key, now))
+            return found
+
+        monkeypatch.setattr(DiskCache, '_open', staticmethod(_open))
+        tiered = TieredCache('test_disk', TTLMemoryCache(update_on_get=False), [('disk', disk)])
+        # only aget looks at the disk
+        assert tiered.get((key, b'Vary')) is None
+        cache = ProxyCache(tiered)
+        assert (await cache.get(key, request)).body_file is opened[-1][0].body_file
+
+        # a stale response is not served, its file is closed
+        now = time.time()
+        monkeypatch.setattr(time, 'time', lambda: now + 8)
+        assert await cache.get(key, request) is None
+        assert opened[-1][0].body_file.file.closed
+
+        entry = await cache.lookup(key, request)
+        assert not entry.fresh and entry.usable_on_error
+        entry.release()
+        assert entry.response.body_file.file.closed
+
+    asyncio.run(main())
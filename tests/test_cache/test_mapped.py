@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.files import OpenFileCache
+from yapas.core.cache.mapped import MappedFileCache, parse_range
+
+
+def _request(*headers):
+    return RawHttpMessage(b'GET / HTTP/1.1', headers=[list(header) for header in headers])
+
+
+@pytest.mark.parametrize('value, expected', [
+    (b'bytes=0-99', (0, 100)),
+    (b'bytes=100-', (100, 1000)),
+    (b'bytes=-100', (900, 1000)),
+    (b'bytes=-5000', (0, 1000)),
+    (b'bytes=900-5000', (900, 1000)),
+    (b'bytes=0-1,5-6', None),
+    (b'bytes=5-1', None),
+    (b'items=0-1', None),
+    (b'bytes=a-b', None),
+])
+def test_parse_range(value, expected):
+    assert parse_range(value, 1000) == expected
+
+
+@pytest.mark.parametrize('value', [b'bytes=1000-', b'bytes=-0'])
+def test_parse_range_not_satisfiable(value):
+    with pytest.raises(ValueError):
+        parse_range(value, 1000)
+
+
+def test_full_and_range_responses(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(bytes(range(256)) * 40)
+    files = OpenFileCache()
+    mapped = MappedFileCache(files, min_size=1024)
+
+    async def main():
+        assert await mapped.get(str(tmp_path / 'missing.js'), _request()) is None
+
+        full = await mapped.get(str(path), _request())
+        assert full.info.status == b'200'
+        assert isinstance(full._body, memoryview)
+        assert full._body == path.read_bytes()
+        assert full.get_header_value(b'Content-Length') == b'10240'
+        etag = full.get_header_value(b'ETag')
+
+        partial = await mapped.get(str(path), _request((b'Range', b'bytes=256-511')))
+        assert partial.info.status == b'206'
+        assert partial._body == bytes(range(256))
+        assert partial.get_header_value(b'Content-Range') == b'bytes 256-511/10240'
+
+        stale = await mapped.get(str(path), _request((b'Range', b'bytes=0-9'), (b'If-Range', b'"old"')))
+        assert stale.info.status == b'200'
+
+        outside = await mapped.get(str(path), _request((b'Range', b'bytes=20000-')))
+        assert outside.info.status == b'416'
+        assert outside.get_header_value(b'Content-Range') == b'bytes */10240'
+
+        not_modified = await mapped.get(str(path), _request((b'If-None-Match', etag)))
+        assert not_modified.info.status == b'304'
+
+        for response in (full, partial, stale):
+            response.body_lease.release()
+
+    asyncio.run(main())
+    files.clear()
+
+
+def test_evicted_mapping_lives_until_released(tmp_path):
+    first, second = tmp_path / 'a.js', tmp_path / 'b.js'
+    first.write_bytes(b'a' * 4096)
+    second.write_bytes(b'b' * 4096)
+    files = OpenFileCache()
+    mapped = MappedFileCache(files, min_size=1024, max_mapped=4096)
+
+    async def main():
+        response = await mapped.get(str(first), _request())
+        await mapped.get(str(second), _request())
+        assert len(mapped) == 1
+
+        # evicted while being written, the body is still readable
+        file = response.body_lease._file
+        assert file.evicted and file.refs == 1
+        assert response._body == b'a' * 4096
+
+        response.body_lease.release()
+        response.body_lease.release()
+        assert file.refs == 0
+        assert file._map is None
+        with pytest.raises(ValueError):
+            bytes(response._body)
+
+    asyncio.run(main())
+    mapped.clear()
+    files.clear()
+
+
+def test_file_changed_in_place_is_remapped(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(b'a' * 4096)
+    files = OpenFileCache()
+    mapped = MappedFileCache(files, min_size=1024)
+
+    async def main():
+        response = await mapped.get(str(path), _request())
+        response.body_lease.release()
+        old = mapped._mapped[str(path)]
+
+        # truncated in place, the open file cache still has the old size
+        with open(path, 'r+b') as f:
+            f.truncate(2048)
+            f.seek(0)
+            f.write(b'b' * 2048)
+        assert (await files.open(str(path))).size == 4096
+
+        response = await mapped.get(str(path), _request())
+        assert response._body == b'b' * 2048
+        assert response.get_header_value(b'Content-Length') == b'2048'
+        assert old._map is None
+        assert (await files.open(str(path))).size == 2048
+        response.body_lease.release()
+
+    asyncio.run(main())
+    mapped.clear()
+    files.clear()
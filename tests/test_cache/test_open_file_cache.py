@@ -0,0 +1,119 @@
+import asyncio
+import threading
+
+import pytest
+
+from yapas.core.cache import files as files_module
+from yapas.core.cache.files import OpenFileCache
+from yapas.core.exceptions import NotFoundError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(files_module, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def syscalls(monkeypatch):
+    calls = []
+    for name in ('_open', '_stat'):
+        func = getattr(files_module, name)
+        monkeypatch.setattr(files_module, name, lambda *args, _f=func, _n=name: calls.append(_n) or _f(*args))
+    return calls
+
+
+def test_hits_do_not_touch_the_filesystem(tmp_path, clock, syscalls):
+    path = tmp_path / 'a.css'
+    path.write_bytes(b'body {}')
+    files = OpenFileCache(valid=10)
+
+    async def main():
+        assert await files.read(str(path)) == b'body {}'
+        assert await files.read(str(path)) == b'body {}'
+        assert syscalls == ['_open']
+
+        # revalidated after `valid`, reopened if changed
+        clock.now += 10
+        path.write_bytes(b'body { color: red }')
+        assert await files.read(str(path)) == b'body { color: red }'
+        assert syscalls == ['_open', '_stat', '_open']
+
+    asyncio.run(main())
+    files.clear()
+
+
+def test_negative_results_are_cached(tmp_path, clock, syscalls):
+    files = OpenFileCache(valid=10)
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(NotFoundError):
+                await files.read(str(tmp_path / 'missing.js'))
+        with pytest.raises(NotFoundError):
+            await files.read(str(tmp_path))
+
+    asyncio.run(main())
+    assert syscalls == ['_open', '_open']
+
+
+def test_size_is_bounded_and_inactive_entries_are_closed(tmp_path, clock):
+    paths = []
+    for name in 'abc':
+        paths.append(path := tmp_path / name)
+        path.write_bytes(name.encode())
+    files = OpenFileCache(max_size=2, inactive=20)
+
+    async def main():
+        for path in paths:
+            await files.read(str(path))
+        assert len(files) == 2
+        assert str(paths[0]) not in files._entries
+
+        entry = files._entries[str(paths[2])]
+        clock.now += 20
+        await files.read(str(paths[1]))
+        assert len(files) == 1
+        assert entry.fd is None
+
+    asyncio.run(main())
+    files.clear()
+
+
+def test_entry_replaced_during_revalidation(tmp_path, clock, syscalls, monkeypatch):
+    path = tmp_path / 'a.css'
+    path.write_bytes(b'body {}')
+    files = OpenFileCache(valid=10)
+    stat, proceed = files_module._stat, threading.Event()
+    monkeypatch.setattr(files_module, '_stat', lambda *args: proceed.wait(1) and stat(*args))
+
+    async def main():
+        await files.read(str(path))
+        entry = files._entries[str(path)]
+
+        clock.now += 10
+        read = asyncio.ensure_future(files.read(str(path)))
+        await asyncio.sleep(0.05)
+        # reopened by another request while the stat runs in the file I/O pool
+        files.invalidate(str(path))
+        assert await files.read(str(path)) == b'body {}'
+        current = files._entries[str(path)]
+        proceed.set()
+
+        # the newer entry is kept open and used
+        assert await read == b'body {}'
+        assert entry.fd is None
+        assert files._entries[str(path)] is current and current.fd is not None
+        assert syscalls == ['_open', '_open', '_stat']
+
+    asyncio.run(main())
+    files.clear()
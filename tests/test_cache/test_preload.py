@@ -0,0 +1,35 @@
+import asyncio
+import gzip
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.preload import StaticPreload
+
+
+def _request(*headers):
+    return RawHttpMessage(b'GET / HTTP/1.1', headers=[list(header) for header in headers])
+
+
+def test_preload_budget_validators_and_variants(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'app.css').write_bytes(b'body { margin: 0 }\n' * 100)
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG' * 10)
+    (tmp_path / 'big.js').write_bytes(b'x' * 5000)
+    preload = StaticPreload(str(tmp_path), max_file_size=4000, memory=2500)
+
+    report = asyncio.run(preload.load())
+    assert (report.files, report.gzipped, report.too_large) == (2, 1, 1)
+    assert report.size <= 2500
+
+    css = str(tmp_path / 'css' / 'app.css')
+    plain = preload.get(css, _request())
+    assert plain.info.status == b'200'
+    etag = plain.get_header_value(b'ETag')
+
+    gzipped = preload.get(css, _request((b'Accept-Encoding', b'gzip, deflate')))
+    assert gzipped.get_header_value(b'Content-Encoding') == b'gzip'
+    assert gzip.decompress(gzipped._body) == b'body { margin: 0 }\n' * 100
+
+    assert preload.get(css, _request((b'If-None-Match', etag))).info.status == b'304'
+    assert preload.get(str(tmp_path / 'big.js'), _request()) is None
+    # responses are copies, the preloaded ones stay untouched
+    assert plain is not preload.get(css, _request())
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import pytest
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.memory import TTLMemoryCache
+from yapas.core.cache.proxy import ProxyCache, CacheControl
+
+
+@pytest.fixture
+def cache():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield ProxyCache(TTLMemoryCache(update_on_get=False))
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def _run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def _request(method=b'GET', path=b'/page', headers=None):
+    return RawHttpMessage(b'%s %s HTTP/1.1' % (method, path),
+                          headers=[[b'Host', b'example.com'], *(headers or [])])
+
+
+def _response(*headers):
+    return RawHttpMessage(b'HTTP/1.1 200 OK', headers=list(headers), body=b'hello')
+
+
+def test_cache_control_parsing():
+    cc = CacheControl.from_header(b'public, Max-Age=60, s-maxage="30", no-cache')
+    assert cc.public and cc.no_cache and not cc.no_store
+    assert cc.max_age == 60
+    assert cc.s_maxage == 30
+
+
+def test_store_and_hit(cache):
+    request = _request()
+    key = cache.make_key(request)
+    assert _run(cache.get(key, request)) is None
+
+    assert cache.set(key, request, _response([b'Cache-Control', b'max-age=60']))
+    cached = _run(cache.get(key, _request()))
+    assert cached is not None and cached.get_header_value(b'X-Cache-Status') == b'HIT'
+    assert (cache.hits, cache.misses, cache.bypass) == (1, 1, 0)
+
+
+@pytest.mark.parametrize('header', [
+    [b'Cache-Control', b'private, max-age=60'],
+    [b'Cache-Control', b'no-store'],
+    [b'Set-Cookie', b'sessionid=1'],
+    [b'Vary', b'*'],
+])
+def test_not_stored(cache, header):
+    request = _request()
+    response = _response([b'Cache-Control', b'max-age=60'], header)
+    assert not cache.set(cache.make_key(request), request, response)
+
+
+def test_bypass(cache):
+    assert cache.make_key(_request(method=b'POST')) is None
+    assert cache.make_key(_request(headers=[[b'Authorization', b'Basic x']])) is None
+    assert cache.bypass == 2
+
+
+def test_vary(cache):
+    gzip = _request(headers=[[b'Accept-Encoding', b'gzip']])
+    key = cache.make_key(gzip)
+    cache.set(key, gzip, _response([b'Cache-Control', b'max-age=60'], [b'Vary', b'Accept-Encoding']))
+
+    assert _run(cache.get(key, _request(headers=[[b'Accept-Encoding', b'br']]))) is None
+    assert _run(cache.get(key, _request(headers=[[b'Accept-Encoding', b'gzip']]))) is not None
+
+
+def test_stale_responses(cache, monkeypatch):
+    request = _request()
+    key = cache.make_key(request)
+    now = time.time()
+    cache_control = b'max-age=5, stale-while-revalidate=10, stale-if-error=60'
+    assert cache.set(key, request, _response([b'Cache-Control', cache_control]))
+
+    # the storage keeps the response after it went stale, ages come from its Date
+    monkeypatch.setattr(time, 'time', lambda: now + 8)
+    entry = _run(cache.lookup(key, request))
+    assert not entry.fresh and entry.revalidating and entry.usable_on_error
+    assert _run(cache.get(key, request)) is None
+    response = cache.respond(entry, b'UPDATING')
+    assert response.get_header_value(b'X-Cache-Status') == b'UPDATING'
+    assert response.get_header_value(b'Age') == b'8'
+
+    monkeypatch.setattr(time, 'time', lambda: now + 30)
+    entry = _run(cache.lookup(key, request))
+    assert not entry.revalidating and entry.usable_on_error
+
+
+def test_stale_grace_defaults():
+    cache = ProxyCache(None, stale_while_revalidate=10, stale_if_error=20)
+    assert cache._grace(CacheControl.from_header(b'max-age=5')) == (10, 20)
+    assert cache._grace(CacheControl.from_header(b'max-age=5, stale-if-error=60')) == (10, 60)
+    # must-revalidate disables the defaults, not the extensions of the response
+    assert cache._grace(CacheControl.from_header(b'max-age=5, proxy-revalidate, stale-if-error=60')) == (0, 60)
+
+
+def test_cleanup_cancels_background_updates(cache, monkeypatch):
+    request = _request()
+    key = cache.make_key(request)
+    now = time.time()
+    assert cache.set(key, request, _response([b'Cache-Control', b'max-age=5, stale-while-revalidate=10']))
+    monkeypatch.setattr(time, 'time', lambda: now + 8)
+    entry = _run(cache.lookup(key, request))
+    assert entry.revalidating
+
+    cache.revalidate(entry, asyncio.Event().wait)
+    assert len(cache._updating) == 1
+    _run(cache.cleanup())
+    assert not cache._updating
+
+
+def test_connection_header_is_not_stored(cache):
+    request = _request()
+    key = cache.make_key(request)
+    assert cache.set(key, request, _response([b'Cache-Control', b'max-age=60'], [b'Connection', b'keep-alive']))
+    assert not _run(cache.get(key, request)).has_header(b'Connection')
+
+
+def test_header_names_are_case_insensitive(cache):
+    request = _request()
+    key = cache.make_key(request)
+    # e.g. an ASGI server behind the proxy
+    assert not cache.set(key, request, _response([b'cache-control', b'max-age=60'], [b'set-cookie', b'sessionid=alice']))
+    assert not cache.set(key, request, _response([b'cache-control', b'private, max-age=60']))
+    assert cache.make_key(_request(headers=[[b'authorization', b'Basic x']])) is None
+    assert cache.make_key(_request(headers=[[b'cache-control', b'no-store']])) is None
+
+    gzip = _request(headers=[[b'accept-encoding', b'gzip']])
+    assert cache.set(key, gzip, _response([b'cache-control', b'max-age=60'], [b'vary', b'Accept-Encoding']))
+    assert _run(cache.get(key, _request(headers=[[b'Accept-Encoding', b'br']]))) is None
+    cached = _run(cache.get(key, _request(headers=[[b'ACCEPT-ENCODING', b'gzip']])))
+    assert cached is not None and cached.get_header_value(b'Cache-Control') == b'max-age=60'
@@ -0,0 +1,102 @@
+import pathlib
+import subprocess
+import sys
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.codec import encode_key
+from yapas.core.cache.shared import SharedMemoryCache, _SHARD
+from yapas.core.cache.tiered import TieredCache
+from yapas.core.stats import stats
+
+
+class DictCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+    def touch(self, key):
+        return key in self.values
+
+
+STORE = """
+import sys
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.shared import SharedMemoryCache
+
+cache = SharedMemoryCache('test', size=64 * 1024, shards=2, directory=sys.argv[1])
+response = RawHttpMessage(b'HTTP/1.1 200 OK', headers=[[b'ETag', b'"1"']], body=b'a\\r\\n\\r\\nb')
+cache.set(((b'GET', b'localhost', b'/app.js'), b'Vary'), (b'Accept-Encoding',))
+cache.set((b'GET', b'localhost', b'/app.js'), response, timeout=30)
+"""
+
+
+def test_entries_are_shared_between_processes(tmp_path):
+    root = pathlib.Path(__file__).parent.parent.parent
+    subprocess.run([sys.executable, '-c', STORE, str(tmp_path)], cwd=root, check=True)
+
+    cache = SharedMemoryCache('test', size=64 * 1024, shards=2, directory=str(tmp_path))
+    assert cache.get(((b'GET', b'localhost', b'/app.js'), b'Vary')) == (b'Accept-Encoding',)
+
+    response, ttl = cache.lookup((b'GET', b'localhost', b'/app.js'))
+    assert 0 < ttl <= 30
+    assert response.info.status == b'200'
+    assert response.get_header_value(b'ETag') == b'"1"'
+    assert response._body == b'a\r\n\r\nb'
+    assert cache.get('missing') is None
+    cache.close()
+
+
+def test_the_arena_is_bounded(tmp_path):
+    cache = SharedMemoryCache('test', size=64 * 1024, shards=2, directory=str(tmp_path))
+    for i in range(200):
+        cache.set(f'/static/{i}', b'x' * 1000)
+
+    assert cache.get('/static/0') is None
+    assert cache.get('/static/199') == b'x' * 1000
+    # records over a half of a shard are not stored
+    cache.set('/static/large', b'x' * 20000)
+    assert cache.get('/static/large') is None
+
+    cache.set('/static/expired', b'x', timeout=-1)
+    assert cache.get('/static/expired') is None
+    cache.close()
+
+
+def test_shard_recovers_from_a_crashed_writer(tmp_path):
+    cache = SharedMemoryCache('test', size=64 * 1024, shards=1, directory=str(tmp_path))
+    cache.set('/static/a', b'a')
+    _, shard = cache._locate(encode_key('/static/a'))
+
+    # a writer died in the shard, the counter is left odd
+    seq, written = _SHARD.unpack_from(cache._map, shard)
+    _SHARD.pack_into(cache._map, shard, seq + 1, written)
+    assert cache.get('/static/a') is None
+
+    # the next write makes it even again
+    cache.set('/static/b', b'b')
+    assert _SHARD.unpack_from(cache._map, shard)[0] % 2 == 0
+    assert cache.get('/static/a') == b'a'
+    assert cache.get('/static/b') == b'b'
+    cache.close()
+
+
+def test_lower_tier_hits_fill_the_memory_tier(tmp_path):
+    shared = SharedMemoryCache('test', directory=str(tmp_path))
+    shared.set('/app.js', b'body')
+    memory = DictCache()
+    cache = TieredCache('test_cache', memory, [('shared', shared)])
+    before = dict(stats.counters)
+
+    assert cache.get('/app.js') == b'body'
+    assert memory.values == {'/app.js': b'body'}
+    assert cache.get('/app.js') == b'body'
+    assert cache.get('/missing.js') is None
+
+    hits = {name: stats.counters[name] - before.get(name, 0) for name in stats.counters if name.startswith('test_cache')}
+    assert hits == {'test_cache.memory.hits': 1, 'test_cache.shared.hits': 1, 'test_cache.misses': 1}
+    shared.close()
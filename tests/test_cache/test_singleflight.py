@@ -0,0 +1,49 @@
+import asyncio
+
+from yapas.core.cache.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_result():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return object()
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('key', work) for _ in range(10)))
+        assert len({id(r) for r in results}) == 1
+        assert flight.shared == 9
+
+        # the key is released once the call is done
+        await flight.do('key', work)
+
+    asyncio.run(main())
+    assert calls == 2
+
+
+def test_exception_is_shared_and_leader_cancel_is_isolated():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise KeyError('boom')
+
+    async def slow():
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('a', fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, KeyError) for r in results)
+
+        leader = asyncio.ensure_future(flight.do('b', slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do('b', slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await waiter == 42
+
+    asyncio.run(main())
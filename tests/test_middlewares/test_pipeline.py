@@ -0,0 +1,64 @@
+import asyncio
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.abs.middleware import AbstractMiddleware
+from yapas.core.middlewares.pipeline import MiddlewarePipeline
+
+
+class Recorder(AbstractMiddleware):
+    def __init__(self, name, calls, short_circuit=False):
+        self.name = name
+        self.calls = calls
+        self.short_circuit = short_circuit
+
+    async def process_request(self, request):
+        self.calls.append(f'{self.name}.request')
+        if self.short_circuit:
+            return RawHttpMessage(b'HTTP/1.1 429 Too Many Requests')
+
+    async def process_response(self, request, response):
+        self.calls.append(f'{self.name}.response')
+        response.add_header(b'X-Seen', self.name.encode())
+        return response
+
+
+class ResponseOnly(AbstractMiddleware):
+    async def process_response(self, request, response):
+        return response
+
+
+def _request():
+    return RawHttpMessage(b'GET / HTTP/1.1')
+
+
+def test_hooks_order():
+    calls = []
+
+    async def handler(request):
+        calls.append('handler')
+        return RawHttpMessage(b'HTTP/1.1 200 OK')
+
+    pipeline = MiddlewarePipeline([Recorder('a', calls), Recorder('b', calls)])
+    response = asyncio.run(pipeline(_request(), handler))
+
+    assert calls == ['a.request', 'b.request', 'handler', 'b.response', 'a.response']
+    assert response.get_header_value(b'X-Seen') == b'a'
+
+
+def test_short_circuit_skips_handler_and_runs_response_hooks():
+    calls = []
+
+    async def handler(request):
+        raise AssertionError('handler must not be called')
+
+    pipeline = MiddlewarePipeline([Recorder('a', calls), Recorder('b', calls, short_circuit=True)])
+    response = asyncio.run(pipeline(_request(), handler))
+
+    assert response.info.status == b'429'
+    assert calls == ['a.request', 'b.request', 'b.response', 'a.response']
+
+
+def test_only_overridden_hooks_are_compiled():
+    pipeline = MiddlewarePipeline([ResponseOnly()])
+    assert pipeline._request_hooks == ()
+    assert len(pipeline._response_hooks) == 1
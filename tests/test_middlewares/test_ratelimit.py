@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.exceptions import ImproperlyConfigured
+from yapas.core.middlewares import ratelimit
+from yapas.core.middlewares.ratelimit import RateLimitMiddleware, parse_rate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+def _request(addr='10.0.0.1', location=b'/*'):
+    request = RawHttpMessage(b'GET / HTTP/1.1')
+    request.remote_addr = addr
+    request.location = location
+    return request
+
+
+def test_parse_rate():
+    assert parse_rate('10r/s') == 10
+    assert parse_rate('30r/m') == 0.5
+    with pytest.raises(ImproperlyConfigured):
+        parse_rate('10/s')
+    with pytest.raises(ImproperlyConfigured):
+        parse_rate('0r/s')
+
+
+def test_nodelay_burst_then_reject(clock):
+    limiter = RateLimitMiddleware(rate=1, burst=2, nodelay=True)
+    delays = [limiter._take(('a', b'/*')) for _ in range(4)]
+    assert delays == [0, 0, 0, None]
+
+    # other clients and locations have their own buckets
+    assert limiter._take(('b', b'/*')) == 0
+    assert limiter._take(('a', b'/static/*')) == 0
+
+    clock.now += 1
+    assert limiter._take(('a', b'/*')) == 0
+    assert limiter._take(('a', b'/*')) is None
+
+
+def test_burst_is_delayed_to_rate(clock):
+    limiter = RateLimitMiddleware(rate=2, burst=2)
+    assert [limiter._take(('a', None)) for _ in range(4)] == [0, 0.5, 1.0, None]
+
+
+def test_lru_eviction(clock):
+    limiter = RateLimitMiddleware(rate=1, nodelay=True, zone_size=2)
+    limiter._take(('a', None))
+    limiter._take(('b', None))
+    limiter._take(('a', None))
+    limiter._take(('c', None))
+    assert list(limiter._buckets) == [('a', None), ('c', None)]
+
+
+def test_rejection_short_circuits(clock):
+    limiter = RateLimitMiddleware(rate=1, nodelay=True)
+
+    async def main():
+        assert await limiter.process_request(_request()) is None
+        return await limiter.process_request(_request())
+
+    response = asyncio.run(main())
+    assert response.info.status == b'429'
+    assert response is not limiter.rejection_message
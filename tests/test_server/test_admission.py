@@ -0,0 +1,60 @@
+import asyncio
+
+from yapas.core.server.admission import AdmissionControl
+
+
+def test_connection_limit():
+    admission = AdmissionControl(max_connections=2)
+    assert admission.accept() and admission.accept()
+    assert not admission.accept()
+
+    admission.release_connection()
+    assert admission.accept()
+    assert admission.rejection.startswith(b'HTTP/1.1 503 Service Unavailable\r\n')
+    assert b'Retry-After: 1\r\n' in admission.rejection
+
+
+def test_in_flight_queue_and_shedding():
+    async def main():
+        admission = AdmissionControl(max_in_flight=1, queue_timeout=0.05)
+        assert await admission.acquire()
+
+        # queued request gets the slot on release
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        admission.release(0.01)
+        assert await waiter
+        assert admission.in_flight == 1
+
+        # nobody releases, the queued request is shed on timeout
+        assert not await admission.acquire()
+
+        # slow service time: shed immediately without waiting
+        admission.release(10)
+        assert await admission.acquire()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        assert not await admission.acquire()
+        assert loop.time() - started < 0.05
+
+    asyncio.run(main())
+
+
+def test_slot_handed_to_cancelled_waiter_is_passed_on():
+    async def main():
+        admission = AdmissionControl(max_in_flight=1, queue_timeout=1)
+        assert await admission.acquire()
+        first = asyncio.ensure_future(admission.acquire())
+        second = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+
+        # the slot goes to the first waiter, which is cancelled before it runs
+        admission.release()
+        first.cancel()
+        assert await second
+        assert admission.in_flight == 1
+
+        admission.release()
+        assert admission.in_flight == 0
+
+    asyncio.run(main())
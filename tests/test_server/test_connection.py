@@ -0,0 +1,65 @@
+import asyncio
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import OK
+from yapas.core.dispatcher import ProxyDispatcher
+from yapas.core.server.proxy import ProxyServer
+
+
+def test_connection_header_follows_the_request():
+    async def main():
+        # e.g. a cached response, shared by the requests
+        shared = RawHttpMessage(OK, headers=[[b'Content-Length', b'2']], body=b'ok')
+        undelimited = RawHttpMessage(OK, body=b'ok')
+        not_modified = RawHttpMessage(b'HTTP/1.1 304 Not Modified', headers=[[b'ETag', b'"1"']])
+
+        async def handler(request: RawHttpMessage) -> RawHttpMessage:
+            if request.info.path == b'/not-modified':
+                return not_modified
+            return undelimited if request.info.path == b'/undelimited' else shared
+
+        dispatcher = ProxyDispatcher()
+        dispatcher.add_location('/*', handler)
+        server = ProxyServer(dispatcher=dispatcher, host='127.0.0.1', port=0, log_level='error')
+        await server._start()
+        port = server._server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        for _ in range(2):
+            writer.write(b'GET / HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n')
+            response = await asyncio.wait_for(reader.readuntil(b'\r\n\r\nok'), 1)
+            assert b'Connection: keep-alive' in response
+        # responses without a body end with the head
+        writer.write(b'GET /not-modified HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n')
+        response = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1)
+        assert response.startswith(b'HTTP/1.1 304') and b'Connection: keep-alive' in response
+        writer.write(b'HEAD /undelimited HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n')
+        response = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 1)
+        assert b'Connection: keep-alive' in response
+        writer.write(b'GET / HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n')
+        response = await asyncio.wait_for(reader.readuntil(b'\r\n\r\nok'), 1)
+        # nothing was written after the head of the response to HEAD
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        # the body ends with the connection
+        writer.write(b'GET /undelimited HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n')
+        response = await asyncio.wait_for(reader.read(), 1)
+        assert b'Connection' not in response and response.endswith(b'ok')
+        writer.close()
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        response = await asyncio.wait_for(reader.read(), 1)
+        assert b'Connection' not in response and response.endswith(b'ok')
+        writer.close()
+
+        # the body is not read, the connection is closed
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST / HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\nContent-Length: 4\r\n\r\nbody')
+        response = await asyncio.wait_for(reader.read(), 1)
+        assert b'Connection: close' in response and response.endswith(b'ok')
+        writer.close()
+
+        assert not shared.has_header(b'Connection')
+        await server.shutdown()
+
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import OK
+from yapas.core.dispatcher import ProxyDispatcher
+from yapas.core.server.proxy import ProxyServer
+
+
+def test_shutdown_drains_connections(tmp_path):
+    async def main():
+        finish = asyncio.Event()
+        cancelled = []
+
+        async def handler(request: RawHttpMessage) -> RawHttpMessage:
+            try:
+                if request.info.path == b'/slow':
+                    await finish.wait()
+                elif request.info.path == b'/stuck':
+                    await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(request.info.path)
+                raise
+            return RawHttpMessage(OK, headers=[[b'Content-Length', b'2']], body=b'ok')
+
+        dispatcher = ProxyDispatcher()
+        dispatcher.add_location('/*', handler)
+        path = tmp_path / 'yapas.sock'
+        server = ProxyServer(dispatcher=dispatcher, host=f'unix:{path}', log_level='error', drain_timeout=0.5)
+        await server._start()
+        assert path.exists()
+
+        async def request(target: bytes):
+            reader, writer = await asyncio.open_unix_connection(str(path))
+            writer.write(b'GET %s HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n' % target)
+            return reader, writer
+
+        # the writers are kept, a collected one closes its connection
+        idle, idle_writer = await request(b'/')
+        assert (await idle.readuntil(b'\r\n\r\nok')).startswith(b'HTTP/1.1 200 OK')
+        slow, slow_writer = await request(b'/slow')
+        stuck, stuck_writer = await request(b'/stuck')
+        await asyncio.sleep(0.05)
+
+        started = time.monotonic()
+        shutdown = asyncio.ensure_future(server.shutdown())
+
+        # idle keep-alive connections are closed right away
+        assert await asyncio.wait_for(idle.read(), 0.2) == b''
+
+        # requests in flight are answered, with Connection: close
+        finish.set()
+        response = await asyncio.wait_for(slow.read(), 0.2)
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        assert b'Connection: close' in response
+        assert not shutdown.done()
+
+        # what is left after drain_timeout is cancelled
+        await asyncio.wait_for(shutdown, 2)
+        assert time.monotonic() - started >= 0.5
+        assert cancelled == [b'/stuck']
+        assert await stuck.read() == b''
+
+        # the socket file is removed
+        assert not path.exists()
+        for writer in (idle_writer, slow_writer, stuck_writer):
+            writer.close()
+
+    asyncio.run(main())
+
+
+def test_shutdown_waits_for_requests_being_read(tmp_path):
+    async def main():
+        async def handler(request: RawHttpMessage) -> RawHttpMessage:
+            return RawHttpMessage(OK, headers=[[b'Content-Length', b'2']], body=b'ok')
+
+        dispatcher = ProxyDispatcher()
+        dispatcher.add_location('/*', handler)
+        path = tmp_path / 'yapas.sock'
+        server = ProxyServer(dispatcher=dispatcher, host=f'unix:{path}', log_level='error', drain_timeout=1)
+        await server._start()
+
+        # the first request of a new connection, and the next one of a keep-alive connection, half sent
+        fresh, fresh_writer = await asyncio.open_unix_connection(str(path))
+        fresh_writer.write(b'GET / HTTP/1.1\r\nHost: x\r\n')
+        kept, kept_writer = await asyncio.open_unix_connection(str(path))
+        kept_writer.write(b'GET / HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n')
+        await kept.readuntil(b'\r\n\r\nok')
+        kept_writer.write(b'GET / HT')
+        await asyncio.sleep(0.05)
+
+        shutdown = asyncio.ensure_future(server.shutdown())
+        await asyncio.sleep(0.05)
+        assert not shutdown.done()
+
+        fresh_writer.write(b'\r\n')
+        kept_writer.write(b'TP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n')
+        for reader in (fresh, kept):
+            response = await asyncio.wait_for(reader.read(), 0.5)
+            assert response.startswith(b'HTTP/1.1 200 OK')
+            assert b'Connection: close' in response
+
+        await asyncio.wait_for(shutdown, 1)
+        for writer in (fresh_writer, kept_writer):
+            writer.close()
+
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+
+from yapas.core.exceptions import ServiceUnavailable
+from yapas.core.fileio import FileIOExecutor, read_file, read_into
+
+
+def test_read_into_reads_by_chunks(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(b'x' * 1000 + b'y' * 24)
+
+    with open(path, 'rb') as f:
+        assert read_into(f.fileno(), 1024, chunk_size=100) == b'x' * 1000 + b'y' * 24
+        # truncated since it was stat'ed
+        assert read_into(f.fileno(), 2048, chunk_size=100) == b'x' * 1000 + b'y' * 24
+
+    with pytest.raises(FileNotFoundError):
+        read_file(str(tmp_path))
+
+
+def test_jobs_over_the_queue_are_rejected():
+    executor = FileIOExecutor(workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def main():
+        running = asyncio.create_task(executor.run(release.wait))
+        queued = asyncio.create_task(executor.run(release.wait))
+        while executor.running != 1:
+            await asyncio.sleep(0.01)
+        assert executor.queued == 1
+
+        with pytest.raises(ServiceUnavailable):
+            await executor.run(release.wait)
+
+        release.set()
+        assert await running and await queued
+        assert executor.pending == 0
+        assert executor.queued_max == 1
+
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.exceptions import (
+    BadRequest,
+    ClientDisconnected,
+    IdleTimeout,
+    RequestTimeout,
+    UnsupportedTransferEncoding,
+)
+
+
+def _reader(data: bytes, eof: bool = True) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+def test_keep_alive_framing():
+    async def main():
+        reader = _reader(
+            b'POST /a HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello'
+            b'POST /b HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'3;ext=1\r\nabc\r\n2\r\nde\r\n0\r\nTrailer: 1\r\n\r\n'
+            b'GET /c HTTP/1.1\r\nHost: x\r\n\r\n'
+        )
+        first = await RawHttpMessage.from_reader(reader)
+        assert (first.info.path, first._body) == (b'/a', b'hello')
+        # the request line goes upstream without its CRLF, followed by the headers
+        assert bytes(first.raw_bytes).startswith(b'POST /a HTTP/1.1\r\nHost: x\r\n')
+
+        second = await RawHttpMessage.from_reader(reader)
+        assert (second.info.path, second._body) == (b'/b', b'abcde')
+        # decoded, forwarded with a length
+        assert not second.has_header(b'Transfer-Encoding')
+        assert second.get_header_value(b'Content-Length') == b'5'
+
+        third = await RawHttpMessage.from_reader(reader)
+        assert (third.info.path, third._body) == (b'/c', b'')
+        with pytest.raises(ClientDisconnected):
+            await RawHttpMessage.from_reader(reader)
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('head, error', [
+    (b'Content-Length: 5\r\nTransfer-Encoding: chunked\r\n', BadRequest),
+    (b'Content-Length: 5\r\nContent-Length: 6\r\n', BadRequest),
+    (b'Content-Length: +5\r\n', BadRequest),
+    (b'Content-Length: 0x5\r\n', BadRequest),
+    (b'Transfer-Encoding: gzip, chunked\r\n', UnsupportedTransferEncoding),
+])
+def test_ambiguous_framing_is_rejected(head, error):
+    async def main():
+        with pytest.raises(error):
+            await RawHttpMessage.from_reader(_reader(b'POST / HTTP/1.1\r\n%s\r\nhello' % head))
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('size', [b'0x3', b'+3', b'1_0', b''])
+def test_malformed_chunk_size(size):
+    async def main():
+        with pytest.raises(BadRequest):
+            await RawHttpMessage.from_reader(
+                _reader(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n%s\r\nabc\r\n0\r\n\r\n' % size))
+
+    asyncio.run(main())
+
+
+def test_streamed_chunked_body():
+    async def main():
+        reader = _reader(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\nGET')
+        request = await RawHttpMessage.from_reader(reader, stream_body=True)
+        # framed again by whoever forwards it
+        assert request.has_header(b'Transfer-Encoding')
+        assert request.body_stream.length is None
+        assert b''.join([chunk async for chunk in request.body_stream.chunks()]) == b'abc'
+        assert await reader.read() == b'GET'
+
+    asyncio.run(main())
+
+
+def test_timeouts():
+    async def main():
+        # nothing arrives on a kept-alive connection
+        with pytest.raises(IdleTimeout):
+            await RawHttpMessage.from_reader(_reader(b'', eof=False), idle_timeout=0.01)
+
+        # the first line arrives in time, the headers do not
+        with pytest.raises(RequestTimeout) as exc:
+            await RawHttpMessage.from_reader(
+                _reader(b'GET / HTTP/1.1\r\nHost: x\r\n', eof=False), idle_timeout=1, header_timeout=0.01)
+        assert str(exc.value) == 'client_header'
+        assert not isinstance(exc.value, IdleTimeout)
+
+        with pytest.raises(RequestTimeout) as exc:
+            await RawHttpMessage.from_reader(
+                _reader(b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nhalf', eof=False), body_timeout=0.01)
+        assert str(exc.value) == 'client_body'
+
+        with pytest.raises(RequestTimeout) as exc:
+            await RawHttpMessage.from_reader(
+                _reader(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nab', eof=False), body_timeout=0.01)
+        assert str(exc.value) == 'client_body'
+
+    asyncio.run(main())
+
+
+def test_truncated_body():
+    async def main():
+        with pytest.raises(ClientDisconnected):
+            await RawHttpMessage.from_reader(_reader(b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nhalf'))
+        with pytest.raises(ClientDisconnected):
+            await RawHttpMessage.from_reader(_reader(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nab'))
+
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+import asyncio
+
+from yapas.conf.parser import ConfParser
+from yapas.core.dispatcher import ProxyDispatcher
+from yapas.core.server.proxy import ProxyServer
+
+LOCATIONS = """
+[locations:root]
+regex = /*
+type = proxy
+proxy_pass.uri = {uri}
+"""
+
+
+class _Dispatcher(ProxyDispatcher):
+    """Records its startups and cleanups."""
+    events: list = []
+
+    async def startup(self) -> None:
+        self.events.append(('startup', self))
+        await super().startup()
+
+    async def cleanup(self) -> None:
+        self.events.append(('cleanup', self))
+        await super().cleanup()
+
+
+async def _backend(body: bytes, release: asyncio.Event):
+    """Keep-alive backend, /slow waits for release."""
+    async def handle(reader, writer):
+        head = await reader.readuntil(b'\r\n\r\n')
+        if head.startswith(b'GET /slow'):
+            await release.wait()
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: keep-alive\r\n\r\n%s' % (len(body), body))
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+
+
+async def _server(tmp_path, uri: str) -> ProxyServer:
+    (tmp_path / 'locations.ini').write_text(LOCATIONS.format(uri=uri))
+    conf = ConfParser(tmp_path)
+    server = ProxyServer(
+        dispatcher=_Dispatcher.from_conf(conf),
+        host='127.0.0.1',
+        port=0,
+        log_level='error',
+        conf=conf,
+        drain_timeout=5,
+    )
+    await server._start()
+    return server
+
+
+async def _request(port: int, path: bytes, writer=None, reader=None) -> bytes:
+    """Send a keep-alive request and read its response, the connection stays open."""
+    if writer is None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET %s HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n' % path)
+    head = await reader.readuntil(b'\r\n\r\n')
+    return head + await reader.readexactly(2), reader, writer
+
+
+def test_old_connections_finish_on_the_old_configuration(tmp_path):
+    async def main():
+        _Dispatcher.events = []
+        release = asyncio.Event()
+        one, one_uri = await _backend(b'v1', release)
+        two, two_uri = await _backend(b'v2', release)
+        server = await _server(tmp_path, one_uri)
+        old = server.dispatcher
+        port = server._server.sockets[0].getsockname()[1]
+
+        response, idle_reader, _ = await _request(port, b'/')
+        assert response.endswith(b'v1')
+        busy = asyncio.ensure_future(_request(port, b'/slow'))
+        await asyncio.sleep(0.05)
+
+        (tmp_path / 'locations.ini').write_text(LOCATIONS.format(uri=two_uri))
+        await server.reload()
+        assert server.dispatcher is not old
+
+        # idle connections of the old configuration are closed, new ones get the new one
+        assert await asyncio.wait_for(idle_reader.read(), 1) == b''
+        response, *_ = await _request(port, b'/')
+        assert response.endswith(b'v2')
+        assert ('cleanup', old) not in _Dispatcher.events
+
+        # the request in flight is answered by the old configuration, then the connection closes
+        release.set()
+        response, reader, _ = await asyncio.wait_for(busy, 1)
+        assert response.endswith(b'v1')
+        assert b'Connection: close' in response
+        assert await asyncio.wait_for(reader.read(), 1) == b''
+
+        await asyncio.wait(set(server._retiring))
+        assert ('cleanup', old) in _Dispatcher.events
+        await server.shutdown()
+        assert ('cleanup', server.dispatcher) in _Dispatcher.events
+        one.close()
+        two.close()
+
+    asyncio.run(main())
+
+
+def test_failed_reload_keeps_the_current_configuration(tmp_path, monkeypatch):
+    async def main():
+        _Dispatcher.events = []
+        server = await _server(tmp_path, 'http://127.0.0.1:1')
+        current = server.dispatcher
+
+        # created, not started
+        (tmp_path / 'locations.ini').write_text('[locations:bad]\nregex = /*\ntype = unknown\n')
+        await server.reload()
+        assert server.dispatcher is current
+
+        # started halfway, cleaned up before it is dropped
+        (tmp_path / 'locations.ini').write_text(LOCATIONS.format(uri='http://127.0.0.1:2'))
+
+        async def failing_startup(self):
+            self.events.append(('startup', self))
+            raise RuntimeError('startup failed')
+
+        monkeypatch.setattr(_Dispatcher, 'startup', failing_startup)
+        await server.reload()
+        assert server.dispatcher is current
+        (_, failed), = [event for event in _Dispatcher.events[1:] if event[0] == 'startup']
+        assert ('cleanup', failed) in _Dispatcher.events
+        assert ('cleanup', current) not in _Dispatcher.events
+
+        await server.shutdown()
+
+    asyncio.run(main())
+
+
+def test_dropped_catch_all_location_stays_dropped(tmp_path):
+    (tmp_path / 'locations.ini').write_text(LOCATIONS.format(uri='http://127.0.0.1:1'))
+    dispatcher = ProxyDispatcher.from_conf(ConfParser(tmp_path), use_proxy=False)
+    assert b'/*' not in dispatcher._locations
+    assert b'/*' not in dispatcher.fresh(ConfParser(tmp_path))._locations
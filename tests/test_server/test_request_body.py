@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from yapas.core.abs.messages import RawHttpMessage, RequestBody
+from yapas.core.dispatcher import ProxyDispatcher
+from yapas.core.exceptions import ClientDisconnected, PayloadTooLarge
+from yapas.core.server.handlers import ProxyHandler
+from yapas.core.server.proxy import ProxyServer
+from yapas.core.upstream.pool import UpstreamPool
+
+BODY = bytes(range(256)) * 40
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def _collect(body: RequestBody, size: int = 1000) -> bytes:
+    return b''.join([chunk async for chunk in body.chunks(size)])
+
+
+def test_from_reader_leaves_body_in_stream():
+    async def main():
+        reader = _reader(b'POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n%sGET' % (len(BODY), BODY))
+        request = await RawHttpMessage.from_reader(reader, stream_body=True)
+        assert request.body_stream.length == len(BODY)
+        assert not request.body_stream.consumed
+
+        assert await _collect(request.body_stream) == BODY
+        assert request.body_stream.consumed
+        # the next request is not touched
+        assert await reader.read() == b'GET'
+
+        with pytest.raises(RuntimeError):
+            await _collect(request.body_stream)
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('threshold', [None, 100])
+def test_spooled_body_is_replayable(threshold):
+    async def main():
+        body = RequestBody(_reader(BODY), len(BODY))
+        await body.spool(threshold)
+        assert body.consumed
+        assert await _collect(body) == BODY
+        assert await _collect(body) == BODY
+        body.close()
+
+    asyncio.run(main())
+
+
+def test_disconnect_and_discard():
+    async def main():
+        body = RequestBody(_reader(BODY[:10]), len(BODY))
+        with pytest.raises(ClientDisconnected):
+            await _collect(body)
+
+        body = RequestBody(_reader(BODY), len(BODY))
+        await body.discard(timeout=1)
+        assert body.consumed
+
+    asyncio.run(main())
+
+
+def _chunked(body: bytes, size: int = 1000) -> bytes:
+    chunks = [body[i:i + size] for i in range(0, len(body), size)]
+    return b''.join(b'%x;ext\r\n%s\r\n' % (len(chunk), chunk) for chunk in chunks) + b'0\r\nTrailer: 1\r\n\r\n'
+
+
+def test_chunked_body_is_decoded_and_framed_again():
+    async def main():
+        reader = _reader(_chunked(BODY) + b'GET')
+        body = RequestBody(reader, None)
+        assert await _collect(body, size=300) == BODY
+        assert body.consumed
+        assert await reader.read() == b'GET'
+
+        body = RequestBody(_reader(_chunked(BODY)), None)
+        framed = b''.join([chunk async for chunk in body.framed(size=4096)])
+        assert await _collect(RequestBody(_reader(framed), None)) == BODY
+        assert framed.endswith(b'\r\n0\r\n\r\n')
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('threshold', [None, 100, len(BODY)])
+def test_spooled_chunked_body(threshold):
+    async def main():
+        body = RequestBody(_reader(_chunked(BODY)), None)
+        await body.spool(threshold)
+        assert body.consumed
+        assert (body._file is not None) == (threshold == 100)
+        assert await _collect(body) == BODY
+        body.close()
+
+    asyncio.run(main())
+
+
+def test_chunked_body_limits():
+    async def main():
+        body = RequestBody(_reader(_chunked(BODY)), None)
+        body.max_size = len(BODY) - 1
+        with pytest.raises(PayloadTooLarge):
+            await _collect(body)
+
+        body = RequestBody(_reader(_chunked(BODY)[:100]), None)
+        with pytest.raises(ClientDisconnected):
+            await _collect(body)
+
+        body = RequestBody(_reader(_chunked(BODY) + b'GET'), None)
+        await body.discard(timeout=1)
+        assert body.consumed
+
+    asyncio.run(main())
+
+
+def test_chunked_upload_is_proxied():
+    async def main():
+        received = []
+
+        async def backend(reader, writer):
+            request = await RawHttpMessage.from_reader(reader)
+            received.append(request)
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            await writer.drain()
+            writer.close()
+
+        upstream = await asyncio.start_server(backend, '127.0.0.1', 0)
+        dispatcher = ProxyDispatcher()
+        dispatcher.add_location('/*', ProxyHandler.as_view(
+            upstream=UpstreamPool.single(f'http://127.0.0.1:{upstream.sockets[0].getsockname()[1]}')))
+        server = ProxyServer(dispatcher=dispatcher, host='127.0.0.1', port=0, log_level='error',
+                             client_max_body_size=len(BODY))
+        await server._start()
+        port = server._server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n' + _chunked(BODY))
+        assert (await reader.read()).endswith(b'\r\n\r\nok')
+        writer.close()
+        assert received[0]._body == BODY
+
+        # over client_max_body_size
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n' + _chunked(BODY + b'!'))
+        assert (await reader.read()).startswith(b'HTTP/1.1 413')
+        writer.close()
+
+        await server.shutdown()
+        upstream.close()
+
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import asyncio
+import shutil
+import ssl
+import subprocess
+from configparser import ConfigParser
+
+import pytest
+
+from yapas.conf.tls import create_ssl_context
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import OK
+from yapas.core.dispatcher import ProxyDispatcher
+from yapas.core.server.proxy import ProxyServer
+
+
+@pytest.fixture(scope='module')
+def certificate(tmp_path_factory):
+    """Self-signed certificate for localhost, (cert, key) paths."""
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is not available')
+    root = tmp_path_factory.mktemp('tls')
+    cert, key = root / 'cert.pem', root / 'key.pem'
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes',
+         '-keyout', str(key), '-out', str(cert), '-days', '1', '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost'],
+        check=True,
+        capture_output=True,
+    )
+    return str(cert), str(key)
+
+
+def _section(**options):
+    conf = ConfigParser()
+    conf.read_dict({'server': options})
+    return conf['server']
+
+
+async def _ok(_request: RawHttpMessage) -> RawHttpMessage:
+    return RawHttpMessage(OK, headers=[[b'Content-Length', b'2']], body=b'ok')
+
+
+def test_handshake_and_get(certificate):
+    cert, key = certificate
+
+    async def main():
+        dispatcher = ProxyDispatcher()
+        dispatcher.add_location('/*', _ok)
+        server = ProxyServer(
+            dispatcher=dispatcher,
+            host='127.0.0.1',
+            port=0,
+            log_level='error',
+            ssl_context=create_ssl_context(_section(ssl_certificate=cert, ssl_certificate_key=key)),
+        )
+        await server._start()
+        port = server._server.sockets[0].getsockname()[1]
+
+        client_ctx = ssl.create_default_context(cafile=cert)
+        client_ctx.set_alpn_protocols(['http/1.1'])
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, ssl=client_ctx, server_hostname='localhost')
+        assert writer.get_extra_info('ssl_object').selected_alpn_protocol() == 'http/1.1'
+
+        writer.write(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await asyncio.wait_for(reader.read(), 5)
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert response.endswith(b'\r\n\r\nok')
+        writer.close()
+        await server.shutdown()
+
+    asyncio.run(main())
+
+
+def test_options(certificate):
+    cert, key = certificate
+    assert create_ssl_context(_section()) is None
+
+    ctx = create_ssl_context(_section(ssl_certificate=cert, ssl_certificate_key=key, ssl_min_protocol='TLSv1.3'))
+    assert ctx.minimum_version is ssl.TLSVersion.TLSv1_3
+    assert not ctx.options & ssl.OP_NO_TICKET
+    assert ctx.num_tickets == 2
+
+    ctx = create_ssl_context(_section(ssl_certificate=cert, ssl_certificate_key=key, ssl_session_tickets='off'))
+    assert ctx.options & ssl.OP_NO_TICKET
+    assert ctx.num_tickets == 0
+
+
+def test_option_errors(certificate, tmp_path):
+    cert, key = certificate
+    with pytest.raises(FileNotFoundError):
+        create_ssl_context(_section(ssl_certificate=str(tmp_path / 'missing.pem')))
+    with pytest.raises(ssl.SSLError):
+        # the key does not match: the certificate file has none
+        create_ssl_context(_section(ssl_certificate=cert, ssl_certificate_key=cert))
+    with pytest.raises(ValueError, match='ssl protocols'):
+        create_ssl_context(_section(ssl_certificate=cert, ssl_certificate_key=key, ssl_min_protocol='SSLv3'))
+    with pytest.raises(ssl.SSLError):
+        create_ssl_context(_section(ssl_certificate=cert, ssl_certificate_key=key, ssl_ciphers='NO-SUCH-CIPHER'))
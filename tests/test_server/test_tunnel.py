@@ -0,0 +1,43 @@
+import asyncio
+
+from yapas.core.server.tunnel import Tunnel
+
+
+async def _pair():
+    """Return both ends of a local TCP connection as (reader, writer) tuples."""
+    accepted = asyncio.get_running_loop().create_future()
+    server = await asyncio.start_server(lambda r, w: accepted.set_result((r, w)), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await asyncio.open_connection('127.0.0.1', port)
+    server.close()
+    return client, await accepted
+
+
+def test_pumps_both_directions_until_close():
+    async def main():
+        (client, client_side), (upstream_side, upstream) = await _pair(), await _pair()
+        tunnel = Tunnel(*upstream_side, idle_timeout=5)
+        task = asyncio.create_task(tunnel.run(*client_side))
+
+        client[1].write(b'ping')
+        assert await upstream[0].readexactly(4) == b'ping'
+        upstream[1].write(b'x' * 100_000)
+        assert len(await client[0].readexactly(100_000)) == 100_000
+        assert Tunnel.active == 1
+
+        client[1].close()
+        await asyncio.wait_for(task, 1)
+        assert Tunnel.active == 0
+        # upstream is closed by the tunnel
+        assert await upstream[0].read() == b''
+
+    asyncio.run(main())
+
+
+def test_idle_timeout():
+    async def main():
+        (client, client_side), (upstream_side, upstream) = await _pair(), await _pair()
+        tunnel = Tunnel(*upstream_side, idle_timeout=0.05)
+        await asyncio.wait_for(tunnel.run(*client_side), 1)
+
+    asyncio.run(main())
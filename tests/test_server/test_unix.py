@@ -0,0 +1,50 @@
+import asyncio
+import socket
+
+from yapas.conf.parser import ConfParser
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.dispatcher import ProxyDispatcher
+from yapas.core.server.proxy import ProxyServer
+
+
+def test_serve_and_proxy_over_unix_sockets(tmp_path):
+    async def main():
+        app, listener = tmp_path / 'app.sock', tmp_path / 'yapas.sock'
+        received = []
+
+        async def backend(reader, writer):
+            received.append(await RawHttpMessage.from_reader(reader))
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            await writer.drain()
+            writer.close()
+
+        upstream = await asyncio.start_unix_server(backend, str(app))
+        (tmp_path / 'locations.ini').write_text(
+            f'[locations:root]\nregex = /*\ntype = proxy\nproxy_pass.uri = unix:{app}\n')
+        # a stale socket file of a previous run is replaced
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(str(listener))
+        stale.close()
+        server = ProxyServer(
+            dispatcher=ProxyDispatcher.from_conf(ConfParser(tmp_path)),
+            host=f'unix:{listener}',
+            log_level='error',
+        )
+        await server._start()
+
+        reader, writer = await asyncio.open_unix_connection(str(listener))
+        writer.write(b'GET /path HTTP/1.1\r\nHost: example.com\r\n\r\n')
+        response = await asyncio.wait_for(reader.read(), 5)
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        assert response.endswith(b'\r\n\r\nok')
+        writer.close()
+
+        assert received[0].info.path == b'/path'
+        assert received[0].get_header_value(b'Host') == b'localhost'
+
+        await server.shutdown()
+        assert not listener.exists()
+        upstream.close()
+        await upstream.wait_closed()
+
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.server.handlers import ProxyHandler
+from yapas.core.upstream.backend import Backend
+from yapas.core.upstream.balancers import RoundRobinBalancer
+from yapas.core.upstream.limit import ConcurrencyLimit
+from yapas.core.upstream.pool import UpstreamPool
+from yapas.core.upstream.retry import RetryPolicy
+
+pytest.importorskip('aiohttp')
+
+from yapas.core.client.aiohttp import AIOHttpClient  # noqa: E402
+
+
+class _Writer:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self.data += data
+
+    async def drain(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+async def _backend(connections: list):
+    """Keep-alive backend answering with a chunked body."""
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while await reader.readuntil(b'\r\n\r\n'):
+                writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nok\r\n0\r\n\r\n')
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+
+
+def test_connections_are_reused():
+    async def main():
+        connections = []
+        server, url = await _backend(connections)
+        client = AIOHttpClient(url)
+        for _ in range(3):
+            response = await client.raw(RawHttpMessage(b'GET / HTTP/1.1', headers=[[b'Connection', b'close']]))
+            # de-chunked and delimited by Content-Length, the pooled connection is not the client's,
+            # the server sets the header of the client connection
+            assert response._body == b'ok'
+            assert response.get_header_value(b'Content-Length') == b'2'
+            assert not response.has_header(b'Connection')
+        assert len(connections) == 1
+        await client.close()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_streamed_response_is_rechunked():
+    async def main():
+        server, url = await _backend([])
+        client = AIOHttpClient()
+        handler = ProxyHandler.as_view(upstream=UpstreamPool.single(url), client=client)
+
+        response = await handler(RawHttpMessage(b'GET / HTTP/1.1'))
+        assert response.get_header_value(b'Transfer-Encoding') == b'chunked'
+        writer = _Writer()
+        await response.body_file.send(writer)
+        response.body_file.release()
+        assert writer.data == b'2\r\nok\r\n0\r\n\r\n'
+        await client.close()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_streamed_response_holds_the_upstream_until_its_end():
+    async def main():
+        body_sent = asyncio.Event()
+
+        async def handle(reader, writer):
+            path = (await reader.readuntil(b'\r\n\r\n')).split()[1]
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nok')
+            await writer.drain()
+            await body_sent.wait()
+            # /broken ends halfway
+            if path != b'/broken':
+                writer.write(b'ok')
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        # not ejected, failures are counted
+        backend = Backend(f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}', max_fails=0)
+        limit = ConcurrencyLimit('test_stream', 1)
+        client, retry = AIOHttpClient(), RetryPolicy()
+        handler = ProxyHandler.as_view(
+            upstream=UpstreamPool('test_stream', [backend], RoundRobinBalancer([backend]), limit=limit),
+            client=client,
+            retry=retry,
+        )
+
+        for path, fails in ((b'/', 0), (b'/broken', 1)):
+            response = await handler(RawHttpMessage(b'GET %s HTTP/1.1' % path))
+            # the head is here, the body is not
+            assert (limit.in_flight, backend.active) == (1, 1)
+            body_sent.set()
+            await response.body_file.send(_Writer())
+            response.body_file.release()
+            body_sent.clear()
+            assert (limit.in_flight, backend.active, backend.fails) == (0, 0, fails)
+        # the latency of the whole response
+        assert len(retry.latencies._samples) == 1
+
+        # released without being sent, e.g. a lost hedge
+        response = await handler(RawHttpMessage(b'GET / HTTP/1.1'))
+        response.body_file.release()
+        await asyncio.sleep(0)
+        assert (limit.in_flight, backend.active) == (0, 0)
+
+        await client.close()
+        server.close()
+
+    asyncio.run(main())
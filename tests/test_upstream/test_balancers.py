@@ -0,0 +1,72 @@
+from collections import Counter
+
+import pytest
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.upstream.backend import Backend
+from yapas.core.upstream.balancers import (
+    RoundRobinBalancer,
+    LeastConnectionsBalancer,
+    HashBalancer,
+)
+
+
+@pytest.fixture
+def request_message():
+    message = RawHttpMessage(b'GET /index HTTP/1.1')
+    message.remote_addr = '10.0.0.1'
+    return message
+
+
+def test_round_robin_is_smooth_and_weighted(request_message):
+    a, b, c = Backend('http://a:80', weight=5), Backend('http://b:80'), Backend('http://c:80')
+    balancer = RoundRobinBalancer([a, b, c])
+
+    order = [balancer.select(request_message) for _ in range(7)]
+    assert Counter(order) == {a: 5, b: 1, c: 1}
+    assert order[:2] == [a, a] and order[2] in (b, c)
+
+
+def test_least_connections(request_message):
+    a, b = Backend('http://a:80'), Backend('http://b:80', weight=2)
+    balancer = LeastConnectionsBalancer([a, b])
+
+    a.active, b.active = 1, 1
+    assert balancer.select(request_message) is b
+
+    with b.track(), b.track():
+        assert balancer.select(request_message) is a
+
+
+def test_hash_is_stable(request_message):
+    backends = [Backend(f'http://backend-{i}:80') for i in range(4)]
+    balancer = HashBalancer(backends, key='client_ip')
+
+    first = balancer.select(request_message)
+    assert all(balancer.select(request_message) is first for _ in range(10))
+
+    # removing another backend does not move the key
+    others = [b for b in backends if b is not first]
+    assert HashBalancer([first, *others[1:]], key='client_ip').select(request_message) is first
+
+
+def test_ejected_backend_is_skipped(request_message):
+    a, b = Backend('http://a:80', max_fails=2), Backend('http://b:80')
+    balancer = RoundRobinBalancer([a, b])
+
+    a.failure()
+    assert a.available
+    a.failure()
+    assert not a.available
+    assert all(balancer.select(request_message) is b for _ in range(4))
+
+    b.mark_down()
+    assert balancer.select(request_message) is None
+
+
+def test_unix_socket_backend():
+    backend = Backend.from_line('unix:/run/app.sock weight=2')
+    assert backend.unix_path == '/run/app.sock'
+    assert backend.host is None
+    assert backend.netloc == b'localhost'
+    assert backend.weight == 2
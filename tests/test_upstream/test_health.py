@@ -0,0 +1,35 @@
+import asyncio
+
+from yapas.core.upstream.backend import Backend
+from yapas.core.upstream.health import HealthChecker
+
+
+async def _backend(response: bytes):
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+
+
+def test_probes_mark_backends_down_and_up():
+    async def main():
+        healthy, healthy_url = await _backend(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+        closing, closing_url = await _backend(b'')
+        garbage, garbage_url = await _backend(b'garbage\r\n\r\n')
+        # fails the probe with an unexpected error, the others are still updated
+        broken, broken_url = await _backend(b'HTTP/1.1\r\n\r\n')
+        backends = [Backend(url) for url in (healthy_url, closing_url, garbage_url, broken_url)]
+        checker = HealthChecker(backends, '/health', timeout=1, passes=1)
+
+        backends[0].mark_down()
+        await checker.check()
+        assert [backend.down for backend in backends] == [False, True, True, True]
+
+        for server in (healthy, closing, garbage, broken):
+            server.close()
+
+    asyncio.run(main())
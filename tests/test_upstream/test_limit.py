@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from yapas.core.exceptions import ServiceUnavailable, GatewayTimeout
+from yapas.core.upstream.limit import ConcurrencyLimit
+
+
+def test_queue_and_timeout():
+    async def main():
+        limit = ConcurrencyLimit('test', 1, queue=1, queue_timeout=0.05)
+        await limit.acquire()
+
+        # the queued request gets the slot on release
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(ServiceUnavailable):
+            # over the queue size
+            await limit.acquire()
+        limit.release()
+        await waiter
+        assert limit.in_flight == 1
+
+        # nobody releases, the queued request times out
+        with pytest.raises(ServiceUnavailable):
+            await limit.acquire()
+        limit.release()
+        assert limit.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_adaptive_limit():
+    async def main():
+        limit = ConcurrencyLimit('test', 10, adaptive=True, min_limit=2)
+        with pytest.raises(GatewayTimeout):
+            async with limit.slot():
+                raise GatewayTimeout()
+        assert limit.limit == 9
+
+        # slow responses cut the limit, fast ones under load raise it again
+        for latency in (0.01, 0.05):
+            await limit.acquire()
+            limit._decreased_at = 0
+            limit.release(latency)
+        assert limit.limit == pytest.approx(8.1)
+
+        for _ in range(8):
+            await limit.acquire()
+        limit.release(0.01)
+        assert limit.limit == pytest.approx(8.1 + 1 / 8.1)
+
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+import asyncio
+import socket
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.server.handlers import ProxyHandler
+from yapas.core.stats import stats
+from yapas.core.upstream.backend import Backend
+from yapas.core.upstream.balancers import RoundRobinBalancer
+from yapas.core.upstream.pool import UpstreamPool
+from yapas.core.upstream.retry import RetryBudget, LatencyWindow, RetryPolicy
+
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _backend(body: bytes, delay: float = 0):
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        await asyncio.sleep(delay)
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+
+
+async def _closing_backend():
+    """Backend that closes every connection without a response."""
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+
+
+def _pool(*urls):
+    backends = [Backend(url) for url in urls]
+    return UpstreamPool('test', backends, RoundRobinBalancer(backends))
+
+
+def _counters(before):
+    counters = {name: stats.counters[name] - before.get(name, 0) for name in stats.counters if name.startswith('upstream.')}
+    return {name: value for name, value in counters.items() if value}
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, min_per_second=0)
+    for _ in range(4):
+        budget.deposit()
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_latency_percentile():
+    window = LatencyWindow(percentile=95)
+    for i in range(31):
+        window.add(i / 100)
+    assert window.value is None
+
+    for i in range(31, 100):
+        window.add(i / 100)
+    assert window.value == 0.94
+
+
+def test_retries_go_to_another_backend():
+    async def main():
+        server, url = await _backend(b'ok')
+        handler = ProxyHandler.as_view(
+            upstream=_pool(f'http://127.0.0.1:{_closed_port()}', url),
+            retry=RetryPolicy(tries=2),
+        )
+        before = dict(stats.counters)
+
+        response = await handler(RawHttpMessage(b'GET / HTTP/1.1', headers=[[b'Host', b'localhost']]))
+        assert response._body == b'ok'
+        assert _counters(before) == {'upstream.retries': 1}
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_closed_connection_is_a_backend_failure():
+    async def main():
+        closing, closing_url = await _closing_backend()
+        server, url = await _backend(b'ok')
+        pool = _pool(closing_url, url)
+        handler = ProxyHandler.as_view(upstream=pool, retry=RetryPolicy(tries=2))
+        before = dict(stats.counters)
+
+        response = await handler(RawHttpMessage(b'GET / HTTP/1.1', headers=[[b'Host', b'localhost']]))
+        assert response._body == b'ok'
+        assert _counters(before) == {'upstream.retries': 1}
+        assert not pool.backends[0].available
+
+        closing.close()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_hedged_requests_take_the_first_response():
+    async def main():
+        slow, slow_url = await _backend(b'slow', delay=1)
+        fast, fast_url = await _backend(b'fast')
+        handler = ProxyHandler.as_view(
+            upstream=_pool(slow_url, fast_url),
+            retry=RetryPolicy(hedge=True, hedge_delay=0.05),
+        )
+        before = dict(stats.counters)
+
+        response = await asyncio.wait_for(handler(RawHttpMessage(b'GET / HTTP/1.1')), 0.5)
+        assert response._body == b'fast'
+        assert _counters(before) == {'upstream.hedges': 1, 'upstream.hedge_wins': 1}
+        slow.close()
+        fast.close()
+
+    asyncio.run(main())
+
+
+def test_hedged_responses_of_the_same_round_are_released(monkeypatch):
+    class _Body:
+        released = 0
+
+        def release(self):
+            self.released += 1
+
+    async def main():
+        respond = asyncio.Event()
+        bodies = []
+
+        async def send(_self, _backend, _message):
+            await respond.wait()
+            response = RawHttpMessage(b'HTTP/1.1 200 OK')
+            response.body_file = _Body()
+            bodies.append(response.body_file)
+            return response
+
+        monkeypatch.setattr(ProxyHandler, '_send', send)
+        handler = ProxyHandler.as_view(
+            upstream=_pool('http://127.0.0.1:1', 'http://127.0.0.1:2'),
+            retry=RetryPolicy(hedge=True, hedge_delay=0.01),
+        )
+        request = asyncio.ensure_future(handler(RawHttpMessage(b'GET / HTTP/1.1')))
+        await asyncio.sleep(0.05)
+        respond.set()
+
+        response = await request
+        assert len(bodies) == 2
+        assert [body.released for body in bodies if body is not response.body_file] == [1]
+        assert response.body_file.released == 0
+
+    asyncio.run(main())
@@ -3,6 +3,7 @@ import asyncio
 
 from yapas import conf
 from yapas.conf.parser import ConfParser
+from yapas.conf.server import server_options
 from yapas.core.constants import WORKING_DIR
 from yapas.core.dispatcher import ProxyDispatcher
 from yapas.core.server.proxy import ProxyServer
@@ -11,18 +12,17 @@ from yapas.core.signals import kill_event
 
 async def main(host='0.0.0.0', port=8079, log_level='debug', use_proxy=False):
     server_conf = ConfParser(WORKING_DIR)
-    dispatcher = ProxyDispatcher.from_conf(server_conf)
-
-    # just for testing
-    if use_proxy is False:
-        del dispatcher._locations[b'/*']
+    # just for testing, without use_proxy the catch-all location is dropped, on reloads too
+    dispatcher = ProxyDispatcher.from_conf(server_conf, use_proxy=use_proxy)
 
     conf.setup_logging(log_level.upper())
     server = ProxyServer(
         dispatcher=dispatcher,
         host=host,
         port=port,
-        log_level=log_level
+        log_level=log_level,
+        conf=server_conf,
+        **server_options(server_conf),
     )
     await server.start()
 
@@ -30,7 +30,7 @@ async def main(host='0.0.0.0', port=8079, log_level='debug', use_proxy=False):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--host', default='0.0.0.0',
-                        type=str, help='IP address of the server')
+                        type=str, help='IP address of the server, or unix:/path/to.sock')
     parser.add_argument('--port', default=8079,
                         type=int, help='Port of the server')
     parser.add_argument('--log_level', default='debug',
@@ -2,6 +2,25 @@ import os
 import pathlib
 from configparser import ConfigParser
 
+from yapas.core.exceptions import ImproperlyConfigured
+
+_SIZE_UNITS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    """Parse an nginx-like size, e.g. '512', '16k' or '1m', into bytes."""
+    value = value.strip().lower()
+    multiplier = _SIZE_UNITS.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        size = int(value) * multiplier
+    except ValueError:
+        raise ImproperlyConfigured(f'invalid size {value!r}, expected like 512, 16k or 1m') from None
+    if size < 0:
+        raise ImproperlyConfigured(f'size must not be negative, got {value!r}')
+    return size
+
 
 class ConfParser:
 
@@ -21,6 +40,10 @@ class ConfParser:
             if self._conf_file_name in filenames:
                 return self._path / self._conf_file_name
 
+    def fresh(self) -> 'ConfParser':
+        """Return a new parser for the same file, e.g. to re-read it on reload."""
+        return type(self)(self._path, self._conf_file_name)
+
     def parse(self) -> ConfigParser:
         if not self._parsed:
             if (file := self._get_file()) is None:
@@ -0,0 +1,29 @@
+from yapas.conf.parser import ConfParser, parse_size
+from yapas.conf.tls import create_ssl_context
+from yapas.core.middlewares.pipeline import MiddlewarePipeline
+from yapas.core.server.admission import AdmissionControl
+
+
+def server_options(conf: ConfParser) -> dict:
+    """Return AbstractAsyncServer keyword arguments from the [server] section."""
+    settings = conf.parse()
+    options = {'middlewares': MiddlewarePipeline.from_conf(conf)}
+    if not settings.has_section('server'):
+        return options
+
+    section = settings['server']
+    options |= {
+        'admission': AdmissionControl.from_conf(section),
+        'ssl_context': create_ssl_context(section),
+    }
+    if (value := section.getfloat('ssl_handshake_timeout')) is not None:
+        options['ssl_handshake_timeout'] = value
+    if (value := section.get('client_max_body_size')) is not None:
+        options['client_max_body_size'] = parse_size(value)
+    for option, name in (('file_io.workers', 'file_io_workers'), ('file_io.max_queue', 'file_io_max_queue')):
+        if (value := section.getint(option)) is not None:
+            options[name] = value
+    for name in ('client_header_timeout', 'client_body_timeout', 'keepalive_timeout', 'drain_timeout'):
+        if (value := section.getfloat(name)) is not None:
+            options[name] = value
+    return options
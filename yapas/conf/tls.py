@@ -0,0 +1,50 @@
+import ssl
+from configparser import SectionProxy
+from typing import Optional
+
+from yapas.core.stats import stats
+
+DEFAULT_CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20:DHE+AESGCM:!aNULL:!MD5:!DSS'
+DEFAULT_ALPN = 'http/1.1'
+_PROTOCOLS = {
+    'TLSv1.2': ssl.TLSVersion.TLSv1_2,
+    'TLSv1.3': ssl.TLSVersion.TLSv1_3,
+}
+
+
+def create_ssl_context(section: SectionProxy) -> Optional[ssl.SSLContext]:
+    """Create a server SSLContext from ssl_* options of the [server] section.
+
+    Return None if ssl_certificate is not configured. Resumption is on by default:
+    OpenSSL keeps a server-side session cache, TLS 1.2 clients may also use
+    session tickets and TLS 1.3 clients get `ssl_num_tickets` tickets per handshake.
+    """
+    if (certificate := section.get('ssl_certificate')) is None:
+        return None
+
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(certificate, section.get('ssl_certificate_key'))
+
+    protocol = section.get('ssl_min_protocol', 'TLSv1.2')
+    try:
+        ctx.minimum_version = _PROTOCOLS[protocol]
+    except KeyError:
+        raise ValueError(f'only {", ".join(_PROTOCOLS.keys())} ssl protocols are supported')
+
+    ctx.set_ciphers(section.get('ssl_ciphers', DEFAULT_CIPHERS))
+    ctx.options |= ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_NO_COMPRESSION
+    ctx.set_alpn_protocols([
+        proto.strip() for proto in section.get('ssl_alpn', DEFAULT_ALPN).split(',') if proto.strip()
+    ])
+
+    if section.getboolean('ssl_session_tickets', True):
+        ctx.options &= ~ssl.OP_NO_TICKET
+        ctx.num_tickets = section.getint('ssl_num_tickets', 2)
+    else:
+        ctx.options |= ssl.OP_NO_TICKET
+        ctx.num_tickets = 0
+
+    for name in ('accept', 'hits', 'misses', 'timeouts', 'cache_full'):
+        stats.gauge(f'tls.sessions.{name}', lambda n=name: ctx.session_stats()[n])
+
+    return ctx
@@ -0,0 +1,19 @@
+from abc import ABC, abstractmethod
+from typing import Optional, Sequence, TYPE_CHECKING
+
+from yapas.core.abs.messages import RawHttpMessage
+
+if TYPE_CHECKING:
+    from yapas.core.upstream.backend import Backend
+
+
+class AbstractBalancer(ABC):
+    """Base class for upstream load balancing strategies."""
+
+    def __init__(self, backends: Sequence['Backend']) -> None:
+        self._backends = tuple(backends)
+
+    @abstractmethod
+    def select(self, request: RawHttpMessage) -> Optional['Backend']:
+        """Return an available backend for the given request, None if all are unavailable."""
+        raise NotImplementedError
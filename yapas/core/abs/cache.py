@@ -1,10 +1,26 @@
-from typing import Protocol
+from typing import Optional, Protocol
 
 
 class AbstractCache[_KT, _VT](Protocol):
 
     def get(self, key: _KT) -> _VT: ...
 
-    def set(self, key: _KT, value: _VT) -> None: ...
+    def set(self, key: _KT, value: _VT, timeout: Optional[float] = None) -> None: ...
+
+    def touch(self, key: _KT) -> bool: ...
+
+
+class AbstractCacheTier[_KT, _VT](AbstractCache[_KT, _VT], Protocol):
+    """A lower cache tier, values found in it are copied to the tiers above for their remaining ttl."""
+
+    def lookup(self, key: _KT) -> Optional[tuple[_VT, float]]: ...
+
+
+class AbstractAsyncCacheTier[_KT, _VT](Protocol):
+    """A lower cache tier read off the event loop, e.g. files, looked up only by TieredCache.aget."""
+
+    async def lookup(self, key: _KT) -> Optional[tuple[_VT, float]]: ...
+
+    def set(self, key: _KT, value: _VT, timeout: Optional[float] = None) -> None: ...
 
     def touch(self, key: _KT) -> bool: ...
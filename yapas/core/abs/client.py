@@ -7,11 +7,20 @@ from typing import Optional, Self, Protocol, Any, final
 from urllib.parse import urlparse
 
 from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import UNIX_SOCKET_PREFIX
 
 logger = getLogger('yapas.core.client')
 DEFAULT_CLIENT_TIMEOUT = 10
 
 
+class ConnectTimeout(TimeoutError):
+    """Upstream connection was not established in time"""
+
+
+class ReadTimeout(TimeoutError):
+    """Upstream did not send data in time"""
+
+
 class SessionProtocol(Protocol):
     """Session impl"""
 
@@ -28,16 +37,26 @@ class AbstractSession(ABC):
         ssl_context: Optional[ssl.SSLContext] = None,
         loop: Optional[asyncio.AbstractEventLoop] = None,
         timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
+        connect_timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
     ) -> None:
+        """
+        :param timeout: max time between two successive reads of the response
+        :param connect_timeout: max time to establish the connection
+        """
         url = urlparse(base_url)
 
         self._base_url = base_url
         self._host = url.hostname
         self._port = url.port
+        # path of a unix domain socket for unix:/path/to.sock urls
+        self._unix_path: Optional[str] = None
+        if base_url.startswith(UNIX_SOCKET_PREFIX):
+            self._unix_path = base_url.removeprefix(UNIX_SOCKET_PREFIX)
 
         self._ssl_context = ssl_context
         self._loop = loop or asyncio.get_event_loop()
         self._timeout = timeout
+        self._connect_timeout = connect_timeout
 
     async def __aenter__(self) -> Self:
         await self._connect()
@@ -67,10 +86,14 @@ class AbstractClient(ABC):
     def __init__(
         self,
         base_url: str = 'http://localhost:8000',
-        ssl_context: Optional[ssl.SSLContext] = None
+        ssl_context: Optional[ssl.SSLContext] = None,
+        timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
+        connect_timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
     ) -> None:
         self._base_url = base_url
         self._ssl_ctx: Optional[ssl.SSLContext] = ssl_context
+        self._timeout = timeout
+        self._connect_timeout = connect_timeout
 
     @abstractmethod
     @contextlib.asynccontextmanager
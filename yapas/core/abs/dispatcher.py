@@ -1,5 +1,5 @@
 from abc import abstractmethod, ABC
-from typing import Self
+from typing import Optional, Self
 
 from yapas.conf.parser import ConfParser
 from yapas.core.abs.handlers import HandlerCallable
@@ -15,31 +15,51 @@ class AbstractDispatcher(ABC):
     def __init__(self):
         # like nginx locations
         self._locations: dict[bytes, HandlerCallable] = {}
+        # client_max_body_size overrides by location
+        self.body_limits: dict[bytes, int] = {}
 
     @classmethod
     @abstractmethod
     def from_conf(cls, conf: ConfParser) -> Self:
         """Create a Dispatcher instance from a configuration file."""
 
-    def add_location(self, path: str, handler: HandlerCallable):
+    def fresh(self, conf: ConfParser) -> Self:
+        """Create a dispatcher from conf like this one was created, on reload."""
+        return type(self).from_conf(conf)
+
+    async def startup(self) -> None:
+        """Start background tasks, called by the server before serving."""
+
+    async def cleanup(self) -> None:
+        """Stop background tasks, called by the server on shutdown."""
+
+    def add_location(self, path: str, handler: HandlerCallable, max_body_size: Optional[int] = None):
         """Add location to listen and proxy pass to"""
         if not path.startswith('/'):
             path = f"/{path}"
         self._locations[path.encode()] = handler
+        if max_body_size is not None:
+            self.body_limits[path.encode()] = max_body_size
 
-    async def get_handler(self, path: bytes) -> HandlerCallable:
-        """Find handler for particular request path"""
+    async def resolve(self, path: bytes) -> tuple[Optional[bytes], HandlerCallable]:
+        """Find the location and its handler for particular request path,
+        location is None if nothing matches."""
 
         if path == EMPTY_BYTES:
-            return NOT_FOUND_HANDLE
+            return None, NOT_FOUND_HANDLE
 
         assert path.startswith(b'/'), path
 
         for loc, handler in self._locations.items():
             if path == loc:
-                return handler
+                return loc, handler
 
             elif loc.endswith(b'*') and path.startswith(loc.removesuffix(b'*')):
-                return handler
+                return loc, handler
+
+        return None, NOT_FOUND_HANDLE
 
-        return NOT_FOUND_HANDLE
+    async def get_handler(self, path: bytes) -> HandlerCallable:
+        """Find handler for particular request path"""
+        _, handler = await self.resolve(path)
+        return handler
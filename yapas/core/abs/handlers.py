@@ -5,7 +5,7 @@ from yapas.conf.dispatcher import ALLOWED_METHODS
 from yapas.core.abs.enums import MessageType
 from yapas.core.abs.messages import RawHttpMessage
 from yapas.core.constants import WORKING_DIR, OK
-from yapas.core.exceptions import MethodNotAllowed, HTTPException
+from yapas.core.exceptions import MethodNotAllowed, HTTPException, ImproperlyConfigured
 from yapas.core.statics import render
 
 DEFAULT_CONTEXT = {}
@@ -15,16 +15,27 @@ HandlerCallable = Callable[[RawHttpMessage], Awaitable[RawHttpMessage]]
 class AbstractHandler(ABC):
     """Abstract base class for handlers."""
 
-    def __init__(self, request: RawHttpMessage):
+    def __init__(self, request: RawHttpMessage, **kwargs):
         self._request = request
         self._context = DEFAULT_CONTEXT
+        # options passed to as_view(), e.g. per location configuration
+        for key, value in kwargs.items():
+            setattr(self, key, value)
 
     @classmethod
-    def as_view(cls):
-        """Closure for handling requests"""
+    def as_view(cls, **initkwargs):
+        """Closure for handling requests.
+
+        :param initkwargs: handler class attributes to override for every request
+        :raises ImproperlyConfigured: if there is no such class attribute
+        """
+        for key in initkwargs:
+            if not hasattr(cls, key):
+                raise ImproperlyConfigured(
+                    f'{cls.__name__}.as_view() received an invalid keyword {key!r}')
 
         def _view(request):
-            self = cls(request)
+            self = cls(request, **initkwargs)
             return self.dispatch(request)
 
         return _view
@@ -1,10 +1,40 @@
+import asyncio
+import copy
+import tempfile
 from asyncio import StreamReader, StreamWriter
 from functools import cached_property
-from typing import Optional, NamedTuple
+from typing import Optional, NamedTuple, AsyncIterator, BinaryIO, Callable, TYPE_CHECKING
 
 from yapas.core.abs.enums import MessageType
-from yapas.core.constants import NEWLINE_BYTES, EMPTY_BYTES, CONNECTION, KEEP_ALIVE
-from yapas.core.exceptions import UnknownProtocolError
+from yapas.core.constants import (
+    NEWLINE_BYTES,
+    EMPTY_BYTES,
+    EOF_BYTES,
+    CONNECTION,
+    KEEP_ALIVE,
+    UPGRADE,
+    CONTENT_LENGTH,
+    CHUNKED,
+    LAST_CHUNK,
+)
+from yapas.core.exceptions import (
+    UnknownProtocolError,
+    BadRequest,
+    ClientDisconnected,
+    RequestTimeout,
+    IdleTimeout,
+    PayloadTooLarge,
+    UnsupportedTransferEncoding,
+)
+from yapas.core.fileio import file_io
+from yapas.core.stats import stats
+
+if TYPE_CHECKING:
+    from yapas.core.cache.mapped import MappedSlice
+    from yapas.core.server.tunnel import Tunnel
+
+DEFAULT_BODY_CHUNK_SIZE = 64 * 1024
+HEX_DIGITS = b'0123456789abcdefABCDEF'
 
 
 class _StatusLine(NamedTuple):
@@ -41,6 +71,244 @@ class _StatusLine(NamedTuple):
         return cls(type_, protocol, method, path, status, reason)
 
 
+async def _read_chunk_size(reader: StreamReader) -> int:
+    """Read a chunk-size line of a chunked body, extensions are ignored.
+
+    :raises BadRequest: if the size is not a plain hex number
+    """
+    line = await reader.readline()
+    if not line.endswith(b'\n'):
+        raise asyncio.IncompleteReadError(line, None)
+    size, _, _ = line.rstrip(NEWLINE_BYTES).partition(b';')
+    # int(..., 16) would take 0x, _ and signs, which another parser may read differently
+    size = size.rstrip(b' \t')
+    if not size or size.strip(HEX_DIGITS):
+        raise BadRequest()
+    return int(size, 16)
+
+
+async def _read_chunk_end(reader: StreamReader) -> None:
+    if await reader.readexactly(2) != NEWLINE_BYTES:
+        raise BadRequest()
+
+
+async def _read_trailers(reader: StreamReader) -> None:
+    """Read and drop the trailer section after the last chunk."""
+    while (line := await reader.readline()) not in EOF_BYTES:
+        if not line.endswith(b'\n'):
+            raise asyncio.IncompleteReadError(line, None)
+    if not line:
+        raise asyncio.IncompleteReadError(line, None)
+
+
+async def _read_chunked(reader: StreamReader) -> bytes:
+    """Read a whole chunked body, return it decoded."""
+    body = bytearray()
+    while size := await _read_chunk_size(reader):
+        body += await reader.readexactly(size)
+        await _read_chunk_end(reader)
+    await _read_trailers(reader)
+    return bytes(body)
+
+
+def _body_framing(headers: list[list[bytes]]) -> tuple[int, bool]:
+    """Return Content-Length of the body and if it is chunked.
+
+    Messages a proxy may frame differently than its upstream are rejected:
+    conflicting or malformed Content-Length, both Content-Length and
+    Transfer-Encoding, transfer codings other than chunked.
+
+    :raises BadRequest: on ambiguous framing
+    :raises UnsupportedTransferEncoding: on transfer codings other than chunked
+    """
+    length = None
+    codings = []
+    for name, value in headers:
+        name = name.strip().lower()
+        if name == b'content-length':
+            value = value.strip()
+            if not value.isdigit() or (length is not None and int(value) != length):
+                raise BadRequest()
+            length = int(value)
+        elif name == b'transfer-encoding':
+            codings.extend(coding.strip().lower() for coding in value.split(b','))
+
+    if not codings:
+        return length or 0, False
+    if length is not None:
+        raise BadRequest()
+    if codings != [CHUNKED]:
+        raise UnsupportedTransferEncoding()
+    return 0, True
+
+
+class RequestBody:
+    """Request body read from the client stream on demand.
+
+    Chunks are read as the consumer iterates them, so the body can be forwarded
+    without holding it in memory. `spool` reads the whole body ahead, after that
+    it can be iterated any number of times. A chunked body is decoded as it is
+    read, `framed` chunks it again for the upstream.
+    """
+
+    def __init__(self, reader: StreamReader, length: Optional[int], timeout: Optional[float] = None) -> None:
+        """
+        :param reader: client stream, positioned at the start of the body
+        :param length: Content-Length of the body, None if it is chunked
+        :param timeout: max time between two successive reads, 408 on expiry
+        """
+        self.length = length
+        # max size of a chunked body, 413 when it is read over; a length is checked upfront
+        self.max_size = 0
+        self._reader = reader
+        self._timeout = timeout
+        # bytes left of the body, or of the current chunk if it is chunked
+        self._remaining = length or 0
+        self._received = 0
+        self._done = length is not None and not length
+        # spooled copy of the body
+        self._buffer: Optional[bytes] = None
+        self._file: Optional[BinaryIO] = None
+
+    @property
+    def consumed(self) -> bool:
+        """Return True if the whole body is read from the client stream."""
+        return self._done
+
+    @property
+    def spooled(self) -> bool:
+        """Return True if the body is read ahead and can be iterated again."""
+        return self._buffer is not None or self._file is not None
+
+    async def _read_chunk(self, size: int) -> bytes:
+        try:
+            async with asyncio.timeout(self._timeout):
+                if self.length is None and not self._remaining:
+                    if not (chunk_size := await _read_chunk_size(self._reader)):
+                        await _read_trailers(self._reader)
+                        self._done = True
+                        return EMPTY_BYTES
+                    self._remaining = chunk_size
+                chunk = await self._reader.read(min(size, self._remaining))
+                if not chunk:
+                    raise ClientDisconnected()
+                self._remaining -= len(chunk)
+                if not self._remaining:
+                    if self.length is None:
+                        await _read_chunk_end(self._reader)
+                    else:
+                        self._done = True
+        except TimeoutError:
+            raise RequestTimeout('client_body') from None
+        except asyncio.IncompleteReadError:
+            raise ClientDisconnected() from None
+
+        self._received += len(chunk)
+        if self.max_size and self._received > self.max_size:
+            stats.incr('requests.body_too_large')
+            raise PayloadTooLarge()
+        return chunk
+
+    async def chunks(self, size: int = DEFAULT_BODY_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Yield the body by chunks from the spooled copy or the client stream.
+
+        :raises RuntimeError: if the stream was partially read already
+        :raises PayloadTooLarge: if a chunked body is over max_size
+        """
+        if self._buffer is not None:
+            yield self._buffer
+            return
+
+        if self._file is not None:
+            await file_io.run(self._file.seek, 0)
+            while chunk := await file_io.run(self._file.read, size):
+                yield chunk
+            return
+
+        if self._received or self._done:
+            raise RuntimeError('request body is already read')
+        while not self._done:
+            if chunk := await self._read_chunk(size):
+                yield chunk
+
+    async def framed(self, size: int = DEFAULT_BODY_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Yield the body framed as the request headers say, chunked again if it was chunked."""
+        if self.length is not None:
+            async for chunk in self.chunks(size):
+                yield chunk
+            return
+
+        async for chunk in self.chunks(size):
+            yield b'%x%s%s%s' % (len(chunk), NEWLINE_BYTES, chunk, NEWLINE_BYTES)
+        yield LAST_CHUNK
+
+    async def spool(self, threshold: Optional[int] = None) -> None:
+        """Read the whole body ahead, into memory up to threshold bytes
+        and into a temporary file above it."""
+        if self._buffer is not None or self._file is not None:
+            return
+
+        buffer, file = bytearray(), None
+        try:
+            if threshold is not None and self.length is not None and self.length > threshold:
+                file = await file_io.run(tempfile.TemporaryFile)
+            async for chunk in self.chunks():
+                if file is None:
+                    buffer.extend(chunk)
+                    if threshold is None or len(buffer) <= threshold:
+                        continue
+                    # a chunked body grew over the threshold
+                    file, chunk = await file_io.run(tempfile.TemporaryFile), bytes(buffer)
+                await file_io.run(file.write, chunk)
+        except BaseException:
+            if file is not None:
+                file.close()
+            raise
+
+        if file is None:
+            self._buffer = bytes(buffer)
+            return
+        stats.incr('requests.body_spooled')
+        self._file = file
+
+    async def discard(self, timeout: Optional[float]) -> None:
+        """Read and drop the rest of the body for at most timeout seconds."""
+        try:
+            async with asyncio.timeout(timeout):
+                while not self._done:
+                    await self._read_chunk(DEFAULT_BODY_CHUNK_SIZE)
+        except (TimeoutError, RequestTimeout, ClientDisconnected, BadRequest, PayloadTooLarge, OSError):
+            pass
+
+    def close(self) -> None:
+        """Release the spooled copy."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = None
+
+
+class BodyFile:
+    """A response body sent from a file with sendfile, e.g. a disk cache hit."""
+    __slots__ = ('file', 'offset', 'count')
+
+    def __init__(self, file: BinaryIO, offset: int, count: int) -> None:
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    async def send(self, writer: StreamWriter) -> None:
+        """Send the body, falls back to reads and writes if the transport can not sendfile (TLS)."""
+        await asyncio.get_running_loop().sendfile(writer.transport, self.file, self.offset, self.count)
+
+    def release(self) -> None:
+        """Close the file, safe to call more than once."""
+        self.file.close()
+
+
 class RawHttpMessage:
     """A raw http message."""
 
@@ -55,8 +323,27 @@ class RawHttpMessage:
         self._info = _StatusLine.from_bytes(self._f_line)
 
         # todo headers class
-        self._headers = {name.strip(): val.strip() for name, val in headers} if headers else {}
+        self._headers: dict[bytes, bytes] = {}
+        # lowercase names to their spelling in _headers, names are case-insensitive
+        self._names: dict[bytes, bytes] = {}
+        for name, value in headers or ():
+            self.add_header(name, value)
         self._body = body
+        # client address, set by the server for incoming requests
+        self.remote_addr: Optional[str] = None
+        # monotonic time the request was read at, set by the server
+        self.received_at: float = 0.0
+        # matched location pattern, e.g. b'/static/*', set by the server
+        self.location: Optional[bytes] = None
+        # body left in the client stream, see from_reader(stream_body=True)
+        self.body_stream: Optional[RequestBody] = None
+        # upstream connection of a 101 response, run by the server after the response is written
+        self.tunnel: Optional['Tunnel'] = None
+        # mapped file slice the body points into, released by the server after the response is written
+        self.body_lease: Optional['MappedSlice'] = None
+        # file the body is sent from instead of _body, closed by the server after the response is written;
+        # also an upstream response streamed by the aiohttp client, see ResponseStream
+        self.body_file: Optional[BodyFile] = None
 
     @property
     def info(self) -> _StatusLine:
@@ -82,36 +369,94 @@ class RawHttpMessage:
         return cls(f_line, headers=headers, body=body)
 
     @classmethod
-    async def from_reader(cls, reader: StreamReader) -> 'RawHttpMessage':
-        """Create a Message from a StreamReader buffer"""
-        reader_gen = aiter(reader)
-        try:
-            f_line = await anext(reader_gen)
-        except StopAsyncIteration:
-            return cls(EMPTY_BYTES)
+    async def from_reader(
+        cls,
+        reader: StreamReader,
+        *,
+        idle_timeout: Optional[float] = None,
+        header_timeout: Optional[float] = None,
+        body_timeout: Optional[float] = None,
+        stream_body: bool = False,
+        on_start: Optional[Callable[[], None]] = None,
+    ) -> 'RawHttpMessage':
+        """Create a Message from a StreamReader buffer.
+
+        The body is read up to Content-Length or the last chunk, so the next
+        request on a keep-alive connection can be read from the same reader.
+        A chunked body is decoded and the message gets its Content-Length,
+        with stream_body it is decoded as it is read, see RequestBody.
+
+        :param idle_timeout: max time to wait for the first byte, e.g. on keep-alive
+            connections, header_timeout covers the first line if None
+        :param header_timeout: max time to read the first line and headers
+        :param body_timeout: max time to read the body
+        :param stream_body: do not read the body, leave it in `body_stream` to be read on demand
+        :param on_start: called when the first byte arrives within idle_timeout
+        :raises IdleTimeout: if the first byte does not arrive in idle_timeout
+        :raises RequestTimeout: if the head or the body is not read in time
+        :raises ClientDisconnected: if the stream ends before a message
+        :raises BadRequest: on malformed or ambiguous body framing
+        """
+        f_line = EMPTY_BYTES
+        if idle_timeout is not None:
+            try:
+                async with asyncio.timeout(idle_timeout):
+                    f_line = await reader.read(1)
+            except TimeoutError:
+                raise IdleTimeout('keepalive') from None
+            if not f_line:
+                raise ClientDisconnected()
+            if on_start is not None:
+                on_start()
 
         headers = []
-        async for chunk in reader_gen:
-            if chunk == NEWLINE_BYTES:
-                reader.feed_eof()
-                break
-            header = chunk.strip(NEWLINE_BYTES).split(b':', maxsplit=1)
-            if len(header) == 2:
-                headers.append(header)
-
+        try:
+            async with asyncio.timeout(header_timeout):
+                if not f_line.endswith(b'\n'):
+                    # the rest of the line after the first byte
+                    f_line += await reader.readline()
+                if not f_line:
+                    raise ClientDisconnected()
+
+                while (chunk := await reader.readline()) not in EOF_BYTES:
+                    header = chunk.strip(NEWLINE_BYTES).split(b':', maxsplit=1)
+                    if len(header) != 2:
+                        continue
+                    headers.append(header)
+        except TimeoutError:
+            raise RequestTimeout('client_header') from None
+
+        length, chunked = _body_framing(headers)
         body = b''
-        if not reader.at_eof():
-            async for chunk in reader:
-                body += chunk
-
-        return cls(f_line, headers=headers, body=body)
+        if (length or chunked) and stream_body:
+            message = cls(f_line.rstrip(NEWLINE_BYTES), headers=headers)
+            message.body_stream = RequestBody(reader, None if chunked else length, timeout=body_timeout)
+            return message
+
+        if length or chunked:
+            try:
+                async with asyncio.timeout(body_timeout):
+                    body = await (_read_chunked(reader) if chunked else reader.readexactly(length))
+            except TimeoutError:
+                raise RequestTimeout('client_body') from None
+            except asyncio.IncompleteReadError:
+                raise ClientDisconnected() from None
+
+        if chunked:
+            # decoded, forwarded with a length
+            headers = [header for header in headers if header[0].strip().lower() != b'transfer-encoding']
+            headers.append([CONTENT_LENGTH, str(len(body)).encode()])
+        return cls(f_line.rstrip(NEWLINE_BYTES), headers=headers, body=body)
 
     async def add_body(self, body: bytes):
         """Add a body to the message"""
         self._body += body
 
-    async def fill(self, writer: StreamWriter) -> None:
-        """Fill writer with self buffer. Does NOT close the writer."""
+    async def fill(self, writer: StreamWriter, head_only: bool = False) -> None:
+        """Fill writer with self buffer. Does NOT close the writer.
+
+        :param head_only: do not write the body, e.g. of a response to HEAD
+        """
         # head of the message
         writer.write(b'%s%s' % (self._f_line, NEWLINE_BYTES))
         for header, value in self._headers.items():
@@ -119,59 +464,86 @@ class RawHttpMessage:
         writer.write(NEWLINE_BYTES)
 
         await writer.drain()
-
-        # body
-        if self._body:
+        if head_only:
+            return
+
+        # body, nothing may follow it: the connection is reused for the next
+        # response or, after 101, for the upgraded protocol
+        if self.body_file is not None:
+            await self.body_file.send(writer)
+        elif self._body:
             writer.write(self._body)
             await writer.drain()
 
-        # finishing response
-        writer.write(NEWLINE_BYTES)
-        await writer.drain()
-
-        writer.write(EMPTY_BYTES)
-        await writer.drain()
-
-    @cached_property
-    def raw_bytes(self) -> bytes:
-        """Return the raw bytes of message."""
+    @property
+    def head_bytes(self) -> bytes:
+        """Return the raw bytes of the first line and headers."""
         buffer = bytearray()
         buffer.extend(self._f_line)
         buffer.extend(NEWLINE_BYTES)
         for header, value in self._headers.items():
             buffer.extend(b'%s: %s%s' % (header, value, NEWLINE_BYTES))
         buffer.extend(NEWLINE_BYTES)
+        return buffer
 
+    @cached_property
+    def raw_bytes(self) -> bytes:
+        """Return the raw bytes of message."""
+        buffer = self.head_bytes
         buffer.extend(self._body)
         buffer.extend(NEWLINE_BYTES)
 
         return buffer
 
+    def copy(self) -> 'RawHttpMessage':
+        """Return a copy with its own headers, the body is shared."""
+        obj = copy.copy(self)
+        obj._headers = self._headers.copy()
+        obj._names = self._names.copy()
+        obj.__dict__.pop('raw_bytes', None)
+        return obj
+
     # header class methods
+    def _key(self, header_name: bytes) -> bytes:
+        """Return the spelling of the header in the message, the name itself if there is none."""
+        name = header_name.strip()
+        return self._names.get(name.lower(), name)
+
     def heep_alive(self):
         """Return True if header Connection: keep-alive in headers"""
-        return CONNECTION in self._headers and self._headers[CONNECTION] == KEEP_ALIVE
+        return self.get_header_value(CONNECTION).lower() == KEEP_ALIVE
 
     def add_header(self, header: bytes, value: bytes):
-        """Add a header to the message."""
-        self._headers[header.strip()] = value.strip()
+        """Add a header to the message, replaces the value of the header if it is there."""
+        key = self._key(header)
+        self._headers[key] = value.strip()
+        self._names[key.lower()] = key
+        self.__dict__.pop('raw_bytes', None)
 
     def remove_header(self, header_name: bytes):
         """Remove a header from the message.
         Does not raise KeyError if header is not presented."""
-        self._headers.pop(header_name.strip(), None)
+        if (key := self._names.pop(header_name.strip().lower(), None)) is not None:
+            del self._headers[key]
+        self.__dict__.pop('raw_bytes', None)
 
     def update_header(self, header: bytes, value: bytes):
-        """Update a header to the message."""
-        self._headers[header.strip()] = value.strip()
+        """Update a header to the message, e.g. Host of a request sent to another backend."""
+        self.add_header(header, value)
+
+    def is_upgrade(self) -> bool:
+        """Return True if the request asks for a protocol upgrade, e.g. to WebSocket."""
+        return self.has_header(UPGRADE) and b'upgrade' in self.get_header_value(CONNECTION).lower()
 
     def has_header(self, header_name: bytes):
-        """Return True if header exists."""
-        return header_name in self._headers
+        """Return True if header exists, whatever the case of its name."""
+        return header_name.lower() in self._names
 
     def get_header_value(self, header_name: bytes):
-        """Return value of header"""
-        return self._headers.get(header_name, EMPTY_BYTES)
+        """Return value of header, whatever the case of its name"""
+        if (key := self._names.get(header_name.lower())) is None:
+            return EMPTY_BYTES
+        return self._headers[key]
 
     def __str__(self):
         return f'{self.info.type} {self._f_line.decode().strip()}'
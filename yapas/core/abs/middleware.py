@@ -0,0 +1,32 @@
+from abc import ABC
+from configparser import SectionProxy
+from typing import Optional, Self
+
+from yapas.core.abs.messages import RawHttpMessage
+
+
+class AbstractMiddleware(ABC):
+    """Base class for middlewares.
+
+    Override `process_request` to run before the handler, a returned response
+    short-circuits the handler and the rest of request hooks. Override
+    `process_response` to run after the handler. Hooks which are not
+    overridden are never called.
+    """
+
+    @classmethod
+    def from_conf(cls, section: Optional[SectionProxy]) -> Self:
+        """Create a middleware from its [middleware:<name>] section, if any."""
+        return cls()
+
+    async def process_request(self, request: RawHttpMessage) -> Optional[RawHttpMessage]:
+        """Inspect or modify the request, return a response to short-circuit."""
+        return None
+
+    async def process_response(
+        self,
+        request: RawHttpMessage,
+        response: RawHttpMessage,
+    ) -> RawHttpMessage:
+        """Inspect, modify or replace the response."""
+        return response
@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import logging
 import os
 import signal
@@ -7,9 +8,25 @@ from abc import abstractmethod, ABC
 from asyncio import StreamReader, StreamWriter
 from typing import Optional
 
+from yapas.conf.parser import ConfParser
 from yapas.core.abs.dispatcher import AbstractDispatcher
+from yapas.core.constants import UNIX_SOCKET_PREFIX
+from yapas.core.fileio import (
+    file_io,
+    DEFAULT_WORKERS as DEFAULT_FILE_IO_WORKERS,
+    DEFAULT_MAX_QUEUE as DEFAULT_FILE_IO_MAX_QUEUE,
+)
+from yapas.core.middlewares.pipeline import MiddlewarePipeline
+from yapas.core.server.admission import AdmissionControl
 from yapas.core.signals import kill_event, handle_shutdown, handle_restart
 
+# nginx defaults
+DEFAULT_CLIENT_HEADER_TIMEOUT = 60
+DEFAULT_CLIENT_BODY_TIMEOUT = 60
+DEFAULT_KEEPALIVE_TIMEOUT = 75
+DEFAULT_DRAIN_TIMEOUT = 30
+DEFAULT_CLIENT_MAX_BODY_SIZE = 1024 * 1024
+
 
 class AbstractAsyncServer(ABC):
     """Async Server implementation."""
@@ -21,32 +38,90 @@ class AbstractAsyncServer(ABC):
         port: Optional[int] = 8070,
         log_level: Optional[str] = 'DEBUG',
         ssl_context: Optional[ssl.SSLContext] = None,
-        ssl_handshake_timeout: Optional[int] = None,
+        ssl_handshake_timeout: Optional[float] = None,
+        admission: Optional[AdmissionControl] = None,
+        client_header_timeout: Optional[float] = DEFAULT_CLIENT_HEADER_TIMEOUT,
+        client_body_timeout: Optional[float] = DEFAULT_CLIENT_BODY_TIMEOUT,
+        keepalive_timeout: Optional[float] = DEFAULT_KEEPALIVE_TIMEOUT,
+        conf: Optional[ConfParser] = None,
+        drain_timeout: float = DEFAULT_DRAIN_TIMEOUT,
+        middlewares: Optional[MiddlewarePipeline] = None,
+        client_max_body_size: int = DEFAULT_CLIENT_MAX_BODY_SIZE,
+        file_io_workers: int = DEFAULT_FILE_IO_WORKERS,
+        file_io_max_queue: int = DEFAULT_FILE_IO_MAX_QUEUE,
     ) -> None:
         """
         :param dispatcher: a Dispatcher instance with configured locations
-        :param host: host to bind to
+        :param host: host to bind to, or unix:/path/to.sock to listen on a unix domain socket
         :param port: port to bind to
         :param log_level: logging level, it would be passed to server logger directly
         :param ssl_context: SSL context to use, defaults to None
+        :param ssl_handshake_timeout: max time for the TLS handshake, asyncio default if None
         :param port: port listen to, defaults to 80
+        :param admission: connection and in-flight request limits, unlimited by default
+        :param client_header_timeout: max time to read the request line and headers, 408 on expiry
+        :param client_body_timeout: max time between two successive reads of the request body,
+            408 on expiry
+        :param keepalive_timeout: max time a keep-alive connection waits for the next request
+        :param conf: configuration the dispatcher was created from, re-read on reload
+        :param drain_timeout: max time to wait for in-flight requests on shutdown
+        :param middlewares: middlewares every request goes through, none by default
+        :param client_max_body_size: max request body size, 413 if over, 0 is unlimited;
+            locations may override it
+        :param file_io_workers: threads of the file I/O pool
+        :param file_io_max_queue: max file I/O jobs waiting for a thread, 503 if over
         """
         self.dispatcher = dispatcher
         self._host = host
         self._port = port
         self._ssl_context = ssl_context
         self._ssl_handshake_timeout = ssl_handshake_timeout
+        self.admission = admission or AdmissionControl()
+        self._client_header_timeout = client_header_timeout
+        self._client_body_timeout = client_body_timeout
+        self._keepalive_timeout = keepalive_timeout
+        self._conf = conf
+        self._drain_timeout = drain_timeout
+        self.middlewares = middlewares or MiddlewarePipeline()
+        file_io.configure(file_io_workers, file_io_max_queue)
+        self._client_max_body_size = client_max_body_size
+
+        # connection tasks, and those of them waiting for the next keep-alive request
+        self._connections: set[asyncio.Task] = set()
+        self._idle: set[asyncio.Task] = set()
+        # set on shutdown, responses get Connection: close
+        self._draining = False
+        # connection tasks by the dispatcher they are served with, see reload
+        self._generations: dict[AbstractDispatcher, set[asyncio.Task]] = {}
+        # dispatchers replaced by reload, cleaned up after their connections
+        self._retiring: set[asyncio.Task] = set()
 
         self._log: logging.Logger = logging.getLogger('yapas.server')
         self._log.setLevel(log_level.upper())
         self._server: Optional[asyncio.Server] = None
 
+    @property
+    def _unix_path(self) -> Optional[str]:
+        if self._host.startswith(UNIX_SOCKET_PREFIX):
+            return self._host.removeprefix(UNIX_SOCKET_PREFIX)
+        return None
+
     async def _create_server(self):
         """Create and return asyncio Server without starting it."""
+        if (path := self._unix_path) is not None:
+            # a stale socket file of a previous run is replaced
+            return await asyncio.start_unix_server(
+                self._handle_connection,
+                path,
+                ssl=self._ssl_context,
+                ssl_handshake_timeout=self._ssl_handshake_timeout,
+                start_serving=False,
+            )
         return await asyncio.start_server(
-            self.dispatch,
+            self._handle_connection,
             self._host,
             self._port,
+            ssl=self._ssl_context,
             ssl_handshake_timeout=self._ssl_handshake_timeout,
             start_serving=False,
         )
@@ -60,12 +135,64 @@ class AbstractAsyncServer(ABC):
             self._log.info(f'Restarting...')
 
         self._server = await self._create_server()
-        self._log.info(f'Starting TCP server on {self._host}:{self._port} pid {os.getpid()}')
+        await self.dispatcher.startup()
+        scheme = 'TLS' if self._ssl_context is not None else 'unix' if self._unix_path is not None else 'TCP'
+        address = self._host if self._unix_path is not None else f'{self._host}:{self._port}'
+        self._log.info(f'Starting {scheme} server on {address} pid {os.getpid()}')
         await self._server.start_serving()
 
+    async def reload(self) -> None:
+        """Re-read the configuration and swap the dispatcher without closing the listener.
+
+        New connections get the new dispatcher. Connections of the old one finish
+        their requests on it and are closed, it is cleaned up after them, see _retire.
+        An invalid configuration is logged and the old one stays in use.
+        """
+        if self._conf is None:
+            self._log.warning('Nothing to reload, server was created without configuration')
+            return
+
+        conf = self._conf.fresh()
+        dispatcher = None
+        try:
+            dispatcher = self.dispatcher.fresh(conf)
+            await dispatcher.startup()
+        except Exception as e:
+            if dispatcher is not None:
+                await dispatcher.cleanup()
+            self._log.error(f'Configuration reload failed, keeping the current one: {e!r}')
+            return
+
+        old, self.dispatcher = self.dispatcher, dispatcher
+        self._conf = conf
+        task = asyncio.create_task(self._retire(old))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+        self._log.info('Configuration reloaded')
+
+    async def _retire(self, dispatcher: AbstractDispatcher) -> None:
+        """Clean up a dispatcher replaced by reload once its connections are gone.
+
+        Its idle keep-alive connections are closed now, those reading or handling
+        a request get Connection: close and drain_timeout to finish, then are cancelled.
+        """
+        tasks = self._generations.pop(dispatcher, set())
+        for task in tasks & self._idle:
+            task.cancel()
+
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self._drain_timeout)
+            if pending:
+                self._log.warning(f'Cancelling {len(pending)} connections of the old configuration')
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending)
+
+        await dispatcher.cleanup()
+
     async def _create_listeners(self):
         """Create the loop listeners for SIGINT, SIGTERM (shutdown)
-        and SIGHUP (restart)
+        and SIGHUP (configuration reload)
         """
         loop = asyncio.get_running_loop()
         for sig in (signal.SIGINT, signal.SIGTERM):
@@ -80,9 +207,64 @@ class AbstractAsyncServer(ABC):
             lambda *_: asyncio.create_task(handle_restart(self)),
         )
 
+    async def _handle_connection(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Connection callback, rejects connections over the limit with 503."""
+        if not self.admission.accept():
+            writer.write(self.admission.rejection)
+            writer.close()
+            return
+
+        task = asyncio.current_task()
+        # the connection is served by the same dispatcher even if config is reloaded
+        dispatcher = self.dispatcher
+        self._connections.add(task)
+        self._generations.setdefault(dispatcher, set()).add(task)
+        try:
+            await self.dispatch(reader, writer, dispatcher)
+        except asyncio.CancelledError:
+            # cancelled by _drain or _retire, it is the top of the connection task
+            pass
+        finally:
+            self._connections.discard(task)
+            self._idle.discard(task)
+            if (generation := self._generations.get(dispatcher)) is not None:
+                generation.discard(task)
+            self.admission.release_connection()
+
+    @contextlib.contextmanager
+    def _idle_scope(self):
+        """Mark the connection as waiting for the next keep-alive request, only idle
+        connections are cancelled right away by drain and reload. Yields a callback
+        marking it busy again, to be called on the first byte of the request."""
+        task = asyncio.current_task()
+        self._idle.add(task)
+        try:
+            yield lambda: self._idle.discard(task)
+        finally:
+            self._idle.discard(task)
+
+    async def _drain(self) -> None:
+        """Close idle keep-alive connections and wait up to drain_timeout for requests
+        being read or handled, then cancel what is left."""
+        self._draining = True
+        idle = self._connections & self._idle
+        for task in idle:
+            task.cancel()
+
+        if connections := set(self._connections):
+            self._log.info(f'Draining {len(connections - idle)} connections for up to {self._drain_timeout}s')
+            _, pending = await asyncio.wait(connections, timeout=self._drain_timeout)
+            if pending:
+                self._log.warning(f'Cancelling {len(pending)} connections after drain timeout')
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending)
+
+        self._draining = False
+
     @abstractmethod
-    async def dispatch(self, reader: StreamReader, writer: StreamWriter) -> None:
-        """Dispatch an incoming request"""
+    async def dispatch(self, reader: StreamReader, writer: StreamWriter, dispatcher: AbstractDispatcher) -> None:
+        """Serve the requests of a connection with dispatcher"""
         raise NotImplementedError
 
     async def start(self) -> None:
@@ -92,11 +274,20 @@ class AbstractAsyncServer(ABC):
         await kill_event.wait()
 
     async def shutdown(self) -> None:
-        """Gracefully shutdown the server."""
+        """Gracefully shutdown the server: stop accepting, drain connections, stop background tasks."""
         server = self._server
         if server is None:
             return
 
         server.close()
         self._server = None
+        await self._drain()
+        if self._retiring:
+            # their connections are cancelled by _drain
+            await asyncio.wait(set(self._retiring))
+        await server.wait_closed()
+        if (path := self._unix_path) is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+        await self.dispatcher.cleanup()
         self._log.info('Server closed')
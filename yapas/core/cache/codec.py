@@ -0,0 +1,52 @@
+from typing import Any, Hashable, Optional
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import NEWLINE_BYTES
+
+MESSAGE = b'M'
+BYTES = b'B'
+TUPLE = b'T'
+
+_HEAD_END = NEWLINE_BYTES * 2
+
+
+def encode_key(key: Hashable) -> bytes:
+    """Return the bytes of a key, the same in every process."""
+    return key if isinstance(key, bytes) else repr(key).encode()
+
+
+def encode_head(value: Any) -> Optional[bytes]:
+    """Serialize a cached value without the body of a message, None if its type
+    can not be stored out of process.
+
+    Messages, bytes and tuples of bytes (e.g. Vary header names) are supported.
+    """
+    if isinstance(value, RawHttpMessage):
+        return MESSAGE + value.head_bytes
+    if isinstance(value, (bytes, bytearray)):
+        return BYTES + value
+    if isinstance(value, tuple) and all(isinstance(item, bytes) and b'\0' not in item for item in value):
+        return TUPLE + b'\0'.join(value)
+    return None
+
+
+def encode_value(value: Any) -> Optional[bytes]:
+    """Serialize a cached value with the body of a message, see encode_head."""
+    if (head := encode_head(value)) is None:
+        return None
+    if isinstance(value, RawHttpMessage):
+        return head + value._body
+    return head
+
+
+def decode_value(data: bytes) -> Any:
+    """Deserialize a value of encode_value, or of encode_head with an empty body."""
+    kind, payload = data[:1], data[1:]
+    if kind == BYTES:
+        return payload
+    if kind == TUPLE:
+        return tuple(payload.split(b'\0')) if payload else ()
+
+    head, _, body = payload.partition(_HEAD_END)
+    f_line, *lines = head.split(NEWLINE_BYTES)
+    return RawHttpMessage(f_line, headers=[line.split(b':', 1) for line in lines], body=body)
@@ -0,0 +1,311 @@
+import asyncio
+import collections
+import contextlib
+import hashlib
+import os
+import struct
+import tempfile
+import time
+from configparser import SectionProxy
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Hashable, Optional
+
+from yapas.conf.parser import parse_size
+from yapas.core.abs.messages import RawHttpMessage, BodyFile
+from yapas.core.cache.codec import encode_key, encode_head, decode_value
+from yapas.core.exceptions import ServiceUnavailable
+from yapas.core.fileio import file_io
+from yapas.core.stats import stats
+
+logger = getLogger('yapas.cache.disk')
+
+# nginx proxy_cache_path defaults, max_size is unlimited there
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+DEFAULT_INACTIVE = 600
+DEFAULT_TIMEOUT = 60
+MANAGER_INTERVAL = 10
+
+MAGIC = b'YAPASDC1'
+# magic, expires (unix time), key length, head length; followed by the key, the head and the body
+_HEADER = struct.Struct('<8sdII')
+TMP_DIR = 'tmp'
+
+
+@dataclass(slots=True)
+class DiskEntry:
+    """Index entry of a cache file."""
+    size: int
+    expires: float
+    used_at: float
+
+
+class DiskCache:
+    """Cache tier in files, like nginx proxy_cache_path with levels=1:2.
+
+    A key is stored in <root>/<c>/<ba>/<md5 of the key>, written to a temporary
+    file first and renamed, so readers never see partial files. An in-memory
+    index of the files is rebuilt in the background on startup; until it is
+    complete, index misses look at the disk. The cache manager removes entries
+    not used for `inactive` seconds and the least recently used ones while the
+    files take more than `max_size` bytes.
+
+    Messages are read up to the body, which is sent from the file with sendfile.
+    Reads and writes run in the file I/O pool, lookups are awaited, set() does
+    not wait for the write.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_size: int = DEFAULT_MAX_SIZE,
+        inactive: float = DEFAULT_INACTIVE,
+        timeout: float = DEFAULT_TIMEOUT,
+        interval: float = MANAGER_INTERVAL,
+    ) -> None:
+        self._root = root
+        self._max_size = max_size
+        self._inactive = inactive
+        self._timeout = timeout
+        self._interval = interval
+        self._index: collections.OrderedDict[str, DiskEntry] = collections.OrderedDict()
+        self._indexed = False
+        self._tasks: set[asyncio.Task] = set()
+        self.size = 0
+
+    def __str__(self):
+        return f"<DiskCache root={self._root} entries={len(self._index)} size={self.size}>"
+
+    def __len__(self):
+        return len(self._index)
+
+    @classmethod
+    def from_conf(cls, section: SectionProxy) -> Optional['DiskCache']:
+        """Create from proxy_cache.* options of a proxy location, None if there is no proxy_cache.path."""
+        if (root := section.get('proxy_cache.path')) is None:
+            return None
+        return cls(
+            root,
+            max_size=parse_size(section.get('proxy_cache.max_size', str(DEFAULT_MAX_SIZE))),
+            inactive=section.getfloat('proxy_cache.inactive', DEFAULT_INACTIVE),
+        )
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self._root, digest[-1], digest[-3:-1], digest)
+
+    @staticmethod
+    def _digest(key: bytes) -> str:
+        return hashlib.md5(key, usedforsecurity=False).hexdigest()
+
+    async def startup(self) -> None:
+        """Start rebuilding the index and the cache manager."""
+        for coro in (self._rebuild(), self._manage()):
+            task = asyncio.create_task(coro)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def cleanup(self) -> None:
+        """Stop the background tasks, files stay for the next start."""
+        for task in list(self._tasks):
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def lookup(self, key: Hashable) -> Optional[tuple[Any, float]]:
+        """Return the value and its remaining ttl, None if missing or expired.
+
+        The file is opened and read up to the body in the file I/O pool, the body_file
+        of a message is set to the rest of the file. A busy pool is a miss.
+        """
+        key = encode_key(key)
+        digest = self._digest(key)
+        if (entry := self._index.get(digest)) is None and self._indexed:
+            return None
+
+        now = time.time()
+        if entry is not None and entry.expires <= now:
+            return None
+
+        try:
+            found = await file_io.run(self._open, self._path(digest), key, now)
+        except OSError:
+            if entry is not None:
+                self._forget(digest)
+            return None
+        except ServiceUnavailable:
+            stats.incr('disk_cache.busy')
+            return None
+        if found is None:
+            return None
+
+        value, ttl, size = found
+        if (entry := self._index.get(digest)) is None:
+            # found before the index was rebuilt
+            entry = self._index[digest] = DiskEntry(size, now + ttl, now)
+            self.size += entry.size
+        entry.used_at = now
+        self._index.move_to_end(digest)
+        return value, ttl
+
+    @classmethod
+    def _open(cls, path: str, key: bytes, now: float) -> Optional[tuple[Any, float, int]]:
+        """Read a cache file up to the body, return the value, its ttl and the file size.
+
+        :raises OSError: if the file can not be opened
+        """
+        file = open(path, 'rb')
+        try:
+            size = os.fstat(file.fileno()).st_size
+            found = cls._read(file, key, size, now)
+        except (OSError, ValueError, struct.error):
+            found = None
+        if found is None or not isinstance(found[0], RawHttpMessage) or found[0].body_file is None:
+            file.close()
+        if found is None:
+            return None
+        return *found, size
+
+    @staticmethod
+    def _read(file, key: bytes, size: int, now: float) -> Optional[tuple[Any, float]]:
+        magic, expires, key_len, head_len = _HEADER.unpack(file.read(_HEADER.size))
+        if magic != MAGIC or file.read(key_len) != key or (ttl := expires - now) <= 0:
+            return None
+
+        value = decode_value(file.read(head_len))
+        if isinstance(value, RawHttpMessage):
+            offset = _HEADER.size + key_len + head_len
+            if (count := size - offset) > 0:
+                value.body_file = BodyFile(file, offset, count)
+        return value, ttl
+
+    async def get(self, key: Hashable):
+        if (found := await self.lookup(key)) is None:
+            return None
+        return found[0]
+
+    def set(self, key: Hashable, value, timeout: Optional[float] = None) -> None:
+        """Write the value to disk in the background if it can be stored."""
+        if (head := encode_head(value)) is None:
+            return
+        key = encode_key(key)
+        expires = time.time() + (self._timeout if timeout is None else timeout)
+        parts = [_HEADER.pack(MAGIC, expires, len(key), len(head)), key, head]
+        if isinstance(value, RawHttpMessage):
+            parts.append(value._body)
+
+        task = asyncio.ensure_future(self._store(self._digest(key), parts, expires))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def touch(self, key: Hashable) -> bool:
+        if (entry := self._index.get(self._digest(encode_key(key)))) is None:
+            return False
+        entry.used_at = time.time()
+        return True
+
+    async def _store(self, digest: str, parts: list[bytes], expires: float) -> None:
+        try:
+            size = await file_io.run(self._write, digest, parts)
+        except (OSError, ServiceUnavailable) as exc:
+            stats.incr('disk_cache.write_errors')
+            logger.warning(f'{self._root}: can not store {digest}: {exc!r}')
+            return
+
+        self._forget(digest)
+        self._index[digest] = DiskEntry(size, expires, time.time())
+        self.size += size
+        stats.incr('disk_cache.stores')
+
+    def _write(self, digest: str, parts: list[bytes]) -> int:
+        """Write a cache file atomically, return its size."""
+        path = self._path(digest)
+        tmp_dir = os.path.join(self._root, TMP_DIR)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for part in parts:
+                    f.write(part)
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp)
+            raise
+        return sum(len(part) for part in parts)
+
+    def _forget(self, digest: str) -> None:
+        if (entry := self._index.pop(digest, None)) is not None:
+            self.size -= entry.size
+
+    async def _rebuild(self) -> None:
+        """Index the files left by previous runs, entries found or stored meanwhile win."""
+        started = time.monotonic()
+        scanned = await file_io.run(self._scan)
+        index = collections.OrderedDict(sorted(scanned.items(), key=lambda item: item[1].used_at))
+        for digest, entry in self._index.items():
+            index.pop(digest, None)
+            index[digest] = entry
+        self._index = index
+        self.size = sum(entry.size for entry in index.values())
+        self._indexed = True
+        logger.info(
+            f'Disk cache {self._root}: {len(index)} entries ({self.size / 1024 / 1024:.1f} MiB) '
+            f'indexed in {time.monotonic() - started:.2f}s'
+        )
+
+    def _scan(self) -> dict[str, DiskEntry]:
+        """Walk the cache directory, remove temporary files of interrupted writes."""
+        entries = {}
+        for directory, dirs, names in os.walk(self._root):
+            if directory == os.path.join(self._root, TMP_DIR):
+                for name in names:
+                    with contextlib.suppress(OSError):
+                        os.unlink(os.path.join(directory, name))
+                continue
+
+            for name in names:
+                try:
+                    with open(os.path.join(directory, name), 'rb') as f:
+                        magic, expires, *_ = _HEADER.unpack(f.read(_HEADER.size))
+                        st = os.fstat(f.fileno())
+                except (OSError, struct.error):
+                    continue
+                if magic == MAGIC:
+                    entries[name] = DiskEntry(st.st_size, expires, max(st.st_atime, st.st_mtime))
+        return entries
+
+    async def _manage(self) -> None:
+        """Evict inactive entries and the least recently used ones over max_size."""
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.evict()
+            except ServiceUnavailable:
+                # the file I/O pool is busy, retried on the next round
+                pass
+
+    async def evict(self) -> int:
+        """Remove inactive entries and the oldest ones over max_size, return how many."""
+        now = time.time()
+        victims = []
+        size = self.size
+        for digest, entry in self._index.items():
+            if size <= self._max_size and now - entry.used_at < self._inactive:
+                break
+            victims.append(digest)
+            size -= entry.size
+        if not victims:
+            return 0
+
+        for digest in victims:
+            self._forget(digest)
+        await file_io.run(self._unlink, [self._path(digest) for digest in victims])
+        stats.incr('disk_cache.evictions', len(victims))
+        return len(victims)
+
+    @staticmethod
+    def _unlink(paths: list[str]) -> None:
+        for path in paths:
+            with contextlib.suppress(OSError):
+                os.unlink(path)
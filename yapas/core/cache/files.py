@@ -0,0 +1,231 @@
+import collections
+import os
+import stat
+import time
+from configparser import SectionProxy
+from logging import getLogger
+from typing import Optional
+
+from yapas.core.exceptions import NotFoundError
+from yapas.core.fileio import file_io, open_read, read_into
+from yapas.core.stats import stats
+
+logger = getLogger('yapas.cache.files')
+
+# nginx open_file_cache defaults
+DEFAULT_MAX_SIZE = 1000
+DEFAULT_INACTIVE = 20
+DEFAULT_VALID = 60
+
+
+class FileEntry:
+    """An open file descriptor with the stat result it was validated with,
+    or a negative result if fd is None."""
+    __slots__ = ('path', 'fd', 'size', 'mtime_ns', 'ino', 'validated_at', 'used_at', 'readers', 'evicted')
+
+    def __init__(self, path: str, fd: Optional[int], st: Optional[os.stat_result], now: float) -> None:
+        self.path = path
+        self.fd = fd
+        self.size = st.st_size if st is not None else 0
+        self.mtime_ns = st.st_mtime_ns if st is not None else 0
+        self.ino = st.st_ino if st is not None else 0
+        self.validated_at = now
+        self.used_at = now
+        # reads in progress, the descriptor is closed after the last one if evicted
+        self.readers = 0
+        self.evicted = False
+
+    @property
+    def found(self) -> bool:
+        return self.fd is not None
+
+    def same_file(self, st: os.stat_result) -> bool:
+        return (st.st_ino, st.st_size, st.st_mtime_ns) == (self.ino, self.size, self.mtime_ns)
+
+    def close(self) -> None:
+        """Close the descriptor now or after the reads in progress."""
+        self.evicted = True
+        if self.fd is not None and not self.readers:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _open(path: str, read: bool = False) -> tuple[Optional[int], Optional[os.stat_result], Optional[bytearray]]:
+    """Open a regular file, stat it and optionally read it in one executor job,
+    (None, None, None) if there is no such file."""
+    try:
+        if read:
+            return open_read(path)
+        fd = os.open(path, os.O_RDONLY)
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError, PermissionError):
+        return None, None, None
+
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode):
+        os.close(fd)
+        return None, None, None
+    return fd, st, None
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+class OpenFileCache:
+    """Cache of open file descriptors, sizes and mtimes of static files, like nginx open_file_cache.
+
+    Entries are used without any syscalls for `valid` seconds, then the path is
+    stat'ed again and reopened if the file was replaced or changed. Missing files
+    are cached as well if `errors` is set. Entries not used for `inactive` seconds
+    are closed, at most `max_size` entries are kept (LRU), zero disables caching.
+    Syscalls run in the file I/O pool, a miss opens, stats and reads the file in one job.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        inactive: float = DEFAULT_INACTIVE,
+        valid: float = DEFAULT_VALID,
+        errors: bool = True,
+    ) -> None:
+        self._max_size = max_size
+        self._inactive = inactive
+        self._valid = valid
+        self._errors = errors
+        self._entries: collections.OrderedDict[str, FileEntry] = collections.OrderedDict()
+        self._last_clean = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def from_conf(cls, section: SectionProxy) -> 'OpenFileCache':
+        """Create from open_file_cache.* options of a location section."""
+        if not section.getboolean('open_file_cache', True):
+            return cls(max_size=0)
+        return cls(
+            max_size=section.getint('open_file_cache.max', DEFAULT_MAX_SIZE),
+            inactive=section.getfloat('open_file_cache.inactive', DEFAULT_INACTIVE),
+            valid=section.getfloat('open_file_cache.valid', DEFAULT_VALID),
+            errors=section.getboolean('open_file_cache.errors', True),
+        )
+
+    async def _lookup(self, path: str, read: bool = False) -> tuple[FileEntry, Optional[bytearray]]:
+        """Return an open entry for path, and its content if it was read on a miss.
+
+        :raises NotFoundError: if path is not a readable regular file
+        """
+        now = time.monotonic()
+        self._maybe_cleanup(now)
+
+        data = None
+        if (entry := self._entries.get(path)) is not None:
+            self._entries.move_to_end(path)
+            entry.used_at = now
+            if now - entry.validated_at >= self._valid:
+                entry, data = await self._revalidate(entry, now, read)
+            else:
+                stats.incr('open_file_cache.hits')
+        else:
+            stats.incr('open_file_cache.misses')
+            entry, data = await self._load(path, now, read)
+
+        if not entry.found:
+            raise NotFoundError()
+        return entry, data
+
+    async def open(self, path: str) -> FileEntry:
+        """Return an open entry for path.
+
+        :raises NotFoundError: if path is not a readable regular file
+        """
+        entry, _ = await self._lookup(path)
+        return entry
+
+    async def read(self, path: str) -> bytearray:
+        """Return the content of the file at path.
+
+        :raises NotFoundError: if path is not a readable regular file
+        """
+        entry, data = await self._lookup(path, read=True)
+        if data is not None:
+            if entry.evicted:
+                entry.close()
+            return data
+
+        entry.readers += 1
+        try:
+            # pread does not move the shared offset, so concurrent reads are safe
+            return await file_io.run(read_into, entry.fd, entry.size)
+        finally:
+            entry.readers -= 1
+            if entry.evicted:
+                entry.close()
+
+    async def _load(self, path: str, now: float, read: bool = False) -> tuple[FileEntry, Optional[bytearray]]:
+        fd, st, data = await file_io.run(_open, path, read)
+        entry = FileEntry(path, fd, st, now)
+        if (entry.found or self._errors) and self._max_size:
+            self._store(entry)
+        elif entry.found:
+            # not cached, closed after the read
+            entry.evicted = True
+        return entry, data
+
+    async def _revalidate(
+        self,
+        entry: FileEntry,
+        now: float,
+        read: bool = False,
+    ) -> tuple[FileEntry, Optional[bytearray]]:
+        stats.incr('open_file_cache.revalidations')
+        st = await file_io.run(_stat, entry.path)
+        if entry.evicted:
+            # evicted or replaced by another request during the stat, its descriptor is
+            # closed or about to be; the path must not be removed, it may hold a newer entry
+            entry.close()
+            if (current := self._entries.get(entry.path)) is not None:
+                return current, None
+            return await self._load(entry.path, now, read)
+        if entry.found and st is not None and entry.same_file(st):
+            entry.validated_at = now
+            return entry, None
+        if not entry.found and st is None:
+            entry.validated_at = now
+            return entry, None
+
+        self._remove(entry.path)
+        return await self._load(entry.path, now, read)
+
+    def invalidate(self, path: str) -> None:
+        """Drop the entry of path, the next lookup opens and stats the file again."""
+        self._remove(path)
+
+    def _store(self, entry: FileEntry) -> None:
+        if (old := self._entries.pop(entry.path, None)) is not None:
+            old.close()
+        self._entries[entry.path] = entry
+        while len(self._entries) > self._max_size:
+            _, evicted = self._entries.popitem(last=False)
+            evicted.close()
+
+    def _remove(self, path: str) -> None:
+        if (entry := self._entries.pop(path, None)) is not None:
+            entry.close()
+
+    def _maybe_cleanup(self, now: float) -> None:
+        """Close entries not used for `inactive` seconds, at most once per `inactive`."""
+        if now - self._last_clean < self._inactive:
+            return
+        self._last_clean = now
+        for path in [path for path, entry in self._entries.items() if now - entry.used_at >= self._inactive]:
+            self._remove(path)
+
+    def clear(self) -> None:
+        """Close all entries."""
+        for entry in self._entries.values():
+            entry.close()
+        self._entries.clear()
@@ -0,0 +1,293 @@
+import collections
+import mmap
+import os
+from configparser import SectionProxy
+from logging import getLogger
+from typing import Optional
+
+from yapas.conf.parser import parse_size
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.files import OpenFileCache, FileEntry
+from yapas.core.cache.preload import validators, NOT_MODIFIED
+from yapas.core.cache.singleflight import SingleFlight
+from yapas.core.constants import (
+    OK,
+    ETAG,
+    LAST_MODIFIED,
+    IF_NONE_MATCH,
+    IF_MODIFIED_SINCE,
+    RANGE,
+    IF_RANGE,
+    ACCEPT_RANGES,
+    CONTENT_RANGE,
+    CONTENT_LENGTH,
+)
+from yapas.core.exceptions import NotFoundError
+from yapas.core.fileio import file_io
+from yapas.core.stats import stats
+
+logger = getLogger('yapas.cache.mapped')
+
+# smaller files are cheaper to copy into the memory cache than to map
+DEFAULT_MIN_SIZE = 64 * 1024
+DEFAULT_MAX_FILE_SIZE = 64 * 1024 * 1024
+DEFAULT_MAX_MAPPED = 1024 * 1024 * 1024
+
+PARTIAL_CONTENT = b'HTTP/1.1 206 Partial Content'
+RANGE_NOT_SATISFIABLE = b'HTTP/1.1 416 Range Not Satisfiable'
+
+
+def parse_range(value: bytes, size: int) -> Optional[tuple[int, int]]:
+    """Return [start, end) of a single `bytes=` range of a file of size bytes,
+    None if the whole file should be sent (no, malformed or multiple ranges).
+
+    :raises ValueError: if the range is not satisfiable
+    """
+    unit, _, spec = value.partition(b'=')
+    if unit.strip().lower() != b'bytes' or b',' in spec:
+        return None
+
+    first, sep, last = spec.strip().partition(b'-')
+    if not sep or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+
+    if not first:
+        # suffix range, the last bytes of the file
+        if not (suffix := int(last)):
+            raise ValueError(value)
+        return max(size - suffix, 0), size
+
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size:
+        raise ValueError(value)
+    if end <= start:
+        return None
+    return start, end
+
+
+class MappedFile:
+    """A read-only mapping of a static file shared by the responses serving it.
+
+    Every response body is a slice leased from the mapping, the file is unmapped
+    once it was evicted and the last leased slice was released. The file is mapped
+    with its size at mapping time, not the one the open file cache saw.
+
+    :raises ValueError: if the file is empty
+    """
+    __slots__ = (
+        'path', 'size', 'mtime_ns', 'ino', 'etag', 'last_modified', 'refs', 'evicted', '_fd', '_map', '_view',
+    )
+
+    def __init__(self, path: str, entry: FileEntry) -> None:
+        self.path = path
+        # a descriptor of its own to fstat before leasing, the open file cache may close its one
+        self._fd = os.dup(entry.fd)
+        try:
+            st = os.fstat(self._fd)
+            self._map: Optional[mmap.mmap] = mmap.mmap(self._fd, st.st_size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            os.close(self._fd)
+            raise
+        self._view = memoryview(self._map)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.ino = st.st_ino
+        self.etag, self.last_modified = validators(self.mtime_ns / 1e9, self.size)
+        # leased slices, the mapping is closed after the last one if evicted
+        self.refs = 0
+        self.evicted = False
+
+    def same_file(self, entry: FileEntry) -> bool:
+        return (entry.ino, entry.size, entry.mtime_ns) == (self.ino, self.size, self.mtime_ns)
+
+    def changed(self) -> bool:
+        """Return True if the file was truncated or rewritten in place since it was mapped,
+        reading the mapping past the new end of the file would kill the process with SIGBUS."""
+        st = os.fstat(self._fd)
+        return (st.st_size, st.st_mtime_ns) != (self.size, self.mtime_ns)
+
+    def lease(self, start: int, end: int) -> 'MappedSlice':
+        """Return a zero-copy slice of the file, it must be released after use."""
+        self.refs += 1
+        return MappedSlice(self, self._view[start:end])
+
+    def _unref(self) -> None:
+        self.refs -= 1
+        if self.evicted and not self.refs:
+            self._unmap()
+
+    def close(self) -> None:
+        """Unmap the file now or after the last leased slice is released."""
+        self.evicted = True
+        if not self.refs:
+            self._unmap()
+
+    def _unmap(self) -> None:
+        if self._map is not None:
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                # the transport still buffers the tail of a body written without blocking,
+                # the file is unmapped once it drops the last slice
+                pass
+            self._map = None
+            os.close(self._fd)
+
+
+class MappedSlice:
+    """A memoryview of a mapped file, keeps the mapping alive until released."""
+    __slots__ = ('view', '_file')
+
+    def __init__(self, file: MappedFile, view: memoryview) -> None:
+        self.view = view
+        self._file: Optional[MappedFile] = file
+
+    def __len__(self):
+        return len(self.view)
+
+    def release(self) -> None:
+        """Drop the reference to the mapping, safe to call more than once."""
+        if self._file is not None:
+            self.view.release()
+            self._file._unref()
+            self._file = None
+
+
+class MappedFileCache:
+    """Static files served straight from the page cache through mmap.
+
+    Files between `min_size` and `max_file_size` bytes are mapped on the first
+    request and responses carry memoryview slices of the mapping, so bodies are
+    never copied into Python bytes; a single `Range` is answered with 206.
+    At most `max_mapped` bytes stay mapped (LRU). Mappings are revalidated
+    through the open file cache and replaced if the file changed; evicted ones
+    are unmapped when the last response using them is written.
+
+    Mapped files must be deployed atomically (written aside and renamed): every
+    hit fstats the mapping and remaps a file truncated or rewritten in place, but
+    a response already being written from it can still crash the process.
+    """
+
+    def __init__(
+        self,
+        files: OpenFileCache,
+        min_size: int = DEFAULT_MIN_SIZE,
+        max_file_size: int = DEFAULT_MAX_FILE_SIZE,
+        max_mapped: int = DEFAULT_MAX_MAPPED,
+    ) -> None:
+        self._files = files
+        self._min_size = min_size
+        self._max_file_size = max_file_size
+        self._max_mapped = max_mapped
+        self._mapped: collections.OrderedDict[str, MappedFile] = collections.OrderedDict()
+        self._flight: SingleFlight[MappedFile] = SingleFlight()
+        self.mapped_bytes = 0
+
+    def __len__(self):
+        return len(self._mapped)
+
+    @classmethod
+    def from_conf(cls, files: OpenFileCache, section: SectionProxy) -> Optional['MappedFileCache']:
+        """Create from mmap.* options of a static location, None if mmap is off."""
+        if not section.getboolean('mmap', False):
+            return None
+        return cls(
+            files,
+            min_size=parse_size(section.get('mmap.min_size', str(DEFAULT_MIN_SIZE))),
+            max_file_size=parse_size(section.get('mmap.max_file_size', str(DEFAULT_MAX_FILE_SIZE))),
+            max_mapped=parse_size(section.get('mmap.max_mapped', str(DEFAULT_MAX_MAPPED))),
+        )
+
+    async def get(self, path: str, request: RawHttpMessage) -> Optional[RawHttpMessage]:
+        """Return a response with a mapped body, None if the file is not to be mapped."""
+        try:
+            entry = await self._files.open(path)
+        except NotFoundError:
+            return None
+        if not self._min_size <= entry.size <= self._max_file_size:
+            return None
+
+        if (file := self._mapped.get(path)) is not None and file.same_file(entry):
+            if not file.changed():
+                self._mapped.move_to_end(path)
+                stats.incr('mmap.hits')
+                return self._response(file, request)
+            logger.warning('%s was changed in place while mapped, deploy mapped files by rename', path)
+            stats.incr('mmap.changed')
+            # the open file cache saw the same inode, its size and mtime are stale as well
+            self._remove(path)
+            self._files.invalidate(path)
+            return await self.get(path, request)
+
+        stats.incr('mmap.misses')
+        # the descriptor stays open while it is mapped, even if the entry is evicted meanwhile
+        entry.readers += 1
+        try:
+            file = await self._flight.do(path, lambda: self._map(path, entry))
+        except ValueError:
+            # emptied since it was opened
+            self._files.invalidate(path)
+            return None
+        finally:
+            entry.readers -= 1
+            if entry.evicted:
+                entry.close()
+        if not file.same_file(entry):
+            # changed between the open and the mapping, the mapping has the current size
+            self._files.invalidate(path)
+        return self._response(file, request)
+
+    async def _map(self, path: str, entry: FileEntry) -> MappedFile:
+        file = await file_io.run(MappedFile, path, entry)
+        self._store(file)
+        return file
+
+    @staticmethod
+    def _response(file: MappedFile, request: RawHttpMessage) -> RawHttpMessage:
+        if request.has_header(IF_NONE_MATCH):
+            if file.etag in request.get_header_value(IF_NONE_MATCH):
+                return RawHttpMessage(NOT_MODIFIED, headers=[[ETAG, file.etag]])
+        elif request.get_header_value(IF_MODIFIED_SINCE) == file.last_modified:
+            return RawHttpMessage(NOT_MODIFIED, headers=[[ETAG, file.etag]])
+
+        f_line, start, end = OK, 0, file.size
+        headers = [[ETAG, file.etag], [LAST_MODIFIED, file.last_modified], [ACCEPT_RANGES, b'bytes']]
+        if request.has_header(RANGE) and request.get_header_value(IF_RANGE) in (b'', file.etag):
+            try:
+                byte_range = parse_range(request.get_header_value(RANGE), file.size)
+            except ValueError:
+                headers.append([CONTENT_RANGE, b'bytes */%d' % file.size])
+                headers.append([CONTENT_LENGTH, b'0'])
+                return RawHttpMessage(RANGE_NOT_SATISFIABLE, headers=headers)
+            if byte_range is not None:
+                f_line, (start, end) = PARTIAL_CONTENT, byte_range
+                headers.append([CONTENT_RANGE, b'bytes %d-%d/%d' % (start, end - 1, file.size)])
+
+        body = file.lease(start, end)
+        headers.append([CONTENT_LENGTH, b'%d' % len(body)])
+        response = RawHttpMessage(f_line, headers=headers, body=body.view)
+        response.body_lease = body
+        return response
+
+    def _store(self, file: MappedFile) -> None:
+        self._remove(file.path)
+        self._mapped[file.path] = file
+        self.mapped_bytes += file.size
+        while self.mapped_bytes > self._max_mapped and len(self._mapped) > 1:
+            path, _ = next(iter(self._mapped.items()))
+            stats.incr('mmap.evictions')
+            self._remove(path)
+
+    def _remove(self, path: str) -> None:
+        if (file := self._mapped.pop(path, None)) is not None:
+            self.mapped_bytes -= file.size
+            file.close()
+
+    def clear(self) -> None:
+        """Unmap all files, those in use after their responses are written."""
+        for file in self._mapped.values():
+            file.close()
+        self._mapped.clear()
+        self.mapped_bytes = 0
@@ -58,10 +58,10 @@ class TTLMemoryCache(AbstractCache):
 
         return cache_value.value
 
-    def set(self, key, value):
-        """Set a new value to key"""
+    def set(self, key, value, timeout=None):
+        """Set a new value to key, optionally with its own timeout"""
         with self._mutex:
-            expires = self._timer() + self._timeout
+            expires = self._timer() + (self._timeout if timeout is None else timeout)
             self._storage[key] = CacheValue(expires=expires, value=value)
 
     def _update_expiry(self, key):
@@ -0,0 +1,171 @@
+import gzip
+import os
+import stat
+import time
+from configparser import SectionProxy
+from dataclasses import dataclass
+from email.utils import formatdate
+from logging import getLogger
+from typing import Optional
+
+from yapas.conf.parser import parse_size
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import (
+    OK,
+    ETAG,
+    LAST_MODIFIED,
+    IF_NONE_MATCH,
+    IF_MODIFIED_SINCE,
+    ACCEPT_ENCODING,
+    CONTENT_ENCODING,
+    CONTENT_LENGTH,
+    VARY,
+)
+from yapas.core.fileio import file_io, read_file
+
+logger = getLogger('yapas.cache.preload')
+
+DEFAULT_MAX_FILE_SIZE = 1024 * 1024
+DEFAULT_MEMORY = 64 * 1024 * 1024
+# compressed variants are kept only if they save at least 10%
+GZIP_MIN_RATIO = 0.9
+GZIP_SUFFIXES = frozenset(('.html', '.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.xml'))
+
+NOT_MODIFIED = b'HTTP/1.1 304 Not Modified'
+
+
+@dataclass(slots=True)
+class PreloadedFile:
+    """Responses of a preloaded file, the gzipped one if it is worth it."""
+    response: RawHttpMessage
+    gzipped: Optional[RawHttpMessage]
+    etag: bytes
+    last_modified: bytes
+
+
+@dataclass(slots=True)
+class PreloadReport:
+    files: int = 0
+    gzipped: int = 0
+    size: int = 0
+    too_large: int = 0
+    over_budget: int = 0
+
+
+def validators(mtime: float, size: int) -> tuple[bytes, bytes]:
+    """Return ETag and Last-Modified values like nginx does."""
+    etag = b'"%x-%x"' % (int(mtime), size)
+    return etag, formatdate(mtime, usegmt=True).encode()
+
+
+class StaticPreload:
+    """Static files of a root directory loaded into memory at startup.
+
+    Files up to `max_file_size` are loaded, smallest first, until `memory`
+    bytes (bodies and gzipped variants) are used. Responses carry ETag and
+    Last-Modified, conditional requests get 304, clients accepting gzip get
+    the precompressed variant. Preloaded files are not revalidated, they are
+    loaded again on configuration reload.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_file_size: int = DEFAULT_MAX_FILE_SIZE,
+        memory: int = DEFAULT_MEMORY,
+        gzip_variants: bool = True,
+    ) -> None:
+        self._root = root
+        self._max_file_size = max_file_size
+        self._memory = memory
+        self._gzip = gzip_variants
+        self.files: dict[str, PreloadedFile] = {}
+
+    @classmethod
+    def from_conf(cls, root: str, section: SectionProxy) -> Optional['StaticPreload']:
+        """Create from preload.* options of a static location, None if preload is off."""
+        if not section.getboolean('preload', False):
+            return None
+        return cls(
+            root,
+            max_file_size=parse_size(section.get('preload.max_file_size', str(DEFAULT_MAX_FILE_SIZE))),
+            memory=parse_size(section.get('preload.memory', str(DEFAULT_MEMORY))),
+            gzip_variants=section.getboolean('preload.gzip', True),
+        )
+
+    async def load(self) -> PreloadReport:
+        """Walk the root and load files in the file I/O pool, log a report."""
+        started = time.monotonic()
+        self.files, report = await file_io.run(self._load)
+        logger.info(
+            f'Preloaded {report.files} files ({report.size / 1024:.0f} KiB, {report.gzipped} gzipped) '
+            f'from {self._root} in {time.monotonic() - started:.2f}s, skipped {report.too_large} '
+            f'over {self._max_file_size} bytes and {report.over_budget} over the memory budget'
+        )
+        return report
+
+    def _scan(self) -> list[tuple[str, os.stat_result]]:
+        found = []
+        for dirpath, _, filenames in os.walk(self._root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    found.append((path, st))
+        return found
+
+    def _load(self) -> tuple[dict[str, PreloadedFile], PreloadReport]:
+        files: dict[str, PreloadedFile] = {}
+        report = PreloadReport()
+
+        for path, st in sorted(self._scan(), key=lambda item: item[1].st_size):
+            if st.st_size > self._max_file_size:
+                report.too_large += 1
+                continue
+            if report.size + st.st_size > self._memory:
+                report.over_budget += 1
+                continue
+            try:
+                body = bytes(read_file(path))
+            except OSError:
+                continue
+
+            etag, last_modified = validators(st.st_mtime, st.st_size)
+            headers = [[ETAG, etag], [LAST_MODIFIED, last_modified], [CONTENT_LENGTH, b'%d' % len(body)]]
+            response = RawHttpMessage(OK, headers=headers, body=body)
+            report.size += len(body)
+
+            gzipped = None
+            if self._gzip and os.path.splitext(path)[1] in GZIP_SUFFIXES:
+                compressed = gzip.compress(body, compresslevel=9, mtime=0)
+                if len(compressed) < len(body) * GZIP_MIN_RATIO and report.size + len(compressed) <= self._memory:
+                    gzipped = RawHttpMessage(OK, headers=[
+                        [ETAG, etag], [LAST_MODIFIED, last_modified], [CONTENT_LENGTH, b'%d' % len(compressed)],
+                        [CONTENT_ENCODING, b'gzip'], [VARY, ACCEPT_ENCODING],
+                    ], body=compressed)
+                    response.add_header(VARY, ACCEPT_ENCODING)
+                    report.size += len(compressed)
+                    report.gzipped += 1
+
+            files[path] = PreloadedFile(response, gzipped, etag, last_modified)
+            report.files += 1
+
+        return files, report
+
+    def get(self, path: str, request: RawHttpMessage) -> Optional[RawHttpMessage]:
+        """Return a response for a preloaded file, None if it is not preloaded."""
+        if (file := self.files.get(path)) is None:
+            return None
+
+        if request.has_header(IF_NONE_MATCH):
+            if file.etag in request.get_header_value(IF_NONE_MATCH):
+                return RawHttpMessage(NOT_MODIFIED, headers=[[ETAG, file.etag]])
+        elif request.get_header_value(IF_MODIFIED_SINCE) == file.last_modified:
+            return RawHttpMessage(NOT_MODIFIED, headers=[[ETAG, file.etag]])
+
+        if file.gzipped is not None and b'gzip' in request.get_header_value(ACCEPT_ENCODING):
+            return file.gzipped.copy()
+        return file.response.copy()
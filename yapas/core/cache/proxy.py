@@ -0,0 +1,308 @@
+import asyncio
+import functools
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime, formatdate
+from logging import getLogger
+from typing import Awaitable, Callable, Optional, Hashable
+
+from yapas.core.abs.cache import AbstractCache
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import (
+    HOST,
+    CACHE_CONTROL,
+    EXPIRES,
+    DATE,
+    AGE,
+    VARY,
+    AUTHORIZATION,
+    SET_COOKIE,
+    X_CACHE_STATUS,
+    CONNECTION,
+)
+from yapas.core.stats import stats
+
+logger = getLogger('yapas.cache.proxy')
+
+CACHEABLE_METHODS = (b'GET', b'HEAD')
+CACHEABLE_STATUSES = (b'200', b'203', b'301', b'404', b'410')
+# upstream responses stale-if-error applies to, besides connection errors and timeouts
+ERROR_STATUSES = (b'500', b'502', b'503', b'504')
+
+CacheKey = tuple[bytes, bytes, bytes]
+
+
+@dataclass(slots=True)
+class CacheControl:
+    """Parsed Cache-Control header, only directives a shared cache cares about."""
+    no_store: bool = False
+    no_cache: bool = False
+    private: bool = False
+    public: bool = False
+    must_revalidate: bool = False
+    max_age: Optional[int] = None
+    s_maxage: Optional[int] = None
+    # RFC 5861 extensions, seconds a stale response may still be served
+    stale_while_revalidate: Optional[int] = None
+    stale_if_error: Optional[int] = None
+
+    @classmethod
+    def from_header(cls, value: bytes) -> 'CacheControl':
+        """Parse `Cache-Control: public, max-age=60` like values."""
+        obj = cls()
+        for directive in value.lower().split(b','):
+            name, _, arg = directive.strip().partition(b'=')
+            name = name.replace(b'-', b'_').decode(errors='ignore')
+            if name in ('max_age', 's_maxage', 'stale_while_revalidate', 'stale_if_error'):
+                try:
+                    setattr(obj, name, int(arg.strip(b'"')))
+                except ValueError:
+                    # invalid freshness is treated as stale
+                    setattr(obj, name, 0)
+            elif name in ('no_store', 'no_cache', 'private', 'public', 'must_revalidate'):
+                setattr(obj, name, True)
+            elif name == 'proxy_revalidate':
+                obj.must_revalidate = True
+        return obj
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_http_date(value: bytes) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value.decode()).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+@dataclass(slots=True)
+class CachedResponse:
+    """A stored response, its age and how long it may be served after it went stale."""
+    key: Hashable
+    response: RawHttpMessage
+    age: int
+    lifetime: float
+    stale_while_revalidate: float
+    stale_if_error: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.age < self.lifetime
+
+    @property
+    def revalidating(self) -> bool:
+        """Stale, but may be served while a background request refreshes it."""
+        return not self.fresh and self.age < self.lifetime + self.stale_while_revalidate
+
+    @property
+    def usable_on_error(self) -> bool:
+        """May be served if the upstream fails or times out."""
+        return self.age < self.lifetime + self.stale_if_error
+
+    def release(self) -> None:
+        """Close the file of a response read from disk that is not served."""
+        if self.response.body_file is not None:
+            self.response.body_file.release()
+
+
+class ProxyCache:
+    """Response cache for proxy locations.
+
+    Keys are method, Host and path (with query), responses with `Vary` are
+    stored per values of the listed request headers. Freshness comes from
+    `Cache-Control: s-maxage/max-age` or `Expires`, responses with
+    `no-store`, `no-cache`, `private` or `Set-Cookie` are never stored.
+
+    Stale responses are kept for a grace period: `stale-while-revalidate`
+    seconds they are served while one background request refreshes them, and
+    `stale-if-error` seconds when the upstream fails. The Cache-Control
+    extensions of a response override the defaults of the location,
+    `must-revalidate` disables the defaults. Ages come from the `Date` header,
+    which is added to stored responses without it, so every tier agrees on them.
+    """
+
+    def __init__(
+        self,
+        storage: AbstractCache,
+        valid: float = 0,
+        stale_while_revalidate: float = 0,
+        stale_if_error: float = 0,
+    ) -> None:
+        """
+        :param storage: cache backend, must honor the per-key timeout
+        :param valid: ttl for cacheable responses without explicit freshness, 0 to skip them
+        :param stale_while_revalidate: default grace to serve stale responses while they are refreshed
+        :param stale_if_error: default grace to serve stale responses if the upstream fails
+        """
+        self._storage = storage
+        self._valid = valid
+        self._stale_while_revalidate = stale_while_revalidate
+        self._stale_if_error = stale_if_error
+        # lower tiers on disk are looked up in the file I/O pool, see TieredCache.aget
+        self._aget = getattr(storage, 'aget', None)
+        # background refreshes of stale responses by variant key
+        self._updating: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypass = 0
+
+    def __str__(self):
+        return f"<ProxyCache hits={self.hits} misses={self.misses} bypass={self.bypass}>"
+
+    def make_key(self, request: RawHttpMessage) -> Optional[CacheKey]:
+        """Return the cache key for a request, None if it must bypass the cache."""
+        info = request.info
+        if info.method not in CACHEABLE_METHODS or request.has_header(AUTHORIZATION):
+            self.bypass += 1
+            return None
+
+        if CacheControl.from_header(request.get_header_value(CACHE_CONTROL)).no_store:
+            self.bypass += 1
+            return None
+
+        return info.method, request.get_header_value(HOST), info.path
+
+    @staticmethod
+    def _variant(key: CacheKey, vary: tuple[bytes, ...], request: RawHttpMessage) -> Hashable:
+        if not vary:
+            return key
+        return key, tuple(request.get_header_value(name) for name in vary)
+
+    async def _get(self, key: Hashable):
+        if self._aget is not None:
+            return await self._aget(key)
+        return self._storage.get(key)
+
+    async def lookup(self, key: CacheKey, request: RawHttpMessage) -> Optional[CachedResponse]:
+        """Return the stored response, fresh or within its grace, None if there is none.
+
+        Anything but a fresh response counts as a miss. A stale response read from
+        disk holds its file open, it must be served or released, see CachedResponse.release.
+        """
+        if (vary := await self._get((key, VARY))) is None:
+            response = None
+        else:
+            variant = self._variant(key, vary, request)
+            response = await self._get(variant)
+
+        if response is None:
+            self.misses += 1
+            return None
+
+        cache_control = CacheControl.from_header(response.get_header_value(CACHE_CONTROL))
+        entry = CachedResponse(
+            variant,
+            response,
+            self._age(response, time.time()),
+            self._lifetime(response, cache_control) or 0,
+            *self._grace(cache_control),
+        )
+        if not entry.fresh:
+            self.misses += 1
+        return entry
+
+    def respond(self, entry: CachedResponse, status: bytes = b'HIT') -> RawHttpMessage:
+        """Return a copy of the stored response with its Age and X-Cache-Status."""
+        if entry.fresh:
+            self.hits += 1
+        else:
+            stats.incr('proxy_cache.stale')
+        response = entry.response.copy()
+        response.update_header(AGE, b'%d' % entry.age)
+        response.update_header(X_CACHE_STATUS, status)
+        return response
+
+    async def get(self, key: CacheKey, request: RawHttpMessage) -> Optional[RawHttpMessage]:
+        """Return a copy of the cached response if it is fresh or None."""
+        if (entry := await self.lookup(key, request)) is None:
+            return None
+        if not entry.fresh:
+            entry.release()
+            return None
+        return self.respond(entry)
+
+    def revalidate(self, entry: CachedResponse, fetch: Callable[[], Awaitable]) -> None:
+        """Refresh a stale response in the background, one request per variant at a time."""
+        if entry.key in self._updating:
+            return
+        stats.incr('proxy_cache.updates')
+        task = asyncio.ensure_future(fetch())
+        self._updating[entry.key] = task
+        task.add_done_callback(lambda t: self._updated(entry.key, t))
+
+    async def cleanup(self) -> None:
+        """Cancel the background refreshes, the stale responses stay stored."""
+        tasks = list(self._updating.values())
+        for task in tasks:
+            task.cancel()
+        # a refresh that failed meanwhile is logged by _updated
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _updated(self, key: Hashable, task: asyncio.Task) -> None:
+        del self._updating[key]
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            # the stale response is served until its grace ends
+            logger.warning(f'background update of {key} failed: {exc!r}')
+
+    @staticmethod
+    def _age(response: RawHttpMessage, now: float) -> int:
+        """Seconds since the response was generated, whole like the Age header."""
+        if (date := _parse_http_date(response.get_header_value(DATE))) is None:
+            return 0
+        return int(max(now - date, 0))
+
+    def _lifetime(self, response: RawHttpMessage, cache_control: CacheControl) -> Optional[float]:
+        if cache_control.s_maxage is not None:
+            return cache_control.s_maxage
+        if cache_control.max_age is not None:
+            return cache_control.max_age
+
+        if response.has_header(EXPIRES):
+            if (expires := _parse_http_date(response.get_header_value(EXPIRES))) is None:
+                return None
+            date = _parse_http_date(response.get_header_value(DATE)) or time.time()
+            return expires - date
+
+        return self._valid or None
+
+    def _grace(self, cache_control: CacheControl) -> tuple[float, float]:
+        """Return stale-while-revalidate and stale-if-error seconds of a response."""
+        defaults = (0, 0) if cache_control.must_revalidate else (self._stale_while_revalidate, self._stale_if_error)
+        return (
+            defaults[0] if cache_control.stale_while_revalidate is None else cache_control.stale_while_revalidate,
+            defaults[1] if cache_control.stale_if_error is None else cache_control.stale_if_error,
+        )
+
+    def set(self, key: CacheKey, request: RawHttpMessage, response: RawHttpMessage) -> bool:
+        """Store the response if it is cacheable, return True if stored."""
+        if response.info.status not in CACHEABLE_STATUSES or response.has_header(SET_COOKIE):
+            return False
+
+        vary = tuple(
+            name.strip().lower()
+            for name in response.get_header_value(VARY).split(b',')
+            if name.strip()
+        )
+        if b'*' in vary:
+            return False
+
+        cache_control = CacheControl.from_header(response.get_header_value(CACHE_CONTROL))
+        if cache_control.no_store or cache_control.no_cache or cache_control.private:
+            return False
+
+        now = time.time()
+        if (lifetime := self._lifetime(response, cache_control)) is None:
+            return False
+        if (ttl := lifetime - self._age(response, now)) <= 0:
+            return False
+        # stale responses are kept for the longest grace
+        ttl += max(self._grace(cache_control))
+
+        # the caller keeps modifying its response, e.g. with middleware headers
+        stored = response.copy()
+        # belongs to the connection it came on, the server sets it for each client
+        stored.remove_header(CONNECTION)
+        if not stored.has_header(DATE):
+            stored.add_header(DATE, formatdate(now, usegmt=True).encode())
+        self._storage.set((key, VARY), vary, timeout=ttl)
+        self._storage.set(self._variant(key, vary, request), stored, timeout=ttl)
+        return True
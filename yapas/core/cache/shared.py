@@ -0,0 +1,253 @@
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from configparser import SectionProxy
+from logging import getLogger
+from typing import Any, Hashable, Optional
+
+from yapas.conf.parser import parse_size
+from yapas.core.cache.codec import encode_key, encode_value, decode_value
+from yapas.core.stats import stats
+
+logger = getLogger('yapas.cache.shared')
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+DEFAULT_SHARDS = 16
+DEFAULT_TIMEOUT = 60
+# expected mean entry size, gives the number of index slots per shard
+ENTRY_SIZE_HINT = 4096
+# index slots probed for a key, the oldest one is reused when all are taken
+PROBES = 8
+# reads retried when a writer changes the shard meanwhile
+READ_RETRIES = 4
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+MAGIC = b'YAPASHM1'
+# magic, shards, index slots per shard, data bytes per shard
+_HEADER = struct.Struct('<8sIIQ')
+# seqlock counter, bytes written to the data ring so far
+_SHARD = struct.Struct('<QQ')
+# key hash, ring position, record length, key length, expires (unix time), crc32
+_SLOT = struct.Struct('<QQIIdI4x')
+_ALIGN = 64
+
+
+def _align(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class SharedMemoryCache:
+    """Cache in a memory-mapped arena file shared by all the processes of a host.
+
+    The arena is split into shards by key hash. A shard has a small open
+    addressing index and a data ring: records are appended, so the oldest ones
+    are overwritten first and the arena never outgrows `size`. Writers of a shard
+    exclude each other with a file lock on its header, readers take no locks:
+    the shard is a seqlock, a read is retried if a writer ran meanwhile, and
+    records are verified by key and crc32.
+
+    Keys are hashed with blake2b of their repr, so all the processes agree on
+    them. Messages, bytes and tuples of bytes can be stored, other values are
+    skipped, so the tier stays behind a per-process memory cache.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        size: int = DEFAULT_SIZE,
+        shards: int = DEFAULT_SHARDS,
+        timeout: float = DEFAULT_TIMEOUT,
+        directory: str = SHM_DIR,
+    ) -> None:
+        self.path = os.path.join(directory, f'yapas-{name}.cache')
+        self._timeout = timeout
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._shards, self._slots, self._data_size = self._attach(size, shards)
+            self._shard_size = _align(_SHARD.size) + _align(self._slots * _SLOT.size) + self._data_size
+            self._map = mmap.mmap(self._fd, _align(_HEADER.size) + self._shards * self._shard_size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def __str__(self):
+        return f"<SharedMemoryCache path={self.path} shards={self._shards} size={self._data_size * self._shards}>"
+
+    @classmethod
+    def from_conf(cls, name: str, section: SectionProxy, timeout: float = DEFAULT_TIMEOUT) -> Optional['SharedMemoryCache']:
+        """Create from shared_cache.* options of a location, None if shared_cache is off."""
+        if not section.getboolean('shared_cache', False):
+            return None
+        return cls(
+            name,
+            size=parse_size(section.get('shared_cache.size', str(DEFAULT_SIZE))),
+            shards=section.getint('shared_cache.shards', DEFAULT_SHARDS),
+            timeout=timeout,
+        )
+
+    def _attach(self, size: int, shards: int) -> tuple[int, int, int]:
+        """Initialize the arena or read the geometry of the existing one."""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER.size, 0)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            if len(header) == _HEADER.size:
+                magic, *geometry = _HEADER.unpack(header)
+                if magic == MAGIC:
+                    if (geometry[0], geometry[2]) != (shards, _align(size // shards)):
+                        logger.warning(f'{self.path} exists with another size, it is used as is')
+                    return tuple(geometry)
+
+            data_size = _align(size // shards)
+            slots = max(data_size // ENTRY_SIZE_HINT, PROBES)
+            shard_size = _align(_SHARD.size) + _align(slots * _SLOT.size) + data_size
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, _align(_HEADER.size) + shards * shard_size)
+            os.pwrite(self._fd, _HEADER.pack(MAGIC, shards, slots, data_size), 0)
+            return shards, slots, data_size
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER.size, 0)
+
+    def _locate(self, key: bytes) -> tuple[int, int]:
+        """Return the key hash and the offset of its shard."""
+        digest = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+        return digest, _align(_HEADER.size) + digest % self._shards * self._shard_size
+
+    def _slot_offset(self, shard: int, digest: int, probe: int) -> int:
+        # the low bits of the hash pick the shard, the high ones the slot
+        return shard + _align(_SHARD.size) + ((digest >> 32) + probe) % self._slots * _SLOT.size
+
+    def _read(self, key: bytes) -> Optional[tuple[bytes, float]]:
+        """Return the record of key and its expiry time, None if it is not in the arena."""
+        digest, shard = self._locate(key)
+        data = shard + _align(_SHARD.size) + _align(self._slots * _SLOT.size)
+
+        for _ in range(READ_RETRIES):
+            seq, written = _SHARD.unpack_from(self._map, shard)
+            if seq & 1:
+                # a writer is in the shard
+                continue
+
+            record = None
+            for probe in range(PROBES):
+                slot_digest, pos, length, key_len, expires, crc = _SLOT.unpack_from(
+                    self._map, self._slot_offset(shard, digest, probe))
+                if slot_digest != digest or pos + self._data_size < written:
+                    continue
+                offset = pos % self._data_size
+                record = self._map[data + offset:data + offset + length], key_len, expires, crc
+                break
+
+            if _SHARD.unpack_from(self._map, shard)[0] != seq:
+                continue
+            if record is None:
+                return None
+
+            body, key_len, expires, crc = record
+            if zlib.crc32(body) != crc or body[:key_len] != key:
+                return None
+            return body[key_len:], expires
+        return None
+
+    def lookup(self, key: Hashable) -> Optional[tuple[Any, float]]:
+        """Return the value and its remaining ttl, None if missing or expired."""
+        if (found := self._read(encode_key(key))) is None:
+            return None
+        data, expires = found
+        if (ttl := expires - time.time()) <= 0:
+            return None
+        return decode_value(data), ttl
+
+    def get(self, key: Hashable):
+        if (found := self.lookup(key)) is None:
+            return None
+        return found[0]
+
+    def set(self, key: Hashable, value, timeout: Optional[float] = None) -> None:
+        """Store the value if it can be shared and fits in a half of a shard."""
+        if (data := encode_value(value)) is None:
+            return
+        key = encode_key(key)
+        record = key + data
+        if len(record) > self._data_size // 2:
+            stats.incr('shared_cache.too_large')
+            return
+
+        expires = time.time() + (self._timeout if timeout is None else timeout)
+        digest, shard = self._locate(key)
+        with self._locked(shard):
+            seq, written = _SHARD.unpack_from(self._map, shard)
+            # odd while writing, readers retry; left odd by a writer that crashed,
+            # it is made even again instead of staying odd forever
+            odd = seq | 1
+            _SHARD.pack_into(self._map, shard, odd, written)
+            try:
+                written = self._append(shard, digest, len(key), record, expires, written)
+            finally:
+                _SHARD.pack_into(self._map, shard, odd + 1, written)
+        stats.incr('shared_cache.stores')
+
+    def _append(self, shard: int, digest: int, key_len: int, record: bytes, expires: float, written: int) -> int:
+        """Write the record to the data ring and index it, return the new ring position."""
+        offset = written % self._data_size
+        if offset + len(record) > self._data_size:
+            # records are never split, the tail of the ring is skipped
+            written += self._data_size - offset
+            offset = 0
+
+        data = shard + _align(_SHARD.size) + _align(self._slots * _SLOT.size) + offset
+        self._map[data:data + len(record)] = record
+        _SLOT.pack_into(
+            self._map, self._choose_slot(shard, digest, written + len(record)),
+            digest, written, len(record), key_len, expires, zlib.crc32(record),
+        )
+        return written + len(record)
+
+    def _choose_slot(self, shard: int, digest: int, written: int) -> int:
+        """Return the slot of the key, a free one or the oldest of the probed ones."""
+        oldest, oldest_pos = 0, None
+        for probe in range(PROBES):
+            offset = self._slot_offset(shard, digest, probe)
+            slot_digest, pos, *_ = _SLOT.unpack_from(self._map, offset)
+            if slot_digest == digest or not slot_digest or pos + self._data_size < written:
+                return offset
+            if oldest_pos is None or pos < oldest_pos:
+                oldest, oldest_pos = offset, pos
+        stats.incr('shared_cache.evictions')
+        return oldest
+
+    def touch(self, key: Hashable) -> bool:
+        """Extend the expiry of a stored value by the default timeout."""
+        key = encode_key(key)
+        digest, shard = self._locate(key)
+        with self._locked(shard):
+            _, written = _SHARD.unpack_from(self._map, shard)
+            for probe in range(PROBES):
+                offset = self._slot_offset(shard, digest, probe)
+                slot_digest, pos, length, key_len, _, crc = _SLOT.unpack_from(self._map, offset)
+                if slot_digest == digest and pos + self._data_size >= written:
+                    _SLOT.pack_into(self._map, offset, digest, pos, length, key_len, time.time() + self._timeout, crc)
+                    return True
+        return False
+
+    @contextlib.contextmanager
+    def _locked(self, shard: int):
+        """Exclude writers of the shard in other processes."""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _SHARD.size, shard)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _SHARD.size, shard)
+
+    def close(self) -> None:
+        """Unmap the arena, it stays on the host for the other processes."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            os.close(self._fd)
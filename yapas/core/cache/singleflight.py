@@ -0,0 +1,39 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight[_VT]:
+    """Deduplicate concurrent calls for the same key.
+
+    The first caller for a key starts the work, callers arriving while it is
+    running await the same task and get the same result or exception.
+    The work runs in its own task, so cancelling one caller does not cancel
+    the others.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def __str__(self):
+        return f"<SingleFlight calls={self.calls} shared={self.shared} in_flight={len(self._calls)}>"
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark the exception retrieved if every caller was cancelled
+            task.exception()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[_VT]]) -> _VT:
+        """Return the result of func(), sharing it with concurrent callers of the same key."""
+        if (task := self._calls.get(key)) is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+
+        return await asyncio.shield(task)
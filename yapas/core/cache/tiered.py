@@ -0,0 +1,81 @@
+import inspect
+from typing import Hashable, Optional
+
+from yapas.core.abs.cache import AbstractCache, AbstractCacheTier, AbstractAsyncCacheTier
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.stats import stats
+
+
+class TieredCache(AbstractCache):
+    """A per-process memory cache in front of lower tiers, e.g. shared memory or disk.
+
+    Values are written through to every tier. A value found in a lower tier is
+    copied to the tiers above it for its remaining ttl, except for messages
+    sent from a file (body_file), which stay on disk. Hits of every tier and
+    misses of all of them are counted as `<name>.<tier>.hits` and `<name>.misses`.
+
+    Tiers with an async lookup (disk) are looked up only by `aget`,
+    `get` skips them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        memory: AbstractCache,
+        tiers: list[tuple[str, AbstractCacheTier | AbstractAsyncCacheTier]],
+    ) -> None:
+        self._name = name
+        self._memory = memory
+        self._tiers = tiers
+        self._async_tiers = {tier_name for tier_name, tier in tiers if inspect.iscoroutinefunction(tier.lookup)}
+
+    def get(self, key: Hashable):
+        if (value := self._memory.get(key)) is not None:
+            stats.incr(f'{self._name}.memory.hits')
+            return value
+
+        for index, (tier_name, tier) in enumerate(self._tiers):
+            if tier_name in self._async_tiers:
+                continue
+            if (found := tier.lookup(key)) is not None:
+                return self._hit(key, index, found)
+
+        stats.incr(f'{self._name}.misses')
+        return None
+
+    async def aget(self, key: Hashable):
+        """Like get, the async tiers are looked up too."""
+        if (value := self._memory.get(key)) is not None:
+            stats.incr(f'{self._name}.memory.hits')
+            return value
+
+        for index, (tier_name, tier) in enumerate(self._tiers):
+            found = await tier.lookup(key) if tier_name in self._async_tiers else tier.lookup(key)
+            if found is not None:
+                return self._hit(key, index, found)
+
+        stats.incr(f'{self._name}.misses')
+        return None
+
+    def _hit(self, key: Hashable, index: int, found: tuple):
+        """Count a hit of a lower tier and copy the value to the tiers above it."""
+        tier_name, _ = self._tiers[index]
+        stats.incr(f'{self._name}.{tier_name}.hits')
+        value, ttl = found
+        if isinstance(value, RawHttpMessage) and value.body_file is not None:
+            return value
+        self._memory.set(key, value, timeout=ttl)
+        for _, upper in self._tiers[:index]:
+            upper.set(key, value, timeout=ttl)
+        return value
+
+    def set(self, key: Hashable, value, timeout: Optional[float] = None) -> None:
+        self._memory.set(key, value, timeout=timeout)
+        for _, tier in self._tiers:
+            tier.set(key, value, timeout=timeout)
+
+    def touch(self, key: Hashable) -> bool:
+        touched = self._memory.touch(key)
+        for _, tier in self._tiers:
+            touched = tier.touch(key) or touched
+        return touched
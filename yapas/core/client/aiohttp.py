@@ -1,59 +1,282 @@
+import asyncio
+import contextlib
+import ssl
+from asyncio import StreamWriter
+from configparser import SectionProxy
+from logging import getLogger
+from typing import Optional
+
 import aiohttp
-from aiohttp.http_writer import HttpVersion
+from yarl import URL
 
-from yapas.core.abs.client import AbstractClient
+from yapas.core.abs.client import AbstractClient, ConnectTimeout, ReadTimeout, DEFAULT_CLIENT_TIMEOUT
 from yapas.core.abs.messages import RawHttpMessage
-from yapas.core.constants import NEWLINE_BYTES
+from yapas.core.constants import NEWLINE_BYTES, CONTENT_LENGTH, UNIX_SOCKET_PREFIX, LAST_CHUNK
+from yapas.core.exceptions import DispatchException
+from yapas.core.stats import stats
+
+logger = getLogger('yapas.core.client')
+
+# aiohttp defaults, keep-alive is longer to outlive short gaps between bursts
+DEFAULT_LIMIT = 100
+DEFAULT_LIMIT_PER_HOST = 0
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+DEFAULT_DNS_CACHE_TTL = 10
+
+TRANSFER_ENCODING = b'Transfer-Encoding'
+CHUNKED = b'chunked'
+# request headers of the client connection, not forwarded to the pooled upstream ones
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade'}
+# response headers of the pooled connection and the upstream framing
+RESPONSE_HOP_BY_HOP = (b'connection', b'keep-alive', b'transfer-encoding')
+# responses without a body whatever their headers say
+NO_BODY_STATUSES = (204, 304)
+# exchanges of streams released unsent, ended in the background
+_ending: set[asyncio.Task] = set()
+
+
+class ResponseStream:
+    """Body of an upstream response sent to the client as it arrives, set as body_file.
+
+    The handler hands it the rest of the upstream exchange (slot, accounting), which
+    ends with the body: a failure halfway counts against the backend.
+    """
+    __slots__ = ('_response', '_chunked', 'exchange')
+
+    def __init__(self, response: aiohttp.ClientResponse, chunked: bool) -> None:
+        self._response = response
+        # re-chunked: the upstream body is chunked or delimited by the connection close
+        self._chunked = chunked
+        # exited once the body is sent or released, see ProxyHandler._send
+        self.exchange: Optional[contextlib.AsyncExitStack] = None
 
+    async def send(self, writer: StreamWriter) -> None:
+        """Send the body, an upstream failure halfway closes the client connection."""
+        try:
+            async for chunk in self._response.content.iter_any():
+                if self._chunked:
+                    writer.write(b'%x%s%s%s' % (len(chunk), NEWLINE_BYTES, chunk, NEWLINE_BYTES))
+                else:
+                    writer.write(chunk)
+                await writer.drain()
+            if self._chunked:
+                writer.write(LAST_CHUNK)
+                await writer.drain()
+        except (aiohttp.ClientError, TimeoutError) as exc:
+            # the head is sent already, the client sees a truncated response
+            stats.incr('upstream.body_errors')
+            logger.warning(f'{self._response.url} body failed: {exc!r}')
+            writer.close()
+            await self._end(exc if isinstance(exc, TimeoutError) else ConnectionError(exc))
+            return
+        except BaseException:
+            # the client went away, tells nothing about the upstream
+            await self._end(asyncio.CancelledError())
+            raise
+        await self._end()
 
-def resolve_version(v: HttpVersion) -> str:
-    """Return string representation of HttpVersion."""
-    return f'HTTP/{v.major}.{v.minor}'
+    async def _end(self, error: Optional[BaseException] = None) -> None:
+        """Exit the exchange, with the error the body failed with if any."""
+        if (exchange := self.exchange) is None:
+            return
+        self.exchange = None
+        if error is None:
+            await exchange.aclose()
+            return
+        # converted to 502/504 and counted, nobody is left to see it
+        with contextlib.suppress(DispatchException, OSError, TimeoutError, asyncio.CancelledError):
+            await exchange.__aexit__(type(error), error, error.__traceback__)
+
+    def release(self) -> None:
+        """Return the upstream connection to the pool, or close it if the body is not read."""
+        self._response.release()
+        if self.exchange is not None:
+            # not sent, e.g. the response lost a hedge
+            task = asyncio.ensure_future(self._end(asyncio.CancelledError()))
+            _ending.add(task)
+            task.add_done_callback(_ending.discard)
 
 
 class AIOHttpClient(AbstractClient):
-    """AioHttp based client"""
-
-    async def encode(self, response) -> bytes:
-        """Encode proxied response to bytes"""
-        # the first status line
-        status_line = resolve_version(response.version), response.status, response.reason
-        status_line = ' '.join(map(lambda s: str(s), status_line)).encode()
-        print(f'{status_line=}')
-        # headers
-        headers = response.headers
-        byte_header_list: list[bytes] = []
-        for header in headers.keys():
-            h_val = headers.getall(header)
-            print(f'header: {header}, len: {len(h_val)}')
-            encoded = '; '.join(h_val).encode()
-
-            if header.lower() == 'set-cookie':
-                self._expand_cookie, *_ = encoded.split(b';')
-
-            header_tuple = header.encode(), encoded
-            # print(f'{header_tuple=}')
-            byte_header_list.append(
-                b'%s: %s' % header_tuple
-            )
+    """Upstream client on a long-lived aiohttp session with pooled keep-alive connections.
+
+    One client serves all backends of an upstream, the connector limits the
+    connections to `limit` in total and `limit_per_host` per backend (0 is no
+    limit), keeps idle ones for `keepalive_timeout` seconds and caches DNS
+    answers for `dns_cache_ttl` seconds. Unix socket backends get a session
+    of their own. Bodies are forwarded as they are, without decompression.
+    """
+
+    def __init__(
+        self,
+        base_url: str = 'http://localhost:8000',
+        ssl_context: Optional[ssl.SSLContext] = None,
+        timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
+        connect_timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
+        limit: int = DEFAULT_LIMIT,
+        limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl: Optional[int] = DEFAULT_DNS_CACHE_TTL,
+    ) -> None:
+        super().__init__(base_url, ssl_context, timeout, connect_timeout)
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+        # by unix socket path, None for the TCP one; created on first use, in the serving loop
+        self._sessions: dict[Optional[str], aiohttp.ClientSession] = {}
 
-        if self._expand_cookie:
-            print(f'{self._expand_cookie}')
-            byte_header_list.append(b'Cookie: %s' % self._expand_cookie)
+    def __str__(self):
+        return f"<AIOHttpClient limit={self._limit} sessions={len(self._sessions)}>"
 
-        byte_headers = NEWLINE_BYTES.join(byte_header_list)
+    @classmethod
+    def from_conf(cls, section: Optional[SectionProxy]) -> 'AIOHttpClient':
+        """Create from client.* options of an [upstream:<name>] section, defaults if None."""
+        if section is None:
+            return cls()
+        return cls(
+            limit=section.getint('client.limit', DEFAULT_LIMIT),
+            limit_per_host=section.getint('client.limit_per_host', DEFAULT_LIMIT_PER_HOST),
+            keepalive_timeout=section.getfloat('client.keepalive_timeout', DEFAULT_KEEPALIVE_TIMEOUT),
+            dns_cache_ttl=section.getint('client.dns_cache_ttl', DEFAULT_DNS_CACHE_TTL),
+        )
 
-        # body
-        content = await response.read()
-        return NEWLINE_BYTES.join((status_line, byte_headers, NEWLINE_BYTES, content))
+    def _session(self, unix_path: Optional[str]) -> aiohttp.ClientSession:
+        if (session := self._sessions.get(unix_path)) is not None and not session.closed:
+            return session
+
+        if unix_path is not None:
+            connector = aiohttp.UnixConnector(
+                path=unix_path,
+                limit=self._limit,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+        else:
+            connector = aiohttp.TCPConnector(
+                limit=self._limit,
+                limit_per_host=self._limit_per_host,
+                keepalive_timeout=self._keepalive_timeout,
+                use_dns_cache=self._dns_cache_ttl is not None,
+                ttl_dns_cache=self._dns_cache_ttl,
+                ssl=self._ssl_ctx if self._ssl_ctx is not None else True,
+            )
+        session = self._sessions[unix_path] = aiohttp.ClientSession(
+            connector=connector,
+            auto_decompress=False,
+            # the request goes as the client sent it
+            skip_auto_headers=('User-Agent', 'Accept', 'Accept-Encoding'),
+        )
+        return session
 
+    @contextlib.asynccontextmanager
     async def get_session(self):
-        return aiohttp.ClientSession(base_url=self._base_url)
-
-    # todo переделать на message
-    async def _raw_request(self, message: RawHttpMessage, method='get') -> bytes:
-        """Send Raw proxied request"""
-        url = message.info.path.decode()
-        async with self.get_session() as session:
-            async with session.request(method, url, data=message.raw_bytes) as resp:
-                return await self.encode(resp)
+        """Yield the shared session of base_url, it stays open."""
+        yield self._session(self._unix_path(self._base_url))
+
+    @staticmethod
+    def _unix_path(base_url: str) -> Optional[str]:
+        if base_url.startswith(UNIX_SOCKET_PREFIX):
+            return base_url.removeprefix(UNIX_SOCKET_PREFIX)
+        return None
+
+    async def close(self) -> None:
+        """Close the pooled connections."""
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+    async def _raw_request(self, message: RawHttpMessage) -> RawHttpMessage:
+        return await self.send(self._base_url, message, timeout=self._timeout, connect_timeout=self._connect_timeout)
+
+    async def send(
+        self,
+        base_url: str,
+        message: RawHttpMessage,
+        *,
+        timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
+        connect_timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
+        stream: bool = False,
+    ) -> RawHttpMessage:
+        """Send the request to base_url on a pooled connection.
+
+        :param timeout: max time between two successive reads of the response
+        :param connect_timeout: max time to get a connection, from the pool or a new one
+        :param stream: send the body to the client as it arrives, see ResponseStream;
+            otherwise it is read into the message
+        :raises ConnectTimeout: if there is no connection in connect_timeout
+        :raises ReadTimeout: if the upstream did not send data in timeout
+        :raises ConnectionError: if the upstream failed or closed the connection
+        """
+        if (unix_path := self._unix_path(base_url)) is not None:
+            base_url = 'http://localhost'
+        session = self._session(unix_path)
+
+        headers = [
+            (name.decode('latin-1'), value.decode('latin-1'))
+            for name, value in message._headers.items()
+            if name.lower().decode('latin-1') not in HOP_BY_HOP
+        ]
+        if (body := message.body_stream) is not None:
+            data = body.chunks()
+        else:
+            data = message._body or None
+
+        try:
+            response = await session.request(
+                message.info.method.decode(),
+                URL(base_url + message.info.path.decode('latin-1'), encoded=True),
+                headers=headers,
+                data=data,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=timeout),
+            )
+        except aiohttp.ConnectionTimeoutError:
+            raise ConnectTimeout(base_url) from None
+        except aiohttp.ServerTimeoutError:
+            raise ReadTimeout(base_url) from None
+        except aiohttp.ClientError as exc:
+            if isinstance(exc.__cause__, DispatchException):
+                # reading the request body failed, e.g. 408 or 413, not the upstream
+                raise exc.__cause__ from None
+            raise ConnectionError(f'{base_url}: {exc}') from exc
+
+        try:
+            return await self._message(message, response, stream)
+        except BaseException:
+            response.release()
+            raise
+
+    async def _message(self, request: RawHttpMessage, response: aiohttp.ClientResponse, stream: bool) -> RawHttpMessage:
+        """Build the response message from the parsed head, no bytes are parsed twice."""
+        headers = [
+            [name, value] for name, value in response.raw_headers
+            if name.lower() not in RESPONSE_HOP_BY_HOP
+        ]
+
+        f_line = b'HTTP/%d.%d %d %s' % (*response.version, response.status, (response.reason or '').encode('latin-1'))
+        if request.info.method == b'HEAD' or response.status in NO_BODY_STATUSES or response.status < 200:
+            response.release()
+            return RawHttpMessage(f_line, headers=headers)
+
+        length = response.headers.get('Content-Length')
+        if stream:
+            message = RawHttpMessage(f_line, headers=headers)
+            if length is None:
+                message.add_header(TRANSFER_ENCODING, CHUNKED)
+            message.body_file = ResponseStream(response, chunked=length is None)
+            return message
+
+        try:
+            body = await response.read()
+        except aiohttp.ServerTimeoutError:
+            raise ReadTimeout(str(response.url)) from None
+        except aiohttp.ClientError as exc:
+            raise ConnectionError(f'{response.url}: {exc}') from exc
+        finally:
+            response.release()
+
+        message = RawHttpMessage(f_line, headers=headers, body=body)
+        if length is None:
+            # de-chunked by aiohttp
+            message.add_header(CONTENT_LENGTH, str(len(body)).encode())
+        return message
@@ -4,7 +4,13 @@ import socket
 import ssl
 from typing import Optional
 
-from yapas.core.abs.client import AbstractSession, AbstractClient
+from yapas.core.abs.client import (
+    AbstractSession,
+    AbstractClient,
+    ConnectTimeout,
+    ReadTimeout,
+    DEFAULT_CLIENT_TIMEOUT,
+)
 from yapas.core.abs.messages import RawHttpMessage
 from yapas.core.constants import EMPTY_BYTES
 
@@ -16,9 +22,11 @@ class SocketSession(AbstractSession):
         self,
         base_url: str = '0.0.0.0:8000',
         ssl_context: Optional[ssl.SSLContext] = None,
-        loop: Optional[asyncio.AbstractEventLoop] = None
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
+        connect_timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT,
     ) -> None:
-        super().__init__(base_url, ssl_context, loop)
+        super().__init__(base_url, ssl_context, loop, timeout, connect_timeout)
         self._conn: Optional[socket.socket] = None
 
     async def _close(self):
@@ -27,8 +35,22 @@ class SocketSession(AbstractSession):
         self._conn = None
 
     async def _connect(self):
-        self._conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        await self._loop.sock_connect(self._conn, (self._host, self._port))
+        if self._unix_path is not None:
+            family, address = socket.AF_UNIX, self._unix_path
+        else:
+            family, address = socket.AF_INET, (self._host, self._port)
+        self._conn = socket.socket(family, socket.SOCK_STREAM)
+        self._conn.setblocking(False)
+        try:
+            async with asyncio.timeout(self._connect_timeout):
+                await self._loop.sock_connect(self._conn, address)
+        except TimeoutError:
+            await self._close()
+            raise ConnectTimeout(self._base_url) from None
+        except BaseException:
+            # __aexit__ is not called if __aenter__ fails
+            await self._close()
+            raise
 
     async def _wrapped_sock(self):
         if self._ssl_context is None:
@@ -38,16 +60,26 @@ class SocketSession(AbstractSession):
     async def request(self, message: RawHttpMessage) -> RawHttpMessage:
         """Send raw request bytes via stram socket and read socket buffer for response"""
         conn = await self._wrapped_sock()  # ssl context
-        await self._loop.sock_sendall(conn, message.raw_bytes)
+        if (body := message.body_stream) is None:
+            await self._loop.sock_sendall(conn, message.raw_bytes)
+        else:
+            # forward the body as it arrives from the client
+            await self._loop.sock_sendall(conn, message.head_bytes)
+            async for chunk in body.framed():
+                await self._loop.sock_sendall(conn, chunk)
 
-        response = EMPTY_BYTES
+        response = bytearray()
         while True:
-            data = await self._loop.sock_recv(conn, 4096)
+            try:
+                async with asyncio.timeout(self._timeout):
+                    data = await self._loop.sock_recv(conn, 4096)
+            except TimeoutError:
+                raise ReadTimeout(self._base_url) from None
             response += data
             if data == EMPTY_BYTES:
                 break
 
-        return await RawHttpMessage.from_bytes(response)
+        return await RawHttpMessage.from_bytes(bytes(response))
 
 
 class SocketClient(AbstractClient):
@@ -55,5 +87,10 @@ class SocketClient(AbstractClient):
 
     @contextlib.asynccontextmanager
     async def get_session(self):
-        async with SocketSession(base_url=self._base_url, ssl_context=self._ssl_ctx) as session:
+        async with SocketSession(
+            base_url=self._base_url,
+            ssl_context=self._ssl_ctx,
+            timeout=self._timeout,
+            connect_timeout=self._connect_timeout,
+        ) as session:
             yield session
@@ -9,10 +9,40 @@ EOF_BYTES: Final = (EMPTY_BYTES, NEWLINE_BYTES)
 
 OK: Final = b'HTTP/1.1 200 OK'
 
+# listen address and upstream url prefix of unix domain sockets, e.g. unix:/run/app.sock
+UNIX_SOCKET_PREFIX: Final = 'unix:'
+
 # headers
 CONNECTION: Final = b'Connection'
 KEEP_ALIVE: Final = b'keep-alive'
+CLOSE: Final = b'close'
+UPGRADE: Final = b'Upgrade'
+CONTENT_LENGTH: Final = b'Content-Length'
+TRANSFER_ENCODING: Final = b'Transfer-Encoding'
+CHUNKED: Final = b'chunked'
+LAST_CHUNK: Final = b'0\r\n\r\n'
+SWITCHING_PROTOCOLS: Final = b'101'
 
 PROXY_FORWARDED_FOR: Final = b'X-Forwarded-For'
 HOST: Final = b'Host'
 REFERER: Final = b'Referer'
+
+CACHE_CONTROL: Final = b'Cache-Control'
+EXPIRES: Final = b'Expires'
+DATE: Final = b'Date'
+AGE: Final = b'Age'
+VARY: Final = b'Vary'
+AUTHORIZATION: Final = b'Authorization'
+SET_COOKIE: Final = b'Set-Cookie'
+X_CACHE_STATUS: Final = b'X-Cache-Status'
+RETRY_AFTER: Final = b'Retry-After'
+ETAG: Final = b'ETag'
+LAST_MODIFIED: Final = b'Last-Modified'
+IF_NONE_MATCH: Final = b'If-None-Match'
+IF_MODIFIED_SINCE: Final = b'If-Modified-Since'
+ACCEPT_ENCODING: Final = b'Accept-Encoding'
+CONTENT_ENCODING: Final = b'Content-Encoding'
+RANGE: Final = b'Range'
+IF_RANGE: Final = b'If-Range'
+ACCEPT_RANGES: Final = b'Accept-Ranges'
+CONTENT_RANGE: Final = b'Content-Range'
@@ -1,10 +1,33 @@
-from yapas.conf.parser import ConfParser
+import functools
+from configparser import ConfigParser, SectionProxy
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+from yapas.conf.parser import ConfParser, parse_size
+from yapas.core.abs.cache import AbstractCache
 from yapas.core.abs.dispatcher import AbstractDispatcher
 from yapas.core.abs.handlers import HandlerCallable
+from yapas.core.cache.disk import DiskCache
+from yapas.core.cache.files import OpenFileCache
+from yapas.core.cache.mapped import MappedFileCache
+from yapas.core.cache.memory import TTLMemoryCache
+from yapas.core.cache.preload import StaticPreload
+from yapas.core.cache.proxy import ProxyCache
+from yapas.core.cache.shared import SharedMemoryCache
+from yapas.core.cache.singleflight import SingleFlight
+from yapas.core.cache.tiered import TieredCache
+from yapas.core.exceptions import ImproperlyConfigured
 from yapas.core.server import handlers
+from yapas.core.upstream.pool import UpstreamPool
+from yapas.core.upstream.retry import RetryPolicy
+
+if TYPE_CHECKING:
+    from yapas.core.client.aiohttp import AIOHttpClient
 
-_HANDLER_MAPPING: dict[str, HandlerCallable] = {
-    'proxy': handlers.ProxyHandler.as_view(),
+PROXY_CLIENTS = ('socket', 'aiohttp')
+
+_HANDLER_MAPPING: dict[str, HandlerCallable | type[handlers.AbstractHandler]] = {
+    'proxy': handlers.ProxyHandler,  # configured per location, see _proxy_handler
     'proxy_static': handlers.proxy_static,
     'server_static': handlers.server_static,
     'restart': handlers.RestartHandler.as_view(),
@@ -12,14 +35,175 @@ _HANDLER_MAPPING: dict[str, HandlerCallable] = {
     'router': handlers.IndexHandler.as_view(),  # todo переделать под обработку роутером
 }
 
+_STATIC_ROOTS = {
+    handlers.proxy_static: handlers.PROXY_STATIC_ROOT,
+    handlers.server_static: str(handlers.SERVER_STATIC_ROOT),
+}
+
 
 class ProxyDispatcher(AbstractDispatcher):
 
+    def __init__(self):
+        super().__init__()
+        # named [upstream:<name>] groups and implicit single-server pools by uri
+        self.upstreams: dict[str, UpstreamPool] = {}
+        # [upstream:<name>] sections, for the client.* options
+        self.upstream_sections: dict[str, SectionProxy] = {}
+        # pooled aiohttp clients by upstream name, of locations with proxy_pass.client = aiohttp
+        self.clients: dict[str, 'AIOHttpClient'] = {}
+        # open file caches of static locations with their own open_file_cache options
+        self.file_caches: list[OpenFileCache] = []
+        # static locations with preload = on, loaded on startup
+        self.preloads: list[StaticPreload] = []
+        # static locations with mmap = on
+        self.mapped_caches: list[MappedFileCache] = []
+        # arenas of locations with shared_cache = on, shared with other processes of the host
+        self.shared_caches: list[SharedMemoryCache] = []
+        # proxy_cache.path tiers, indexed and managed in the background
+        self.disk_caches: list[DiskCache] = []
+        # caches of locations with proxy_cache = on, refresh stale responses in the background
+        self.proxy_caches: list[ProxyCache] = []
+        # False if the catch-all /* location is dropped, kept on reload
+        self.use_proxy = True
+
+    async def startup(self) -> None:
+        for preload in self.preloads:
+            await preload.load()
+        for disk in self.disk_caches:
+            await disk.startup()
+        for pool in self.upstreams.values():
+            await pool.startup()
+
+    async def cleanup(self) -> None:
+        # background refreshes use the upstreams and clients
+        for proxy_cache in self.proxy_caches:
+            await proxy_cache.cleanup()
+        for pool in self.upstreams.values():
+            await pool.cleanup()
+        for client in self.clients.values():
+            await client.close()
+        for disk in self.disk_caches:
+            await disk.cleanup()
+        self.close()
+
+    def close(self) -> None:
+        """Release what the locations hold from their creation on: mappings, shared arenas, open files."""
+        for mapped in self.mapped_caches:
+            mapped.clear()
+        for shared in self.shared_caches:
+            shared.close()
+        for files in self.file_caches:
+            files.clear()
+
+    def fresh(self, conf: ConfParser) -> "ProxyDispatcher":
+        return type(self).from_conf(conf, use_proxy=self.use_proxy)
+
+    def _get_upstream(self, uri: str) -> UpstreamPool:
+        """Return the upstream group named like uri host, e.g. http://backend,
+        or a single-server pool for uri."""
+        if (name := urlparse(uri).hostname) in self.upstreams:
+            return self.upstreams[name]
+        return self.upstreams.setdefault(uri, UpstreamPool.single(uri))
+
+    def _get_client(self, pool: UpstreamPool) -> 'AIOHttpClient':
+        """Return the aiohttp client of the upstream, shared by its locations."""
+        if (client := self.clients.get(pool.name)) is not None:
+            return client
+        try:
+            from yapas.core.client.aiohttp import AIOHttpClient
+        except ImportError:
+            raise ImproperlyConfigured('proxy_pass.client = aiohttp requires the aiohttp package') from None
+        client = self.clients[pool.name] = AIOHttpClient.from_conf(self.upstream_sections.get(pool.name))
+        return client
+
+    def _proxy_handler(self, loc_info: SectionProxy) -> HandlerCallable:
+        if (uri := loc_info.get('proxy_pass.uri')) is None:
+            raise ImproperlyConfigured(f'proxy location {loc_info.name} has no proxy_pass.uri')
+        options = {'upstream': self._get_upstream(uri)}
+        if (client := loc_info.get('proxy_pass.client', 'socket')) not in PROXY_CLIENTS:
+            raise ImproperlyConfigured(f'only {", ".join(PROXY_CLIENTS)} proxy clients are supported')
+        if client == 'aiohttp':
+            options['client'] = self._get_client(options['upstream'])
+        if (timeout := loc_info.getfloat('proxy_connect_timeout')) is not None:
+            options['connect_timeout'] = timeout
+        if (timeout := loc_info.getfloat('proxy_read_timeout')) is not None:
+            options['read_timeout'] = timeout
+        if (timeout := loc_info.getfloat('proxy_tunnel_timeout')) is not None:
+            options['tunnel_timeout'] = timeout
+        if (buffering := loc_info.getboolean('proxy_request_buffering')) is not None:
+            options['request_buffering'] = buffering
+        if (size := loc_info.get('client_body_buffer_size')) is not None:
+            options['body_buffer_size'] = parse_size(size)
+        if (retry := RetryPolicy.from_conf(loc_info)) is not None:
+            options['retry'] = retry
+        if loc_info.getboolean('proxy_cache', False):
+            options['cache'] = ProxyCache(
+                self._tiered('proxy_cache', TTLMemoryCache(update_on_get=False), loc_info, disk=True),
+                valid=loc_info.getfloat('proxy_cache.valid', 0),
+                stale_while_revalidate=loc_info.getfloat('proxy_cache.stale_while_revalidate', 0),
+                stale_if_error=loc_info.getfloat('proxy_cache.stale_if_error', 0),
+            )
+            self.proxy_caches.append(options['cache'])
+            if loc_info.getboolean('proxy_cache.lock', True):
+                options['flight'] = SingleFlight()
+        return handlers.ProxyHandler.as_view(**options)
+
+    def _tiered(self, name: str, memory: TTLMemoryCache, loc_info: SectionProxy, disk: bool = False) -> AbstractCache:
+        """Put the lower tiers of the location behind its memory cache: shared memory, then disk."""
+        _, location = loc_info.name.split(':')
+        tiers = []
+        if (shared := SharedMemoryCache.from_conf(f'{name}-{location}', loc_info)) is not None:
+            self.shared_caches.append(shared)
+            tiers.append(('shared', shared))
+        if disk and (disk_cache := DiskCache.from_conf(loc_info)) is not None:
+            self.disk_caches.append(disk_cache)
+            tiers.append(('disk', disk_cache))
+        return TieredCache(name, memory, tiers) if tiers else memory
+
+    def _static_handler(self, handler: HandlerCallable, loc_info: SectionProxy) -> HandlerCallable:
+        options = {}
+        if loc_info.getboolean('shared_cache', False):
+            options['memory'] = self._tiered('static_cache', TTLMemoryCache(timeout=60), loc_info)
+        if any(key.startswith('open_file_cache') for key in loc_info):
+            options['files'] = OpenFileCache.from_conf(loc_info)
+            self.file_caches.append(options['files'])
+        if (preload := StaticPreload.from_conf(_STATIC_ROOTS[handler], loc_info)) is not None:
+            options['preload'] = preload
+            self.preloads.append(preload)
+        if (mapped := MappedFileCache.from_conf(options.get('files', handlers.open_files), loc_info)) is not None:
+            options['mapped'] = mapped
+            self.mapped_caches.append(mapped)
+        return functools.partial(handler, **options) if options else handler
+
     @classmethod
-    def from_conf(cls, conf: ConfParser) -> "ProxyDispatcher":
-        """Create a Dispatcher instance from a configuration file."""
+    def from_conf(cls, conf: ConfParser, use_proxy: bool = True) -> "ProxyDispatcher":
+        """Create a Dispatcher instance from a configuration file.
+
+        :param use_proxy: keep the catch-all /* location
+        """
         settings = conf.parse()
         obj = cls()
+        obj.use_proxy = use_proxy
+        try:
+            obj._configure(settings)
+        except BaseException:
+            # nothing is started yet, but shared arenas and mappings are held
+            obj.close()
+            raise
+
+        if not use_proxy:
+            obj._locations.pop(b'/*', None)
+        return obj
+
+    def _configure(self, settings: ConfigParser) -> None:
+        """Create the upstreams and the locations of settings."""
+        for section in settings.sections():
+            if not section.startswith('upstream'):
+                continue
+
+            _, name = section.split(':')
+            self.upstreams[name] = UpstreamPool.from_conf(name, settings[section])
+            self.upstream_sections[name] = settings[section]
 
         locations = {}
         for section in settings.sections():
@@ -34,9 +218,17 @@ class ProxyDispatcher(AbstractDispatcher):
             type_ = loc_info.get('type')
 
             try:
-                obj.add_location(regex, _HANDLER_MAPPING[type_])
+                handler = _HANDLER_MAPPING[type_]
             except KeyError:
                 raise ValueError(
                     f'only {", ".join(_HANDLER_MAPPING.keys())} locations are supported')
 
-        return obj
+            if handler is handlers.ProxyHandler:
+                handler = self._proxy_handler(loc_info)
+            elif handler in _STATIC_ROOTS:
+                handler = self._static_handler(handler, loc_info)
+
+            max_body_size = None
+            if (size := loc_info.get('client_max_body_size')) is not None:
+                max_body_size = parse_size(size)
+            self.add_location(regex, handler, max_body_size=max_body_size)
@@ -21,9 +21,13 @@ class HTTPException(DispatchException):
         return b'HTTP/1.1 %d %s' % (cls.status.value, cls.status.phrase.encode())
 
 
+class ClientDisconnected(DispatchException):
+    """Client closed the connection before sending a request"""
+
+
 class UnknownProtocolError(HTTPException):
     """Unknown Protocol"""
-    status: HTTPStatus.HTTP_VERSION_NOT_SUPPORTED
+    status = HTTPStatus.HTTP_VERSION_NOT_SUPPORTED
 
 
 class MethodNotAllowed(HTTPException):
@@ -44,3 +48,42 @@ class NotFoundError(HTTPException):
 class InternalServerError(HTTPException):
     """Internal Server Error"""
     status = HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+class BadGateway(HTTPException):
+    """Bad Gateway"""
+    status = HTTPStatus.BAD_GATEWAY
+
+
+class RequestTimeout(HTTPException):
+    """Request Timeout, the argument names the timed out phase"""
+    status = HTTPStatus.REQUEST_TIMEOUT
+
+
+class IdleTimeout(RequestTimeout):
+    """Keep-alive connection was idle for too long, closed without response"""
+
+
+class UnsupportedTransferEncoding(HTTPException):
+    """Transfer-Encoding other than chunked"""
+    status = HTTPStatus.NOT_IMPLEMENTED
+
+
+class PayloadTooLarge(HTTPException):
+    """Request body is over client_max_body_size"""
+    status = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+
+class TooManyRequests(HTTPException):
+    """Too Many Requests"""
+    status = HTTPStatus.TOO_MANY_REQUESTS
+
+
+class ServiceUnavailable(HTTPException):
+    """Service Unavailable"""
+    status = HTTPStatus.SERVICE_UNAVAILABLE
+
+
+class GatewayTimeout(HTTPException):
+    """Gateway Timeout"""
+    status = HTTPStatus.GATEWAY_TIMEOUT
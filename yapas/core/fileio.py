@@ -0,0 +1,126 @@
+import asyncio
+import os
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional, TypeVar
+
+from yapas.core.exceptions import ServiceUnavailable
+from yapas.core.stats import stats
+
+_T = TypeVar('_T')
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_QUEUE = 1024
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class FileIOExecutor:
+    """Dedicated thread pool for file I/O, like nginx thread_pool.
+
+    File syscalls do not compete with other users of the default executor,
+    and at most `max_queue` jobs wait for a worker: jobs over it are rejected
+    with 503 instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE) -> None:
+        self._workers = workers
+        self._max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        self.pending = 0
+        self.running = 0
+        self.queued_max = 0
+
+    @property
+    def queued(self) -> int:
+        """Jobs waiting for a worker."""
+        return self.pending - self.running
+
+    def configure(self, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE) -> None:
+        """Resize the pool, jobs in progress finish on the old one."""
+        self._workers = workers
+        self._max_queue = max_queue
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _call(self, func: Callable[..., _T], *args) -> _T:
+        with self._lock:
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def run(self, func: Callable[..., _T], *args) -> _T:
+        """Run func(*args) in the pool.
+
+        :raises ServiceUnavailable: if max_queue jobs are waiting already
+        """
+        if self.queued >= self._max_queue:
+            stats.incr('fileio.rejected')
+            raise ServiceUnavailable()
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='yapas-fileio')
+
+        self.pending += 1
+        self.queued_max = max(self.queued_max, self.queued)
+        stats.incr('fileio.jobs')
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(self._call, func, *args))
+        finally:
+            self.pending -= 1
+
+
+def read_into(fd: int, size: int, chunk_size: int = READ_CHUNK_SIZE) -> bytearray:
+    """Read up to size bytes from the start of fd into a preallocated buffer by chunks.
+
+    Uses pread, so the shared file offset is not moved.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    position = 0
+    while position < size:
+        read = os.preadv(fd, [view[position:position + chunk_size]], position)
+        if not read:
+            # the file was truncated
+            view.release()
+            del buffer[position:]
+            break
+        position += read
+    return buffer
+
+
+def open_read(path: str) -> tuple[int, os.stat_result, bytearray]:
+    """Open, stat and read a regular file in one go, the descriptor is left open.
+
+    :raises FileNotFoundError: if path is not a regular file
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise FileNotFoundError(path)
+        return fd, st, read_into(fd, st.st_size)
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+def read_file(path: str) -> bytearray:
+    """Open, stat and read a regular file in one go."""
+    fd, _, data = open_read(path)
+    os.close(fd)
+    return data
+
+
+file_io = FileIOExecutor()
+
+stats.gauge('fileio.queued', lambda: file_io.queued)
+stats.gauge('fileio.queued_max', lambda: file_io.queued_max)
+stats.gauge('fileio.running', lambda: file_io.running)
@@ -0,0 +1,39 @@
+from configparser import SectionProxy
+from typing import Optional, Self
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.abs.middleware import AbstractMiddleware
+from yapas.core.constants import PROXY_FORWARDED_FOR, REFERER, SET_COOKIE
+
+
+class ProxyHeadersMiddleware(AbstractMiddleware):
+    """Add the client address to X-Forwarded-For, optionally override Referer."""
+
+    def __init__(self, referer: Optional[bytes] = None):
+        self._referer = referer
+
+    @classmethod
+    def from_conf(cls, section: Optional[SectionProxy]) -> Self:
+        if section is None or (referer := section.get('referer')) is None:
+            return cls()
+        return cls(referer=referer.encode())
+
+    async def process_request(self, request: RawHttpMessage) -> None:
+        if (addr := request.remote_addr) is not None:
+            if forwarded := request.get_header_value(PROXY_FORWARDED_FOR):
+                request.update_header(PROXY_FORWARDED_FOR, b'%s, %s' % (forwarded, addr.encode()))
+            else:
+                request.add_header(PROXY_FORWARDED_FOR, addr.encode())
+
+        if self._referer is not None:
+            request.update_header(REFERER, self._referer)
+
+
+class CSRFCookieMiddleware(AbstractMiddleware):
+    """Pass the cookie value of request's Set-Cookie as X-CSRFToken response header."""
+
+    async def process_response(self, request: RawHttpMessage, response: RawHttpMessage) -> RawHttpMessage:
+        if request.has_header(SET_COOKIE):
+            value, *_ = request.get_header_value(SET_COOKIE).split(b';', maxsplit=1)
+            response.add_header(b'X-CSRFToken', value)
+        return response
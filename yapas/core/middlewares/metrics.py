@@ -1,27 +1,20 @@
-import asyncio
 import logging
+import time
 from threading import Thread
-from typing import Callable, Awaitable
 
 from yapas.core.abs.messages import RawHttpMessage
-from yapas.core.abs.server import AbstractAsyncServer
+from yapas.core.abs.middleware import AbstractMiddleware
 from yapas.core.signals import prepare_shutdown, show_metrics
+from yapas.core.stats import stats
 
-StreamReader = asyncio.StreamReader
-StreamWriter = asyncio.StreamWriter
-CallbackResponse = tuple[RawHttpMessage, RawHttpMessage]
 
-Decorated = Callable[[AbstractAsyncServer, StreamReader, StreamWriter], Awaitable[CallbackResponse]]
-
-
-class MessageMetrics:
-    """Class for logging and writing metrics"""
+class MetricsMiddleware(AbstractMiddleware):
+    """Middleware for logging and writing metrics"""
 
     def __init__(self):
         self._counter = 0
         self._response_time = 0
         self._log = logging.getLogger('yapas.metrics')
-        self._loop = asyncio.get_event_loop()
         self._init_loop()
 
     def _init_loop(self):
@@ -34,22 +27,14 @@ class MessageMetrics:
             show_metrics.wait()
             self._log.info(
                 f'total requests: {self._counter} | '
-                f'average response time: {self._response_time / self._counter:.4f} ms'
+                f'average response time: {self._response_time / max(self._counter, 1):.4f} ms'
             )
+            self._log.info(str(stats))
             show_metrics.clear()
 
-    def __call__(self, dispatch_cb: Decorated) -> Decorated:
-        async def _decorated(_self, reader: StreamReader, writer: StreamWriter) -> CallbackResponse:
-            self._counter += 1
-            now = self._loop.time()
-            req, resp = await dispatch_cb(_self, reader, writer)
-            elapsed = self._loop.time() - now
-
-            self._log.info(f'{req!r} - {resp!r}: {elapsed:.4f} ms')
-            self._response_time += elapsed
-            return req, resp
-
-        return _decorated
-
-
-metrics = MessageMetrics
+    async def process_response(self, request: RawHttpMessage, response: RawHttpMessage) -> RawHttpMessage:
+        elapsed = time.monotonic() - request.received_at
+        self._counter += 1
+        self._response_time += elapsed
+        self._log.info(f'{request!r} - {response!r}: {elapsed:.4f} ms')
+        return response
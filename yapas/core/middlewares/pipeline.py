@@ -0,0 +1,79 @@
+from typing import Awaitable, Callable, Sequence
+
+from yapas.conf.parser import ConfParser
+from yapas.core.abs.handlers import HandlerCallable
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.abs.middleware import AbstractMiddleware
+from yapas.core.exceptions import ImproperlyConfigured
+from yapas.core.middlewares.headers import ProxyHeadersMiddleware, CSRFCookieMiddleware
+from yapas.core.middlewares.metrics import MetricsMiddleware
+from yapas.core.middlewares.ratelimit import RateLimitMiddleware
+
+RequestHook = Callable[[RawHttpMessage], Awaitable[RawHttpMessage | None]]
+ResponseHook = Callable[[RawHttpMessage, RawHttpMessage], Awaitable[RawHttpMessage]]
+
+_MIDDLEWARE_MAPPING: dict[str, type[AbstractMiddleware]] = {
+    'metrics': MetricsMiddleware,
+    'limit_req': RateLimitMiddleware,
+    'proxy_headers': ProxyHeadersMiddleware,
+    'csrf_cookie': CSRFCookieMiddleware,
+}
+DEFAULT_MIDDLEWARES = 'metrics, proxy_headers, csrf_cookie'
+
+
+def _overrides(middleware: AbstractMiddleware, hook: str) -> bool:
+    return getattr(type(middleware), hook) is not getattr(AbstractMiddleware, hook)
+
+
+class MiddlewarePipeline:
+    """Middlewares compiled once into flat lists of request and response hooks.
+
+    Request hooks run in declaration order, response hooks in reverse order,
+    for short-circuited responses as well. Middlewares which do not override
+    a hook are not in its list, so they cost nothing per request.
+    """
+
+    def __init__(self, middlewares: Sequence[AbstractMiddleware] = ()) -> None:
+        self.middlewares = tuple(middlewares)
+        self._request_hooks: tuple[RequestHook, ...] = tuple(
+            m.process_request for m in self.middlewares if _overrides(m, 'process_request')
+        )
+        self._response_hooks: tuple[ResponseHook, ...] = tuple(
+            m.process_response for m in reversed(self.middlewares) if _overrides(m, 'process_response')
+        )
+
+    @classmethod
+    def from_conf(cls, conf: ConfParser) -> 'MiddlewarePipeline':
+        """Create from `middlewares` of the [server] section and [middleware:<name>] sections."""
+        settings = conf.parse()
+        names = settings.get('server', 'middlewares', fallback=DEFAULT_MIDDLEWARES)
+
+        middlewares = []
+        for name in (name.strip() for name in names.split(',')):
+            if not name:
+                continue
+            try:
+                middleware_cls = _MIDDLEWARE_MAPPING[name]
+            except KeyError:
+                raise ImproperlyConfigured(
+                    f'only {", ".join(_MIDDLEWARE_MAPPING.keys())} middlewares are supported')
+
+            section = f'middleware:{name}'
+            middlewares.append(middleware_cls.from_conf(
+                settings[section] if settings.has_section(section) else None
+            ))
+
+        return cls(middlewares)
+
+    async def __call__(self, request: RawHttpMessage, handler: HandlerCallable) -> RawHttpMessage:
+        """Run the request through the hooks and the handler."""
+        for hook in self._request_hooks:
+            if (response := await hook(request)) is not None:
+                break
+        else:
+            response = await handler(request)
+
+        for hook in self._response_hooks:
+            response = await hook(request, response)
+
+        return response
@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import math
+import time
+from configparser import SectionProxy
+from typing import Optional, Self
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.abs.middleware import AbstractMiddleware
+from yapas.core.constants import RETRY_AFTER
+from yapas.core.exceptions import ImproperlyConfigured, TooManyRequests
+from yapas.core.stats import stats
+
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 0
+DEFAULT_ZONE_SIZE = 10_000
+
+_RATE_UNITS = {'r/s': 1, 'r/m': 60}
+
+
+def parse_rate(value: str) -> float:
+    """Parse an nginx-like rate, e.g. '10r/s' or '60r/m', into requests per second."""
+    value = value.strip()
+    try:
+        unit = value[-3:]
+        rate = float(value[:-3]) / _RATE_UNITS[unit]
+    except (KeyError, ValueError):
+        raise ImproperlyConfigured(f'invalid rate {value!r}, expected like 10r/s or 60r/m') from None
+    if rate <= 0:
+        raise ImproperlyConfigured(f'rate must be positive, got {value!r}')
+    return rate
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float) -> None:
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimitMiddleware(AbstractMiddleware):
+    """Token bucket rate limiting per client address and location, like nginx limit_req.
+
+    A bucket holds `burst + 1` tokens and is refilled with `rate` tokens per second,
+    every request takes a token and requests with an empty bucket get 429.
+    Requests over the rate are delayed to the rate unless `nodelay` is set, then
+    the burst is served right away. The bucket table keeps `zone_size` most
+    recently used keys, the least recently used bucket is evicted (i.e. reset).
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        nodelay: bool = False,
+        zone_size: int = DEFAULT_ZONE_SIZE,
+    ) -> None:
+        """
+        :param rate: requests per second
+        :param burst: requests over the rate served (or delayed) before rejecting
+        :param nodelay: serve the burst without delaying it to the rate
+        :param zone_size: max number of buckets kept in memory
+        """
+        self._rate = rate
+        self._capacity = burst + 1
+        self._nodelay = nodelay
+        self._zone_size = zone_size
+        self._buckets: collections.OrderedDict[tuple, _Bucket] = collections.OrderedDict()
+
+        # pre-built, rejecting must be cheap
+        self.rejection_message = RawHttpMessage(
+            TooManyRequests.as_bytes(),
+            headers=[[RETRY_AFTER, str(math.ceil(1 / rate)).encode()]],
+        )
+
+        stats.gauge('limit_req.keys', lambda: len(self._buckets))
+
+    @classmethod
+    def from_conf(cls, section: Optional[SectionProxy]) -> Self:
+        """Create from the [middleware:limit_req] section."""
+        if section is None:
+            return cls()
+        return cls(
+            rate=parse_rate(section.get('rate', f'{DEFAULT_RATE:g}r/s')),
+            burst=section.getint('burst', DEFAULT_BURST),
+            nodelay=section.getboolean('nodelay', False),
+            zone_size=section.getint('zone_size', DEFAULT_ZONE_SIZE),
+        )
+
+    def _take(self, key: tuple) -> Optional[float]:
+        """Take a token for key, return the delay to serve the request after,
+        or None if it must be rejected."""
+        now = time.monotonic()
+        buckets = self._buckets
+        if (bucket := buckets.get(key)) is None:
+            bucket = buckets[key] = _Bucket(self._capacity, now)
+            if len(buckets) > self._zone_size:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+            bucket.tokens = min(self._capacity, bucket.tokens + (now - bucket.updated) * self._rate)
+            bucket.updated = now
+
+        if bucket.tokens < 1:
+            return None
+        bucket.tokens -= 1
+
+        if self._nodelay:
+            return 0
+        # tokens taken over the first one are spread at the rate
+        return (self._capacity - 1 - bucket.tokens) / self._rate
+
+    async def process_request(self, request: RawHttpMessage) -> Optional[RawHttpMessage]:
+        delay = self._take((request.remote_addr, request.location))
+        if delay is None:
+            stats.incr('limit_req.rejected')
+            return self.rejection_message.copy()
+        if delay > 0:
+            stats.incr('limit_req.delayed')
+            await asyncio.sleep(delay)
+        return None
@@ -0,0 +1,130 @@
+import asyncio
+import collections
+from configparser import SectionProxy
+from typing import Optional
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import CONNECTION, CLOSE, RETRY_AFTER
+from yapas.core.stats import stats
+
+DEFAULT_QUEUE_TIMEOUT = 1.0
+DEFAULT_RETRY_AFTER = 1
+# weight of the latest request in the average service time
+SERVICE_TIME_ALPHA = 0.1
+
+
+class AdmissionControl:
+    """Connection and in-flight request limits with queue-time based shedding.
+
+    Requests over `max_in_flight` wait in a FIFO queue. A request is shed
+    with 503 right away if its expected queue time is over `queue_timeout`,
+    and after waiting `queue_timeout` otherwise. Connections over
+    `max_connections` are answered with 503 and closed without reading.
+    Zero disables the corresponding limit.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 0,
+        max_in_flight: int = 0,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        retry_after: int = DEFAULT_RETRY_AFTER,
+    ) -> None:
+        self._max_connections = max_connections
+        self._max_in_flight = max_in_flight
+        self._queue_timeout = queue_timeout
+
+        self.connections = 0
+        self.in_flight = 0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._service_time = 0.0
+
+        # pre-built, shedding must be cheap
+        self.rejection_message = RawHttpMessage(
+            b'HTTP/1.1 503 Service Unavailable',
+            headers=[[RETRY_AFTER, str(retry_after).encode()], [CONNECTION, CLOSE]],
+        )
+        self.rejection: bytes = bytes(self.rejection_message.raw_bytes)
+
+        stats.gauge('connections', lambda: self.connections)
+        stats.gauge('requests.in_flight', lambda: self.in_flight)
+        stats.gauge('requests.queued', lambda: len(self._waiters))
+
+    @classmethod
+    def from_conf(cls, section: SectionProxy) -> 'AdmissionControl':
+        """Create from the [server] config section."""
+        return cls(
+            max_connections=section.getint('max_connections', 0),
+            max_in_flight=section.getint('max_in_flight', 0),
+            queue_timeout=section.getfloat('queue_timeout', DEFAULT_QUEUE_TIMEOUT),
+            retry_after=section.getint('retry_after', DEFAULT_RETRY_AFTER),
+        )
+
+    def accept(self) -> bool:
+        """Register a new connection, return False if it must be rejected."""
+        if self._max_connections and self.connections >= self._max_connections:
+            stats.incr('shed.connections')
+            return False
+        self.connections += 1
+        return True
+
+    def release_connection(self) -> None:
+        """Unregister a closed connection."""
+        self.connections -= 1
+
+    def _expected_wait(self) -> float:
+        return (len(self._waiters) + 1) * self._service_time / self._max_in_flight
+
+    async def acquire(self) -> bool:
+        """Take an in-flight slot, return False if the request must be shed."""
+        if not self._max_in_flight:
+            self.in_flight += 1
+            return True
+
+        if self.in_flight < self._max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return True
+
+        if self._expected_wait() > self._queue_timeout:
+            stats.incr('shed.requests')
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout(self._queue_timeout):
+                await waiter
+        except TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over right before the deadline
+                return True
+            stats.incr('shed.requests')
+            return False
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # cancelled after the slot was handed over, pass it on
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+        # the slot was handed over by release()
+        return True
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Give the slot back, handing it to the first waiter if any."""
+        if service_time is not None:
+            self._service_time += SERVICE_TIME_ALPHA * (service_time - self._service_time)
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
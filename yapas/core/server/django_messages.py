@@ -7,8 +7,8 @@ class DjangoMessage(RawHttpMessage):
     'csrftoken = bls1lQLeouKcoK75fT8VShMlGrvVqt4m'
 
     @classmethod
-    async def from_reader(cls, reader):
-        obj = await super().from_reader(reader)
+    async def from_reader(cls, reader, **kwargs):
+        obj = await super().from_reader(reader, **kwargs)
         if not obj.info.type is MessageType.RESPONSE:
             return obj
 
@@ -1,34 +1,326 @@
-import pathlib
+import asyncio
+import contextlib
 import signal
+import time
 from logging import getLogger
+from typing import Optional, TYPE_CHECKING
 
+from yapas.core.abs.cache import AbstractCache
 from yapas.core.abs.handlers import AbstractHandler, TemplateHandler, GetMixin, ErrorHandler
+from yapas.core.abs.client import ConnectTimeout, ReadTimeout, DEFAULT_CLIENT_TIMEOUT
 from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.cache.files import OpenFileCache
+from yapas.core.cache.mapped import MappedFileCache
 from yapas.core.cache.memory import TTLMemoryCache
+from yapas.core.cache.preload import StaticPreload
+from yapas.core.cache.proxy import ProxyCache, CacheKey, ERROR_STATUSES
+from yapas.core.cache.singleflight import SingleFlight
 from yapas.core.client.socket import SocketClient
-from yapas.core.constants import OK, WORKING_DIR
-from yapas.core.exceptions import NotFoundError, InternalServerError
+from yapas.core.constants import OK, WORKING_DIR, HOST, X_CACHE_STATUS, CONTENT_LENGTH, SWITCHING_PROTOCOLS
+from yapas.core.exceptions import (
+    NotFoundError,
+    InternalServerError,
+    ImproperlyConfigured,
+    BadGateway,
+    ServiceUnavailable,
+    GatewayTimeout,
+    DispatchException,
+    UnknownProtocolError,
+)
 from yapas.core.signals import show_metrics
-from yapas.core.statics import async_open
+from yapas.core.stats import stats
+from yapas.core.server.tunnel import Tunnel, DEFAULT_TUNNEL_TIMEOUT
+from yapas.core.upstream.backend import Backend
+from yapas.core.upstream.pool import UpstreamPool
+from yapas.core.upstream.retry import RetryPolicy
+
+if TYPE_CHECKING:
+    from yapas.core.client.aiohttp import AIOHttpClient
 
 logger = getLogger('yapas.handlers')
+# nginx default
+DEFAULT_BODY_BUFFER_SIZE = 16 * 1024
 cache = TTLMemoryCache(timeout=60)
+static_flight: SingleFlight[RawHttpMessage] = SingleFlight()
+# used by static locations without open_file_cache options
+open_files = OpenFileCache()
+
+PROXY_STATIC_ROOT = '/var/www/static/ma-tool'
+SERVER_STATIC_ROOT = WORKING_DIR / 'static'
 
 
 class ProxyHandler(AbstractHandler):
     """Proxy handler for all requests"""
+    upstream: Optional[UpstreamPool] = None
+    # retries and hedging of idempotent requests, like nginx proxy_next_upstream
+    retry: Optional[RetryPolicy] = None
+    # pooled client of the upstream with proxy_pass.client = aiohttp, a SocketClient per request if None
+    client: Optional['AIOHttpClient'] = None
+    cache: Optional[ProxyCache] = None
+    # coalesce concurrent cache misses, like nginx proxy_cache_lock
+    flight: Optional[SingleFlight] = None
+    connect_timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT
+    read_timeout: Optional[float] = DEFAULT_CLIENT_TIMEOUT
+    # read the whole request body before connecting to the upstream,
+    # bodies over body_buffer_size are spooled to a temporary file
+    request_buffering: bool = False
+    body_buffer_size: int = DEFAULT_BODY_BUFFER_SIZE
+    # idle timeout of upgraded (e.g. WebSocket) connections
+    tunnel_timeout: Optional[float] = DEFAULT_TUNNEL_TIMEOUT
 
     async def dispatch(self, message: RawHttpMessage) -> RawHttpMessage:
         """Proxy handler, ignores ALLOWED METHODS"""
-        _client = SocketClient()
-        return await _client.raw(message)
+        if self.upstream is None:
+            raise ImproperlyConfigured('proxy location has no upstream')
+
+        if message.is_upgrade():
+            return await self._upgrade(message)
+
+        if self.cache is None:
+            return await self._proxy(message)
+
+        if (key := self.cache.make_key(message)) is None:
+            response = await self._proxy(message)
+            response.update_header(X_CACHE_STATUS, b'BYPASS')
+            return response
+
+        if (entry := await self.cache.lookup(key, message)) is not None:
+            if entry.fresh:
+                return self.cache.respond(entry)
+            # the background request must not read the body of this one
+            if entry.revalidating and message.body_stream is None:
+                self.cache.revalidate(entry, lambda: self._fetch(key, message.copy()))
+                return self.cache.respond(entry, b'UPDATING')
+
+        if entry is None:
+            return await self._fetch_shared(key, message)
+        if not entry.usable_on_error:
+            entry.release()
+            return await self._fetch_shared(key, message)
+
+        try:
+            response = await self._fetch_shared(key, message)
+        except (BadGateway, ServiceUnavailable, GatewayTimeout):
+            return self.cache.respond(entry, b'STALE')
+        except BaseException:
+            entry.release()
+            raise
+        if response.info.status in ERROR_STATUSES:
+            return self.cache.respond(entry, b'STALE')
+        entry.release()
+        return response
+
+    async def _fetch_shared(self, key: CacheKey, message: RawHttpMessage) -> RawHttpMessage:
+        """Fetch a missing or stale response, concurrent misses share a request if locked."""
+        if self.flight is None:
+            _, response = await self._fetch(key, message)
+            return response
+
+        leader, response = await self.flight.do(key, lambda: self._fetch(key, message))
+        if leader is message:
+            return response
+
+        # waiters share only what went to the cache and fits their Vary headers
+        if (response := await self.cache.get(key, message)) is not None:
+            return response
+
+        _, response = await self._fetch(key, message)
+        return response
+
+    async def _fetch(self, key: CacheKey, message: RawHttpMessage):
+        """Proxy the request and try to store the response."""
+        response = await self._proxy(message)
+        self.cache.set(key, message, response)
+        response.update_header(X_CACHE_STATUS, b'MISS')
+        return message, response
+
+    async def _proxy(self, message: RawHttpMessage) -> RawHttpMessage:
+        """Send the request to a backend of the upstream pool."""
+        if self.request_buffering and message.body_stream is not None:
+            await message.body_stream.spool(self.body_buffer_size)
+
+        if self.retry is None or not self.retry.replayable(message):
+            return await self._send(self.upstream.select(message), message)
+        return await self._send_retried(message)
+
+    async def _send(self, backend: Backend, message: RawHttpMessage) -> RawHttpMessage:
+        """Send the request to the backend, within the concurrency limit of the upstream."""
+        message.update_header(HOST, backend.netloc)
+        async with contextlib.AsyncExitStack() as stack:
+            await stack.enter_async_context(self._exchange(backend))
+            if self.client is not None:
+                # cached responses are stored whole, others go to the client as they arrive
+                response = await self.client.send(
+                    backend.url,
+                    message,
+                    timeout=self.read_timeout,
+                    connect_timeout=self.connect_timeout,
+                    stream=self.cache is None,
+                )
+            else:
+                _client = SocketClient(
+                    base_url=backend.url,
+                    timeout=self.read_timeout,
+                    connect_timeout=self.connect_timeout,
+                )
+                response = await _client.raw(message)
+
+            if response.body_file is not None:
+                # streamed, the exchange ends with the body, see ResponseStream
+                response.body_file.exchange = stack.pop_all()
+        return response
+
+    @contextlib.asynccontextmanager
+    async def _exchange(self, backend: Backend):
+        """Hold a slot of the upstream and count the request on the backend until
+        the response ends, its duration goes to the adaptive limit and hedge delay."""
+        async with self.upstream.slot():
+            started = time.monotonic()
+            with backend.track(), self._passive_check(backend):
+                yield
+            backend.success()
+            if self.retry is not None:
+                self.retry.latencies.add(time.monotonic() - started)
+
+    async def _send_retried(self, message: RawHttpMessage) -> RawHttpMessage:
+        """Send the request, to another backend if an attempt fails, within the retry budget."""
+        policy = self.retry
+        policy.budget.deposit()
+        backend = self.upstream.select(message)
+        tried = [backend]
+        while True:
+            try:
+                if policy.hedge:
+                    return await self._send_hedged(backend, message, tried)
+                return await self._send(backend, message)
+            except (BadGateway, GatewayTimeout) as exc:
+                if len(tried) >= policy.tries or not policy.retries_on(exc):
+                    raise
+                try:
+                    backend = self.upstream.select(message, exclude=tried)
+                except BadGateway:
+                    # no other backend to try
+                    raise exc from None
+                if not policy.budget.withdraw():
+                    stats.incr('upstream.retry_budget_exhausted')
+                    raise
+                tried.append(backend)
+                stats.incr('upstream.retries')
+
+    async def _send_hedged(self, backend: Backend, message: RawHttpMessage, tried: list[Backend]) -> RawHttpMessage:
+        """Send the request, and a copy to another backend if there is no response
+        after the hedge delay. The first response wins, the other request is cancelled."""
+        primary = asyncio.ensure_future(self._send(backend, message))
+        tasks = {primary}
+        # the body of the request can be read only by one of them
+        delay = self.retry.hedge_delay if message.body_stream is None else None
+        error = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    delay = None
+                    if (hedge := self._hedge(message, tried)) is not None:
+                        tasks.add(hedge)
+                    continue
+
+                winner = None
+                for task in done:
+                    if (exc := task.exception()) is not None:
+                        error = error or exc
+                    elif winner is None:
+                        winner = task
+                    elif (body := task.result().body_file) is not None:
+                        # both responded in the same round, the streamed body of the other is dropped
+                        body.release()
+                if winner is not None:
+                    if winner is not primary:
+                        stats.incr('upstream.hedge_wins')
+                    return winner.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _hedge(self, message: RawHttpMessage, tried: list[Backend]) -> Optional[asyncio.Future]:
+        """Start a hedged request if there is another backend and the budget allows it."""
+        try:
+            backend = self.upstream.select(message, exclude=tried)
+        except BadGateway:
+            return None
+        if not self.retry.budget.withdraw():
+            stats.incr('upstream.retry_budget_exhausted')
+            return None
+        tried.append(backend)
+        stats.incr('upstream.hedges')
+        return asyncio.ensure_future(self._send(backend, message.copy()))
+
+    async def _upgrade(self, message: RawHttpMessage) -> RawHttpMessage:
+        """Relay an Upgrade request. A 101 response carries the tunnel to the upstream,
+        the server pumps it once the response is written."""
+        backend = self.upstream.select(message)
+        message.update_header(HOST, backend.netloc)
+
+        with self._passive_check(backend):
+            try:
+                async with asyncio.timeout(self.connect_timeout):
+                    if backend.unix_path is not None:
+                        reader, writer = await asyncio.open_unix_connection(backend.unix_path)
+                    else:
+                        reader, writer = await asyncio.open_connection(backend.host, backend.port)
+            except TimeoutError:
+                raise ConnectTimeout(backend.url) from None
+
+            try:
+                async with asyncio.timeout(self.read_timeout):
+                    writer.write(message.head_bytes)
+                    await writer.drain()
+                    response = await RawHttpMessage.from_reader(reader)
+                    if response.info.status != SWITCHING_PROTOCOLS and not response.has_header(CONTENT_LENGTH):
+                        await response.add_body(await reader.read())
+            except TimeoutError:
+                writer.close()
+                raise ReadTimeout(backend.url) from None
+            except DispatchException as exc:
+                # the upstream closed the connection or sent garbage
+                writer.close()
+                raise ConnectionError(exc) from exc
+            except BaseException:
+                writer.close()
+                raise
+
+        backend.success()
+        if response.info.status != SWITCHING_PROTOCOLS:
+            writer.close()
+            return response
+
+        stats.incr('tunnels.total')
+        response.tunnel = Tunnel(reader, writer, backend=backend, idle_timeout=self.tunnel_timeout)
+        return response
+
+    @contextlib.contextmanager
+    def _passive_check(self, backend: Backend):
+        """Count upstream errors as backend failures and convert them to 502/504."""
+        try:
+            yield
+        except TimeoutError as exc:
+            backend.failure()
+            kind = 'connect' if isinstance(exc, ConnectTimeout) else 'read'
+            stats.incr(f'timeouts.upstream_{kind}')
+            logger.warning(f'{backend.url} {kind} timeout')
+            raise GatewayTimeout() from exc
+        except (OSError, UnknownProtocolError) as exc:
+            # refused or reset, or closed without a parsable status line
+            backend.failure()
+            logger.warning(f'{backend.url} failed: {exc!r}')
+            raise BadGateway() from exc
 
 
 class RestartHandler(TemplateHandler):
-    """Restart handler. Restarts the server."""
+    """Restart handler. Reloads the configuration without dropping connections."""
 
     async def get_context(self) -> dict:
-        return {"error_msg": "Restarting..."}
+        return {"error_msg": "Reloading configuration..."}
 
     async def get(self, _message: RawHttpMessage):
         signal.raise_signal(signal.SIGHUP)
@@ -58,35 +350,61 @@ class InternalErrorHandler(ErrorHandler):
     error = InternalServerError
 
 
-async def _static(static_path) -> RawHttpMessage:
-    if (result := cache.get(static_path)) is not None:
-        return result
+async def _read_static(static_path, files: OpenFileCache, memory: AbstractCache) -> RawHttpMessage:
+    result = RawHttpMessage(OK, body=await files.read(str(static_path)))
+    memory.set(static_path, result)
+    return result
+
 
-    if not pathlib.Path(static_path).exists():
-        raise NotFoundError()
+async def _static(
+    static_path,
+    files: OpenFileCache,
+    message: RawHttpMessage,
+    mapped: Optional[MappedFileCache] = None,
+    memory: AbstractCache = cache,
+) -> RawHttpMessage:
+    if (result := memory.get(static_path)) is not None:
+        return result
 
-    async with async_open(static_path) as f:
-        result = RawHttpMessage(OK, body=await f.read())
-        cache.set(static_path, result)
+    if mapped is not None and (result := await mapped.get(str(static_path), message)) is not None:
         return result
 
+    # concurrent misses for the same file read it only once
+    return await static_flight.do(static_path, lambda: _read_static(static_path, files, memory))
+
 
-async def proxy_static(message: RawHttpMessage) -> RawHttpMessage:
-    """Static files handler, uses TTLCache."""
+async def proxy_static(
+    message: RawHttpMessage,
+    files: OpenFileCache = open_files,
+    preload: Optional[StaticPreload] = None,
+    mapped: Optional[MappedFileCache] = None,
+    memory: AbstractCache = cache,
+) -> RawHttpMessage:
+    """Static files handler, uses preloaded files, TTLCache, mapped files and the open file cache."""
 
     # todo переписать на нормальный хендлер сервера
     path = message.info.path.decode().removeprefix('/static')
-    static_path = f'/var/www/static/ma-tool{path}'
+    static_path = f'{PROXY_STATIC_ROOT}{path}'
 
     if "?" in static_path:
         # versioned static files
         static_path, *_ = static_path.split("?")
 
-    return await _static(static_path)
+    if preload is not None and (response := preload.get(static_path, message)) is not None:
+        return response
+    return await _static(static_path, files, message, mapped, memory)
 
 
-async def server_static(message: RawHttpMessage) -> RawHttpMessage:
+async def server_static(
+    message: RawHttpMessage,
+    files: OpenFileCache = open_files,
+    preload: Optional[StaticPreload] = None,
+    mapped: Optional[MappedFileCache] = None,
+    memory: AbstractCache = cache,
+) -> RawHttpMessage:
     """Server static files handler."""
     path = message.info.path.decode().replace('/server_static', './static')
     static_path = WORKING_DIR / path
-    return await _static(static_path)
+    if preload is not None and (response := preload.get(str(static_path), message)) is not None:
+        return response
+    return await _static(static_path, files, message, mapped, memory)
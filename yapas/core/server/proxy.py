@@ -1,62 +1,152 @@
+import contextlib
+import time
 from asyncio import StreamReader, StreamWriter
+from functools import partial
 from typing import Optional
 
+from yapas.core.abs.dispatcher import AbstractDispatcher
 from yapas.core.abs.enums import MessageType
 from yapas.core.abs.handlers import HandlerCallable
 from yapas.core.abs.messages import RawHttpMessage
 from yapas.core.abs.server import AbstractAsyncServer
-from yapas.core.constants import HOST, PROXY_FORWARDED_FOR, REFERER
-from yapas.core.exceptions import HTTPException, DispatchException, InternalServerError
-from yapas.core.middlewares.metrics import metrics
+from yapas.core.constants import CONNECTION, CLOSE, KEEP_ALIVE, CONTENT_LENGTH, TRANSFER_ENCODING, CHUNKED
+from yapas.core.exceptions import (
+    HTTPException,
+    DispatchException,
+    InternalServerError,
+    ClientDisconnected,
+    RequestTimeout,
+    IdleTimeout,
+    PayloadTooLarge,
+)
+from yapas.core.stats import stats
+
+# max time to read and drop an unread request body before closing,
+# so that the client gets the response instead of a connection reset
+LINGERING_TIME = 5
 
 StackCall = tuple[RawHttpMessage, RawHttpMessage] | tuple[None, None]
 
 
+def _delimited(request: RawHttpMessage, response: RawHttpMessage) -> bool:
+    """Return True if the client can find the end of the response without the connection close,
+    1xx, 204 and 304 responses and responses to HEAD have no body."""
+    status = response.info.status or b''
+    if request.info.method == b'HEAD' or status[:1] == b'1' or status in (b'204', b'304'):
+        return True
+    return response.has_header(CONTENT_LENGTH) or response.get_header_value(TRANSFER_ENCODING).lower() == CHUNKED
+
+
 class ProxyServer(AbstractAsyncServer):
     """Proxy-based async server"""
 
-    async def read_request(self, reader: StreamReader):
-        request = await RawHttpMessage.from_reader(reader)
+    async def read_request(
+        self,
+        reader: StreamReader,
+        writer: StreamWriter,
+        idle_timeout: Optional[float] = None,
+    ):
+        # only a keep-alive connection waiting for the next request is idle, not the first request
+        with self._idle_scope() if idle_timeout is not None else contextlib.nullcontext() as busy:
+            request = await RawHttpMessage.from_reader(
+                reader,
+                idle_timeout=idle_timeout,
+                header_timeout=self._client_header_timeout,
+                body_timeout=self._client_body_timeout,
+                stream_body=True,
+                on_start=busy,
+            )
         assert request
         assert request.info.type is MessageType.REQUEST
 
-        # todo вынести это
-        proxy = b'localhost:8000'
-        request.add_header(HOST, proxy)
-        request.add_header(PROXY_FORWARDED_FOR, proxy)
-        request.add_header(REFERER, proxy)
+        request.received_at = time.monotonic()
+        peername = writer.get_extra_info('peername')
+        if isinstance(peername, tuple):
+            request.remote_addr = peername[0]
 
         return request
 
-    @metrics()
     async def middleware_stack(
         self,
         reader: StreamReader,
         writer: StreamWriter,
+        dispatcher: AbstractDispatcher,
+        idle_timeout: Optional[float] = None,
     ) -> Optional[StackCall]:
         """Read a Request and create a Response object through the middleware stack"""
 
         try:
-            request = await self.read_request(reader)
+            request = await self.read_request(reader, writer, idle_timeout)
+        except ClientDisconnected:
+            return None, None
+        except IdleTimeout:
+            stats.incr('timeouts.keepalive')
+            return None, None
+        except HTTPException as exc:
+            if isinstance(exc, RequestTimeout):
+                stats.incr(f'timeouts.{exc}')
+            else:
+                # malformed or ambiguous framing, the rest of the stream can not be trusted
+                stats.incr('requests.bad_framing')
+            response = await RawHttpMessage.from_bytes(buffer=exc.as_bytes())
+            response.add_header(CONNECTION, CLOSE)
+            await response.fill(writer)
+            return None, response
         except DispatchException as e:
             self._log.exception(e)
             return None, None
 
-        handler: HandlerCallable = await self.dispatcher.get_handler(path=request.info.path)
+        return await self._handle(request, reader, writer, dispatcher)
 
+    async def _handle(
+        self,
+        request: RawHttpMessage,
+        reader: StreamReader,
+        writer: StreamWriter,
+        dispatcher: AbstractDispatcher,
+    ) -> StackCall:
+        """Create a Response for the Request through the middlewares and write it."""
+        request.location, handler = await dispatcher.resolve(path=request.info.path)
+        max_body_size = dispatcher.body_limits.get(request.location, self._client_max_body_size)
+        body = request.body_stream
         try:
-            response = await handler(request)
-        except HTTPException as exc:
-            response = await RawHttpMessage.from_bytes(buffer=exc.as_bytes())
-        except Exception as e:
-            self._log.exception(e)
-            response = await RawHttpMessage.from_bytes(buffer=InternalServerError.as_bytes())
+            response = await self.middlewares(request, partial(self._get_response, handler, max_body_size))
+        except ClientDisconnected:
+            return None, None
+        finally:
+            if body is not None:
+                body.close()
+
+        # shutting down or the configuration was reloaded, the next request goes to a new connection
+        closing = self._draining or dispatcher is not self.dispatcher
+        # the rest of an unread body is still in the stream, the connection can not be reused
+        if (closing and response.tunnel is None) or (body is not None and not body.consumed):
+            # the header belongs to this connection; a copy, the response may be shared
+            # with other requests, e.g. a cached one
+            response = response.copy()
+            response.update_header(CONNECTION, CLOSE)
+        elif not response.has_header(CONNECTION) and request.heep_alive() and _delimited(request, response):
+            # e.g. upstream responses of the pooled client, a copy as well
+            response = response.copy()
+            response.add_header(CONNECTION, KEEP_ALIVE)
 
-        if request.has_header(b'Set-Cookie'):
-            value, *_ = request.get_header_value(b'Set-Cookie').split(b';', maxsplit=1)
-            response.add_header(b'X-CSRFToken', value)
+        try:
+            # the head ends a response to HEAD, a body would be read as the next response
+            await response.fill(writer, head_only=request.info.method == b'HEAD')
+        finally:
+            if response.body_lease is not None:
+                response.body_lease.release()
+            if response.body_file is not None:
+                response.body_file.release()
+
+        if response.tunnel is not None:
+            # the connection belongs to the upgraded protocol now
+            await response.tunnel.run(reader, writer)
+            writer.close()
+            return request, response
 
-        await response.fill(writer)
+        if body is not None and not body.consumed:
+            await body.discard(LINGERING_TIME)
 
         if not response.heep_alive():
             writer.close()
@@ -64,5 +154,54 @@ class ProxyServer(AbstractAsyncServer):
 
         return request, response
 
-    async def dispatch(self, reader: StreamReader, writer: StreamWriter) -> None:
-        await self.middleware_stack(reader, writer)
+    async def _get_response(
+        self,
+        handler: HandlerCallable,
+        max_body_size: int,
+        request: RawHttpMessage,
+    ) -> RawHttpMessage:
+        """Call the handler within the admission limits, convert errors to responses."""
+        if max_body_size and (body := request.body_stream) is not None:
+            if body.length is None:
+                # chunked, the size is known once it is read
+                body.max_size = max_body_size
+            elif body.length > max_body_size:
+                stats.incr('requests.body_too_large')
+                return await RawHttpMessage.from_bytes(buffer=PayloadTooLarge.as_bytes())
+
+        if not await self.admission.acquire():
+            return self.admission.rejection_message.copy()
+
+        started = time.monotonic()
+        try:
+            return await handler(request)
+        except RequestTimeout as exc:
+            # the request body was not read in time
+            stats.incr(f'timeouts.{exc}')
+            return await RawHttpMessage.from_bytes(buffer=exc.as_bytes())
+        except HTTPException as exc:
+            return await RawHttpMessage.from_bytes(buffer=exc.as_bytes())
+        except ClientDisconnected:
+            raise
+        except Exception as e:
+            self._log.exception(e)
+            return await RawHttpMessage.from_bytes(buffer=InternalServerError.as_bytes())
+        finally:
+            self.admission.release(time.monotonic() - started)
+
+    async def dispatch(self, reader: StreamReader, writer: StreamWriter, dispatcher: AbstractDispatcher) -> None:
+        """Serve requests of the connection until it is closed or not kept alive."""
+        idle_timeout = None
+        try:
+            while not writer.is_closing():
+                request, _ = await self.middleware_stack(reader, writer, dispatcher, idle_timeout)
+                if request is None:
+                    break
+                idle_timeout = self._keepalive_timeout
+        finally:
+            if not writer.is_closing():
+                writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
@@ -0,0 +1,94 @@
+import asyncio
+from asyncio import StreamReader, StreamWriter
+from logging import getLogger
+from typing import Optional
+
+from yapas.core.stats import stats
+from yapas.core.upstream.backend import Backend
+
+logger = getLogger('yapas.tunnel')
+
+TUNNEL_BUFFER_SIZE = 16 * 1024
+# like nginx proxy_read_timeout for upgraded connections
+DEFAULT_TUNNEL_TIMEOUT = 60
+
+
+class Tunnel:
+    """Bidirectional byte pump between a client and an upstream after `101 Switching Protocols`.
+
+    Each direction reads at most TUNNEL_BUFFER_SIZE bytes at a time and waits for
+    the other side to drain them before reading more, so a slow reader slows the
+    sender down instead of growing buffers. The tunnel is closed when either side
+    closes, or when no bytes pass in either direction for `idle_timeout` seconds.
+    """
+    active = 0
+
+    def __init__(
+        self,
+        reader: StreamReader,
+        writer: StreamWriter,
+        backend: Optional[Backend] = None,
+        idle_timeout: Optional[float] = DEFAULT_TUNNEL_TIMEOUT,
+    ) -> None:
+        """
+        :param reader: upstream stream, positioned after the 101 response head
+        :param writer: upstream stream
+        :param backend: upstream backend, the tunnel is counted as its active request
+        :param idle_timeout: max time without bytes in both directions
+        """
+        self._upstream_reader = reader
+        self._upstream_writer = writer
+        self._backend = backend
+        self._idle_timeout = idle_timeout
+        self._last_activity = 0.0
+
+    async def _pump(self, reader: StreamReader, writer: StreamWriter, counter: str) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                async with asyncio.timeout(self._idle_timeout):
+                    data = await reader.read(TUNNEL_BUFFER_SIZE)
+            except TimeoutError:
+                if loop.time() - self._last_activity < self._idle_timeout:
+                    # the other direction is active
+                    continue
+                stats.incr('timeouts.tunnel_idle')
+                return
+
+            if not data:
+                return
+            self._last_activity = loop.time()
+            writer.write(data)
+            await writer.drain()
+            stats.incr(counter, len(data))
+
+    async def run(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Pump bytes between the client streams and the upstream until either side
+        closes or the tunnel is idle. Closes the upstream, not the client."""
+        Tunnel.active += 1
+        if self._backend is not None:
+            self._backend.active += 1
+        self._last_activity = asyncio.get_running_loop().time()
+        for transport in (writer.transport, self._upstream_writer.transport):
+            transport.set_write_buffer_limits(high=TUNNEL_BUFFER_SIZE)
+
+        pumps = [
+            asyncio.create_task(self._pump(reader, self._upstream_writer, 'tunnels.bytes_upstream')),
+            asyncio.create_task(self._pump(self._upstream_reader, writer, 'tunnels.bytes_downstream')),
+        ]
+        try:
+            done, _ = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if (exc := task.exception()) is not None:
+                    logger.debug(f'tunnel closed: {exc!r}')
+        finally:
+            for task in pumps:
+                task.cancel()
+            await asyncio.gather(*pumps, return_exceptions=True)
+            self._upstream_writer.close()
+            if self._backend is not None:
+                self._backend.active -= 1
+            Tunnel.active -= 1
+
+
+stats.gauge('tunnels.active', lambda: Tunnel.active)
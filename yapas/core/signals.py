@@ -19,5 +19,5 @@ async def handle_shutdown(signal_name, server_obj):
 
 
 async def handle_restart(server_obj):
-    """Signal handler for server restart."""
-    await server_obj._start()
+    """Signal handler for configuration reload, the listening socket stays open."""
+    await server_obj.reload()
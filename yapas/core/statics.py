@@ -1,7 +1,8 @@
-import asyncio
 import pathlib
 from functools import partial
 
+from yapas.core.fileio import file_io
+
 
 class AsyncOpener:  # noqa
     """Async version of open"""
@@ -13,13 +14,12 @@ class AsyncOpener:  # noqa
         self._kwargs = kwargs
         self._opened_file = None
 
-        self._loop = asyncio.get_event_loop()
         open_func = partial(open, self._file, self._mode, *self._args, **self._kwargs)
         self._coro = self._coro_factory(open_func)
 
     @property
     def _coro_factory(self):
-        return partial(self._loop.run_in_executor, None)
+        return file_io.run
 
     async def read(self):
         return await self._coro_factory(self._opened_file.read)
@@ -0,0 +1,31 @@
+from collections import defaultdict
+from typing import Callable
+
+
+class Stats:
+    """Process-wide named counters and gauges, shown by the metrics location."""
+
+    def __init__(self) -> None:
+        self.counters: dict[str, int] = defaultdict(int)
+        self._gauges: dict[str, Callable[[], float]] = {}
+
+    def __str__(self):
+        return ' | '.join(f'{name}: {value}' for name, value in self.snapshot().items())
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """Increment a counter."""
+        self.counters[name] += value
+
+    def gauge(self, name: str, getter: Callable[[], float]) -> None:
+        """Register a gauge, getter is called on every snapshot."""
+        self._gauges[name] = getter
+
+    def snapshot(self) -> dict[str, float]:
+        """Return current values of all counters and gauges."""
+        values: dict[str, float] = dict(self.counters)
+        for name, getter in self._gauges.items():
+            values[name] = getter()
+        return dict(sorted(values.items()))
+
+
+stats = Stats()
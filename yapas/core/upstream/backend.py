@@ -0,0 +1,134 @@
+import contextlib
+import time
+from logging import getLogger
+from typing import Optional
+from urllib.parse import urlparse
+
+from yapas.core.constants import UNIX_SOCKET_PREFIX
+
+logger = getLogger('yapas.upstream')
+
+# nginx defaults
+DEFAULT_MAX_FAILS = 1
+DEFAULT_FAIL_TIMEOUT = 10
+# weight share a backend gets right after it comes back
+SLOW_START_MIN_RATIO = 0.1
+
+
+class Backend:
+    """A single upstream server with its health state.
+
+    Passive checks: `max_fails` consecutive failures eject the backend for
+    `fail_timeout` seconds. Active checks (see HealthChecker) mark it down
+    until a probe succeeds. After coming back the backend's weight ramps up
+    linearly for `slow_start` seconds.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        weight: int = 1,
+        max_fails: int = DEFAULT_MAX_FAILS,
+        fail_timeout: float = DEFAULT_FAIL_TIMEOUT,
+        slow_start: float = 0,
+    ) -> None:
+        assert weight > 0, weight
+        parsed = urlparse(url)
+
+        self.url = url
+        if url.startswith(UNIX_SOCKET_PREFIX):
+            self.unix_path: Optional[str] = url.removeprefix(UNIX_SOCKET_PREFIX)
+            self.host, self.port = None, None
+            self.netloc = b'localhost'
+        else:
+            self.unix_path = None
+            self.host = parsed.hostname
+            self.port = parsed.port
+            self.netloc = parsed.netloc.encode()
+        self.weight = weight
+
+        self.max_fails = max_fails
+        self.fail_timeout = fail_timeout
+        self.slow_start = slow_start
+
+        # number of requests being proxied right now
+        self.active = 0
+        # smooth weighted round-robin state, see RoundRobinBalancer
+        self.current_weight = 0
+
+        self.fails = 0
+        self.down = False  # set by active health checks
+        self._ejected_until = 0.0
+        self._recovered_at = 0.0
+
+    def __repr__(self):
+        return f'<Backend {self.url} weight={self.weight} active={self.active}>'
+
+    @classmethod
+    def from_line(cls, line: str) -> 'Backend':
+        """Create a Backend from a config line like
+        `http://localhost:8000 weight=2 max_fails=3 fail_timeout=10 slow_start=30`"""
+        url, *params = line.split()
+        kwargs = {}
+        for param in params:
+            key, _, value = param.partition('=')
+            if key in ('weight', 'max_fails'):
+                kwargs[key] = int(value)
+            elif key in ('fail_timeout', 'slow_start'):
+                kwargs[key] = float(value)
+            else:
+                raise ValueError(f'unknown upstream server parameter {key!r}')
+        return cls(url, **kwargs)
+
+    @property
+    def available(self) -> bool:
+        """Return True if the backend may receive requests."""
+        return not self.down and time.monotonic() >= self._ejected_until
+
+    @property
+    def effective_weight(self) -> float:
+        """Weight used by balancers, reduced during slow start."""
+        if not self.slow_start:
+            return self.weight
+
+        elapsed = time.monotonic() - self._recovered_at
+        if elapsed >= self.slow_start:
+            return self.weight
+        return self.weight * max(elapsed / self.slow_start, SLOW_START_MIN_RATIO)
+
+    def success(self) -> None:
+        """Register a successful request."""
+        self.fails = 0
+
+    def failure(self) -> None:
+        """Register a connect/read failure or timeout, eject on max_fails."""
+        self.fails += 1
+        if self.max_fails and self.fails >= self.max_fails:
+            now = time.monotonic()
+            self._ejected_until = now + self.fail_timeout
+            self._recovered_at = self._ejected_until
+            self.fails = 0
+            logger.warning(f'{self.url} ejected for {self.fail_timeout}s')
+
+    def mark_down(self) -> None:
+        """Take the backend out of rotation until mark_up()."""
+        if not self.down:
+            self.down = True
+            logger.warning(f'{self.url} is down')
+
+    def mark_up(self) -> None:
+        """Return the backend to rotation starting the slow start ramp."""
+        if self.down:
+            self.down = False
+            self.fails = 0
+            self._recovered_at = time.monotonic()
+            logger.info(f'{self.url} is up')
+
+    @contextlib.contextmanager
+    def track(self):
+        """Count the request as active while in the context."""
+        self.active += 1
+        try:
+            yield self
+        finally:
+            self.active -= 1
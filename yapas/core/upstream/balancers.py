@@ -0,0 +1,102 @@
+import bisect
+import hashlib
+import itertools
+from typing import Optional
+
+from yapas.core.abs.balancer import AbstractBalancer
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.constants import EMPTY_BYTES
+from yapas.core.upstream.backend import Backend
+
+# virtual nodes per weight unit on the consistent hash ring
+HASH_POINTS = 160
+
+
+class RoundRobinBalancer(AbstractBalancer):
+    """Smooth weighted round-robin, the same as nginx does.
+
+    With weights 5, 1, 1 the order is a a b a c a a instead of a a a a a b c.
+    """
+
+    def select(self, request: RawHttpMessage) -> Optional[Backend]:
+        total = 0
+        best = None
+        for backend in self._backends:
+            if not backend.available:
+                continue
+            weight = backend.effective_weight
+            backend.current_weight += weight
+            total += weight
+            if best is None or backend.current_weight > best.current_weight:
+                best = backend
+
+        if best is not None:
+            best.current_weight -= total
+        return best
+
+
+class LeastConnectionsBalancer(AbstractBalancer):
+    """Pick the backend with the least active requests relative to its weight.
+
+    Ties are resolved in round-robin order, so idle pools still spread the load.
+    """
+
+    def __init__(self, backends):
+        super().__init__(backends)
+        self._offset = itertools.count()
+
+    def select(self, request: RawHttpMessage) -> Optional[Backend]:
+        backends = self._backends
+        start = next(self._offset) % len(backends)
+
+        best = None
+        best_load = 0.0
+        for i in range(len(backends)):
+            backend = backends[(start + i) % len(backends)]
+            if not backend.available:
+                continue
+            load = backend.active / backend.effective_weight
+            if best is None or load < best_load:
+                best, best_load = backend, load
+
+        return best
+
+
+class HashBalancer(AbstractBalancer):
+    """Consistent hashing (ketama-like ring) by client IP or request path.
+
+    Adding or removing a backend remaps only ~1/N of the keys,
+    keys of an unavailable backend go to the next one on the ring.
+    """
+
+    def __init__(self, backends, key: str = 'client_ip'):
+        super().__init__(backends)
+        if key not in ('client_ip', 'path'):
+            raise ValueError(f'unknown hash key {key!r}')
+        self._key = key
+
+        ring = []
+        for backend in self._backends:
+            for point in range(HASH_POINTS * backend.weight):
+                ring.append((self._hash(b'%s-%d' % (backend.url.encode(), point)), backend))
+        ring.sort(key=lambda item: item[0])
+        self._points = [point for point, _ in ring]
+        self._ring = [backend for _, backend in ring]
+
+    @staticmethod
+    def _hash(value: bytes) -> int:
+        return int.from_bytes(hashlib.md5(value).digest()[:4], 'little')
+
+    def _request_key(self, request: RawHttpMessage) -> bytes:
+        if self._key == 'path':
+            return request.info.path or EMPTY_BYTES
+        return (request.remote_addr or '').encode()
+
+    def select(self, request: RawHttpMessage) -> Optional[Backend]:
+        index = bisect.bisect(self._points, self._hash(self._request_key(request)))
+        ring = self._ring
+        for i in range(len(ring)):
+            backend = ring[(index + i) % len(ring)]
+            if backend.available:
+                return backend
+        return None
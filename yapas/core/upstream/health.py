@@ -0,0 +1,115 @@
+import asyncio
+from configparser import SectionProxy
+from logging import getLogger
+from typing import Optional, Sequence
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.client.socket import SocketClient
+from yapas.core.constants import HOST, CONNECTION
+from yapas.core.exceptions import DispatchException
+from yapas.core.upstream.backend import Backend
+
+logger = getLogger('yapas.upstream.health')
+
+DEFAULT_INTERVAL = 5
+DEFAULT_TIMEOUT = 1
+
+
+class HealthChecker:
+    """Active health checks: probe every backend of a pool on a timer.
+
+    A backend is marked down after `fails` consecutive failed probes and
+    marked up again after `passes` consecutive successful ones. A probe
+    succeeds if the backend answers with a 2xx or 3xx status in time.
+    """
+
+    def __init__(
+        self,
+        backends: Sequence[Backend],
+        path: str,
+        interval: float = DEFAULT_INTERVAL,
+        timeout: float = DEFAULT_TIMEOUT,
+        fails: int = 1,
+        passes: int = 1,
+    ) -> None:
+        self._backends = tuple(backends)
+        self._path = path.encode()
+        self._interval = interval
+        self._timeout = timeout
+        self._fails = fails
+        self._passes = passes
+
+        self._task: Optional[asyncio.Task] = None
+        # consecutive probe results, > 0 for passes and < 0 for fails
+        self._streaks: dict[Backend, int] = {backend: 0 for backend in self._backends}
+
+    @classmethod
+    def from_conf(cls, backends: Sequence[Backend], section: SectionProxy) -> Optional['HealthChecker']:
+        """Create a checker from health_check.* options, None if not configured."""
+        if (path := section.get('health_check.path')) is None:
+            return None
+        return cls(
+            backends,
+            path,
+            interval=section.getfloat('health_check.interval', DEFAULT_INTERVAL),
+            timeout=section.getfloat('health_check.timeout', DEFAULT_TIMEOUT),
+            fails=section.getint('health_check.fails', 1),
+            passes=section.getint('health_check.passes', 1),
+        )
+
+    async def _probe(self, backend: Backend) -> bool:
+        message = RawHttpMessage(
+            b'GET %s HTTP/1.1' % self._path,
+            headers=[[HOST, backend.netloc], [CONNECTION, b'close']],
+        )
+        try:
+            async with asyncio.timeout(self._timeout):
+                response = await SocketClient(base_url=backend.url).raw(message)
+        except (OSError, TimeoutError, DispatchException) as exc:
+            logger.debug(f'{backend.url} probe failed: {exc!r}')
+            return False
+
+        status = response.info.status
+        return status is not None and status[:1] in (b'2', b'3')
+
+    async def check(self) -> None:
+        """Probe all the backends once and update their state."""
+        results = await asyncio.gather(*(self._probe(backend) for backend in self._backends), return_exceptions=True)
+        for backend, ok in zip(self._backends, results):
+            if isinstance(ok, BaseException):
+                # one broken probe must not leave the state of the other backends stale
+                logger.warning(f'{backend.url} probe failed: {ok!r}')
+                ok = False
+            streak = self._streaks[backend]
+            if ok:
+                streak = streak + 1 if streak > 0 else 1
+                if streak >= self._passes:
+                    backend.mark_up()
+            else:
+                streak = streak - 1 if streak < 0 else -1
+                if -streak >= self._fails:
+                    backend.mark_down()
+            self._streaks[backend] = streak
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(self._interval)
+
+    def start(self) -> None:
+        """Start probing in background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name='health-check')
+
+    async def stop(self) -> None:
+        """Stop probing."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,174 @@
+import asyncio
+import collections
+import contextlib
+import time
+from configparser import SectionProxy
+from typing import Optional
+
+from yapas.core.exceptions import ImproperlyConfigured, ServiceUnavailable, BadGateway, GatewayTimeout
+from yapas.core.stats import stats
+
+DEFAULT_QUEUE = 100
+DEFAULT_QUEUE_TIMEOUT = 1.0
+# multiplicative decrease of the adaptive limit
+BACKOFF = 0.9
+# a response this many times slower than the unloaded ones means the upstream is queueing
+LATENCY_TOLERANCE = 2.0
+# the unloaded response time follows the fastest responses, and slower ones with this weight
+BASELINE_ALPHA = 0.01
+
+
+class ConcurrencyLimit:
+    """Max concurrent requests to an upstream with a bounded FIFO wait queue.
+
+    Requests over the limit wait for a slot for at most `queue_timeout`
+    seconds, with more than `queue` requests waiting new ones are rejected
+    right away; both get 503. So a burst of slow requests queues in yapas
+    instead of opening more connections to an overloaded backend.
+
+    With `adaptive` the limit follows the upstream like TCP congestion control
+    (AIMD): it grows by about one per round of responses while the slots are
+    in use, and is cut by BACKOFF on errors, timeouts and responses slower than
+    `latency` seconds (by default LATENCY_TOLERANCE times the unloaded response
+    time), at most once per `latency`. It stays in [min_limit, max_limit].
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_limit: int,
+        queue: int = DEFAULT_QUEUE,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        adaptive: bool = False,
+        min_limit: int = 1,
+        latency: Optional[float] = None,
+    ) -> None:
+        assert max_limit > 0, max_limit
+        self.name = name
+        self._max_limit = max_limit
+        self._min_limit = min(min_limit, max_limit)
+        self._queue = queue
+        self._queue_timeout = queue_timeout
+        self._adaptive = adaptive
+        self._latency = latency
+
+        self.limit: float = max_limit
+        self.in_flight = 0
+        self._waiters: collections.deque[asyncio.Future] = collections.deque()
+        self._baseline: Optional[float] = None
+        self._decreased_at = 0.0
+
+        stats.gauge(f'upstream.{name}.limit', lambda: int(self.limit))
+        stats.gauge(f'upstream.{name}.in_flight', lambda: self.in_flight)
+        stats.gauge(f'upstream.{name}.queued', lambda: len(self._waiters))
+
+    def __str__(self):
+        return f"<ConcurrencyLimit {self.name} limit={self.limit:.1f} in_flight={self.in_flight} queued={len(self._waiters)}>"
+
+    @classmethod
+    def from_conf(cls, name: str, section: SectionProxy) -> Optional['ConcurrencyLimit']:
+        """Create from max_concurrency* options of an upstream, None if there is no limit."""
+        if not (max_limit := section.getint('max_concurrency', 0)):
+            return None
+        if (adaptive := section.get('max_concurrency.adaptive', 'off')) not in ('off', 'aimd'):
+            raise ImproperlyConfigured(f'upstream {name}: only off and aimd adaptive limits are supported')
+        return cls(
+            name,
+            max_limit,
+            queue=section.getint('max_concurrency.queue', DEFAULT_QUEUE),
+            queue_timeout=section.getfloat('max_concurrency.queue_timeout', DEFAULT_QUEUE_TIMEOUT),
+            adaptive=adaptive == 'aimd',
+            min_limit=section.getint('max_concurrency.min', 1),
+            latency=section.getfloat('max_concurrency.latency'),
+        )
+
+    async def acquire(self) -> None:
+        """Take a slot, waiting in the queue if needed.
+
+        :raises ServiceUnavailable: if the queue is full or the wait timed out
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+
+        if len(self._waiters) >= self._queue:
+            stats.incr(f'upstream.{self.name}.rejected')
+            raise ServiceUnavailable()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout(self._queue_timeout):
+                await waiter
+        except TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over right before the deadline
+                return
+            stats.incr(f'upstream.{self.name}.queue_timeouts')
+            raise ServiceUnavailable() from None
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # cancelled after the slot was handed over, pass it on
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(waiter)
+
+    def release(self, latency: Optional[float] = None, failed: bool = False) -> None:
+        """Give the slot back, handing it to the first waiter if the limit allows.
+
+        :param latency: response time of a successful request, adjusts the adaptive limit
+        :param failed: the request failed or timed out, decreases the adaptive limit
+        """
+        if self._adaptive and (failed or latency is not None):
+            self._adapt(latency, failed)
+
+        if self.in_flight <= self.limit:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    def _adapt(self, latency: Optional[float], failed: bool) -> None:
+        if latency is not None:
+            if self._baseline is None or latency < self._baseline:
+                self._baseline = latency
+            else:
+                # drifts up if the upstream got slower for good, e.g. after a deploy
+                self._baseline += BASELINE_ALPHA * (latency - self._baseline)
+        if self._latency is not None:
+            threshold = self._latency
+        else:
+            threshold = (self._baseline or 0) * LATENCY_TOLERANCE
+
+        if failed or latency > threshold:
+            # a burst of slow responses is one signal, not one per response
+            now = time.monotonic()
+            if now - self._decreased_at >= threshold:
+                self._decreased_at = now
+                self.limit = max(self.limit * BACKOFF, self._min_limit)
+                stats.incr(f'upstream.{self.name}.limit_decreases')
+        elif self.in_flight * 2 >= self.limit:
+            # the slots are in use, probe for more
+            self.limit = min(self.limit + 1 / self.limit, self._max_limit)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold a slot for a request, its outcome adjusts the adaptive limit."""
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except (BadGateway, GatewayTimeout):
+            self.release(failed=True)
+            raise
+        except BaseException:
+            # e.g. a cancelled hedge, tells nothing about the upstream
+            self.release()
+            raise
+        self.release(time.monotonic() - started)
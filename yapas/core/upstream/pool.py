@@ -0,0 +1,114 @@
+import contextlib
+from configparser import SectionProxy
+from typing import Collection, Optional, Sequence
+
+from yapas.core.abs.balancer import AbstractBalancer
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.exceptions import ImproperlyConfigured, BadGateway
+from yapas.core.upstream.backend import Backend
+from yapas.core.upstream.balancers import (
+    RoundRobinBalancer,
+    LeastConnectionsBalancer,
+    HashBalancer,
+)
+from yapas.core.upstream.health import HealthChecker
+from yapas.core.upstream.limit import ConcurrencyLimit
+
+_BALANCER_MAPPING: dict[str, type[AbstractBalancer]] = {
+    'round_robin': RoundRobinBalancer,
+    'least_conn': LeastConnectionsBalancer,
+    'hash': HashBalancer,
+}
+
+
+class UpstreamPool:
+    """A named group of backends behind a balancing strategy."""
+
+    def __init__(
+        self,
+        name: str,
+        backends: Sequence[Backend],
+        balancer: AbstractBalancer,
+        health_checker: Optional[HealthChecker] = None,
+        limit: Optional[ConcurrencyLimit] = None,
+    ) -> None:
+        assert backends, name
+        self.name = name
+        self.backends = tuple(backends)
+        self._balancer = balancer
+        self.health_checker = health_checker
+        self.limit = limit
+
+    def __repr__(self):
+        return f'<UpstreamPool {self.name} {list(self.backends)}>'
+
+    @classmethod
+    def single(cls, url: str) -> 'UpstreamPool':
+        """Create a pool with only one backend."""
+        backend = Backend(url)
+        return cls(url, [backend], RoundRobinBalancer([backend]))
+
+    @classmethod
+    def from_conf(cls, name: str, section: SectionProxy) -> 'UpstreamPool':
+        """Create a pool from an [upstream:<name>] config section."""
+        lines = [line for line in section.get('servers', '').splitlines() if line.strip()]
+        if not lines:
+            raise ImproperlyConfigured(f'upstream {name} has no servers')
+        backends = [Backend.from_line(line) for line in lines]
+
+        strategy = section.get('balancer', 'round_robin')
+        try:
+            balancer_cls = _BALANCER_MAPPING[strategy]
+        except KeyError:
+            raise ImproperlyConfigured(
+                f'only {", ".join(_BALANCER_MAPPING.keys())} balancers are supported')
+
+        if balancer_cls is HashBalancer:
+            balancer = balancer_cls(backends, key=section.get('hash_key', 'client_ip'))
+        else:
+            balancer = balancer_cls(backends)
+
+        return cls(
+            name,
+            backends,
+            balancer,
+            HealthChecker.from_conf(backends, section),
+            ConcurrencyLimit.from_conf(name, section),
+        )
+
+    def select(self, request: RawHttpMessage, exclude: Collection[Backend] = ()) -> Backend:
+        """Return a backend for the request.
+
+        :param exclude: backends tried already, e.g. by a retry
+        :raises BadGateway: if every backend is ejected, down or excluded
+        """
+        for _ in range(len(self.backends)):
+            if (backend := self._balancer.select(request)) is None:
+                break
+            if backend not in exclude:
+                return backend
+
+        # the balancer keeps picking excluded ones, e.g. hash or least_conn
+        for backend in self.backends:
+            if backend.available and backend not in exclude:
+                return backend
+        raise BadGateway()
+
+    def slot(self):
+        """Context of a request to the pool, waits for the concurrency limit if any.
+
+        :raises ServiceUnavailable: if the wait queue is full or the wait timed out
+        """
+        if self.limit is None:
+            return contextlib.nullcontext()
+        return self.limit.slot()
+
+    async def startup(self) -> None:
+        """Start active health checks if configured."""
+        if self.health_checker is not None:
+            self.health_checker.start()
+
+    async def cleanup(self) -> None:
+        """Stop active health checks."""
+        if self.health_checker is not None:
+            await self.health_checker.stop()
@@ -0,0 +1,172 @@
+import math
+import time
+from configparser import SectionProxy
+from typing import Optional
+
+from yapas.core.abs.messages import RawHttpMessage
+from yapas.core.exceptions import ImproperlyConfigured, GatewayTimeout
+
+# methods safe to send twice, like nginx non_idempotent excludes POST, LOCK and PATCH
+IDEMPOTENT_METHODS = (b'GET', b'HEAD', b'OPTIONS', b'PUT', b'DELETE', b'TRACE')
+RETRY_CONDITIONS = ('error', 'timeout')
+
+# retries allowed on top of the requests, like the Finagle retry budget
+DEFAULT_BUDGET_RATIO = 0.2
+DEFAULT_BUDGET_MIN_PER_SECOND = 10
+DEFAULT_BUDGET_WINDOW = 10
+DEFAULT_HEDGE_PERCENTILE = 95
+# latencies kept for the hedge delay, it is recomputed every LATENCY_SAMPLES // 16 responses
+LATENCY_SAMPLES = 1024
+LATENCY_MIN_SAMPLES = 32
+
+
+class RetryBudget:
+    """Limit retries and hedges to a share of the requests of the last `window` seconds.
+
+    Every request allows `ratio` extra ones and `min_per_second` are always
+    allowed, so a failing upstream gets at most (1 + ratio) times the load
+    instead of `tries` times.
+    """
+
+    def __init__(
+        self,
+        ratio: float = DEFAULT_BUDGET_RATIO,
+        min_per_second: float = DEFAULT_BUDGET_MIN_PER_SECOND,
+        window: int = DEFAULT_BUDGET_WINDOW,
+    ) -> None:
+        self._ratio = ratio
+        self._reserve = min_per_second * window
+        self._window = window
+        # per second counters in a ring, with the second each slot belongs to
+        self._seconds = [-1] * window
+        self._requests = [0] * window
+        self._retries = [0] * window
+
+    def __str__(self):
+        return f"<RetryBudget requests={sum(self._requests)} retries={sum(self._retries)}>"
+
+    def _slot(self) -> int:
+        second = int(time.monotonic())
+        slot = second % self._window
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._requests[slot] = self._retries[slot] = 0
+        return slot
+
+    def _live(self, counters: list[int]) -> int:
+        oldest = int(time.monotonic()) - self._window
+        return sum(count for second, count in zip(self._seconds, counters) if second > oldest)
+
+    def deposit(self) -> None:
+        """Register a request."""
+        self._requests[self._slot()] += 1
+
+    def withdraw(self) -> bool:
+        """Register a retry if the budget allows it."""
+        slot = self._slot()
+        if self._live(self._retries) + 1 > self._reserve + self._ratio * self._live(self._requests):
+            return False
+        self._retries[slot] += 1
+        return True
+
+
+class LatencyWindow:
+    """Recent upstream response times and a percentile of them."""
+
+    def __init__(self, percentile: float = DEFAULT_HEDGE_PERCENTILE, size: int = LATENCY_SAMPLES) -> None:
+        self._percentile = percentile
+        self._samples: list[float] = []
+        self._size = size
+        self._next = 0
+        self._value: Optional[float] = None
+        self._stale = 0
+
+    def add(self, seconds: float) -> None:
+        if len(self._samples) < self._size:
+            self._samples.append(seconds)
+        else:
+            self._samples[self._next] = seconds
+            self._next = (self._next + 1) % self._size
+        self._stale += 1
+
+    @property
+    def value(self) -> Optional[float]:
+        """Return the percentile, None until there are enough samples."""
+        if len(self._samples) < LATENCY_MIN_SAMPLES:
+            return None
+        if self._value is None or self._stale >= self._size // 16:
+            ordered = sorted(self._samples)
+            self._value = ordered[min(math.ceil(len(ordered) * self._percentile / 100), len(ordered)) - 1]
+            self._stale = 0
+        return self._value
+
+
+class RetryPolicy:
+    """Upstream retries and hedging of a proxy location.
+
+    Failed requests with idempotent methods are sent to another backend up to
+    `tries` times in total, on connection errors and/or timeouts. With hedging
+    a second request goes to another backend if there is no response after
+    `hedge_delay` seconds, or the `hedge_percentile` of recent response times,
+    and the slower one is cancelled. Both take from the retry budget.
+    """
+
+    def __init__(
+        self,
+        tries: int = 1,
+        conditions: tuple[str, ...] = RETRY_CONDITIONS,
+        budget: Optional[RetryBudget] = None,
+        hedge: bool = False,
+        hedge_delay: Optional[float] = None,
+        hedge_percentile: float = DEFAULT_HEDGE_PERCENTILE,
+    ) -> None:
+        self.tries = tries
+        self.conditions = conditions
+        self.budget = budget or RetryBudget()
+        self.hedge = hedge
+        self._hedge_delay = hedge_delay
+        self.latencies = LatencyWindow(hedge_percentile)
+
+    def __str__(self):
+        return f"<RetryPolicy tries={self.tries} hedge={self.hedge} budget={self.budget}>"
+
+    @classmethod
+    def from_conf(cls, section: SectionProxy) -> Optional['RetryPolicy']:
+        """Create from proxy_next_upstream* and proxy_hedge* options, None if both are off."""
+        tries = section.getint('proxy_next_upstream_tries', 1)
+        hedge = section.getboolean('proxy_hedge', False)
+        if tries <= 1 and not hedge:
+            return None
+
+        conditions = tuple(section.get('proxy_next_upstream', ' '.join(RETRY_CONDITIONS)).split())
+        if unknown := set(conditions) - set(RETRY_CONDITIONS):
+            raise ImproperlyConfigured(f'unknown proxy_next_upstream conditions: {", ".join(sorted(unknown))}')
+        return cls(
+            tries=max(tries, 1),
+            conditions=conditions,
+            budget=RetryBudget(
+                ratio=section.getfloat('proxy_retry_budget', DEFAULT_BUDGET_RATIO),
+                min_per_second=section.getfloat('proxy_retry_budget.min_per_second', DEFAULT_BUDGET_MIN_PER_SECOND),
+            ),
+            hedge=hedge,
+            hedge_delay=section.getfloat('proxy_hedge.delay'),
+            hedge_percentile=section.getfloat('proxy_hedge.percentile', DEFAULT_HEDGE_PERCENTILE),
+        )
+
+    @staticmethod
+    def replayable(message: RawHttpMessage) -> bool:
+        """Return True if the request may be sent more than once."""
+        if message.info.method not in IDEMPOTENT_METHODS:
+            return False
+        return message.body_stream is None or message.body_stream.spooled
+
+    def retries_on(self, exc: Exception) -> bool:
+        """Return True if a failed attempt is to be retried, exc is a 502 or 504."""
+        return ('timeout' if isinstance(exc, GatewayTimeout) else 'error') in self.conditions
+
+    @property
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, None if there are not enough samples yet."""
+        if self._hedge_delay is not None:
+            return self._hedge_delay
+        return self.latencies.value